@@ -0,0 +1,583 @@
+"""
+Asynchronous email processing via aioimaplib, with concurrent IMAP commands on one connection.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import List, Dict, Tuple, Optional, Any
+
+try:
+    import aioimaplib
+except ImportError:
+    aioimaplib = None
+
+from category_registry import CATEGORIES
+from email_processor import EmailProcessor, MAX_FETCH_BATCH, _UIDVALIDITY_RE, save_uid_state
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Maximum number of UID FETCH commands in flight on one connection
+MAX_IN_FLIGHT_FETCHES = 8
+
+
+class AsyncEmailProcessor(EmailProcessor):
+    """
+    Email processor that issues IMAP commands asynchronously, so the fetches and moves of
+    a batch are pipelined on one connection instead of waiting a full round trip each.
+    Messages are addressed by UID, which, unlike sequence numbers, stay valid while other
+    messages of the batch are moved. Requires the optional 'aioimaplib' package.
+    """
+
+    uses_async_session = True
+
+    def __init__(self):
+        """
+        Initialize the async email processor with configuration from config.py.
+        
+        Raises:
+            ImportError: If 'aioimaplib' is not installed.
+        """
+        if aioimaplib is None:
+            raise ImportError("The 'aioimaplib' package is required for the async email processor")
+        
+        super().__init__()
+        self.aconnection = None
+        self._fetch_slots = None
+        # UIDs of the current batch to mark as processed / flag as deleted, see aflush_flags()
+        self._pending_processed: List[str] = []
+        self._pending_deleted: List[str] = []
+
+    async def aconnect(self) -> bool:
+        """
+        Establish a connection to the IMAP server.
+        
+        Returns:
+            bool: True if connection was successful, False otherwise.
+        """
+        try:
+            if self.use_ssl:
+                logger.debug("Attempting to connect with SSL")
+                self.aconnection = aioimaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+            else:
+                logger.debug("Attempting to connect without SSL")
+                self.aconnection = aioimaplib.IMAP4(self.imap_server, self.imap_port)
+            self._fetch_slots = asyncio.Semaphore(MAX_IN_FLIGHT_FETCHES)
+            await self.aconnection.wait_hello_from_server()
+            
+            # Login to the server
+            response = await self.aconnection.login(self.username, self.password)
+            if response.result != 'OK':
+                logger.error(f"Failed to login to IMAP server: {response.lines}")
+                return False
+            
+            logger.info(f"Successfully connected to {self.imap_server}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to IMAP server: {e}")
+            return False
+
+    async def adisconnect(self) -> None:
+        """Close the connection to the IMAP server and save the UID state file."""
+        save_uid_state()
+        if self.aconnection:
+            try:
+                await self.aconnection.logout()
+                logger.info("Disconnected from IMAP server")
+            except Exception as e:
+                logger.error(f"Error during IMAP logout: {e}")
+            finally:
+                self.aconnection = None
+
+    async def aget_folders(self) -> List[str]:
+        """
+        Get a list of all folders in the mailbox.
+        
+        Returns:
+            List[str]: List of folder names.
+        """
+        try:
+            response = await self.aconnection.list('""', '*')
+            if response.result != 'OK':
+                logger.error(f"Failed to get folders: {response.result}")
+                return []
+            
+            # The last line is the status text of the command
+            folder_list = self._parse_folder_list(response.lines[:-1])
+            self._folder_cache = (time.monotonic(), folder_list, {folder.lower(): folder for folder in folder_list})
+            logger.info(f"Detected folders: {folder_list}")
+            return folder_list
+        except Exception as e:
+            logger.error(f"Error getting folders: {e}")
+            return []
+
+    async def afolder_exists(self, folder_name: str, folders: Optional[List[str]] = None) -> bool:
+        """
+        Check if a folder exists in the folder list.
+        
+        Args:
+            folder_name: Name of the folder to check.
+            folders: Optional folder list, to avoid listing the folders again.
+        
+        Returns:
+            bool: True if the folder exists, False otherwise.
+        """
+        if folders is None:
+            folders = await self.aget_folders()
+        
+        found = self._find_folder(folder_name, folders)
+        if found:
+            logger.info(f"Folder '{folder_name}' exists as '{found}'")
+            return True
+        
+        logger.warning(f"Folder '{folder_name}' does not exist")
+        return False
+
+    async def aselect_folder(self, folder_name: str) -> int:
+        """
+        Select a folder to work with.
+        
+        Args:
+            folder_name: Name of the folder to select.
+        
+        Returns:
+            int: Number of messages in the folder, or -1 if selection failed.
+        """
+        folders = self._folder_cache[2] if self._folder_cache else await self.aget_folders()
+        try:
+            mailbox = self._quote(self._canonical(folder_name, folders))
+            response = await self.aconnection.select(mailbox)
+            if response.result == 'OK':
+                self._selected_folder = mailbox
+                self._uidvalidity = None
+                message_count = 0
+                for line in response.lines:
+                    if not isinstance(line, bytes):
+                        continue
+                    if line.endswith(b' EXISTS'):
+                        message_count = int(line.split()[0])
+                    match = _UIDVALIDITY_RE.search(line)
+                    if match:
+                        self._uidvalidity = int(match.group(1))
+                logger.info(f"Selected folder {folder_name} with {message_count} messages")
+                return message_count
+            logger.error(f"Failed to select folder {folder_name}: {response.lines}")
+        except Exception as e:
+            logger.error(f"Error selecting folder {folder_name}: {e}")
+        
+        return -1
+
+    async def asearch_emails(self, criteria: str = 'ALL') -> List[str]:
+        """
+        Search for emails matching the given criteria.
+        
+        Args:
+            criteria: IMAP search criteria (default: 'ALL').
+        
+        Returns:
+            List[str]: List of email UIDs matching the criteria.
+        """
+        return await self._asearch(criteria) or []
+
+    async def _asearch(self, criteria: str) -> Optional[List[str]]:
+        """
+        Search for emails matching the given criteria.
+        
+        Args:
+            criteria: IMAP search criteria.
+        
+        Returns:
+            Optional[List[str]]: List of email UIDs matching the criteria, or None if the search failed.
+        """
+        try:
+            response = await self.aconnection.uid_search(criteria)
+            if response.result != 'OK':
+                logger.error(f"Search failed: {response.lines}")
+                return None
+            
+            return response.lines[0].decode('utf-8').split()
+        except Exception as e:
+            logger.error(f"Error searching emails: {e}")
+            return None
+
+    async def aget_unprocessed_emails(self, folder_name: str, limit: int = None) -> List[str]:
+        """
+        Get a list of unprocessed email UIDs from the specified folder.
+        
+        Args:
+            folder_name: Name of the folder to search in.
+            limit: Maximum number of emails to return.
+        
+        Returns:
+            List[str]: List of unprocessed email UIDs.
+        """
+        if await self.aselect_folder(folder_name) <= 0:
+            return []
+        
+        if not self.skip_processed:
+            email_ids = await self.asearch_emails('ALL')
+        else:
+            # Only search emails above the highest UID processed by earlier runs
+            high_water_uid = self._high_water_uid()
+            uid_range = f'UID {high_water_uid + 1}:* ' if high_water_uid else ''
+            
+            email_ids = await self._asearch(f'{uid_range}UNDELETED UNKEYWORD PROCESSED')
+            if email_ids is None:
+                logger.warning("Failed to search with UNKEYWORD criteria, searching by UID only")
+                email_ids = await self.asearch_emails(f'{uid_range}UNDELETED')
+            
+            # n:* always matches the newest email, even when its UID is below n
+            if high_water_uid:
+                email_ids = [eid for eid in email_ids if int(eid) > high_water_uid]
+        
+        # Apply limit if specified
+        if limit and len(email_ids) > limit:
+            email_ids = email_ids[:limit]
+        
+        self._remember_search(email_ids)
+        return email_ids
+
+    async def _afetch_chunk(self, chunk: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetch and parse the emails of one message set.
+        
+        The sizes, and unless attachments are needed the BODYSTRUCTURE, are fetched first, so
+        emails over the size limit are skipped and only the start of each email's text part is
+        downloaded (see fetch_emails_bulk). Skipped emails are queued to be marked as processed.
+        
+        Args:
+            chunk: UIDs of the emails to fetch.
+        
+        Returns:
+            List[Dict[str, Any]]: Parsed email data, for every email that could be fetched.
+        """
+        structures = await self._afetch_items(chunk, self._probe_items())
+        oversized: List[str] = []
+        plans = list(self._plan_fetches(chunk, structures, oversized).items())
+        if oversized:
+            self._pending_processed.extend(oversized)
+        responses = await asyncio.gather(*[self._afetch_items(uids, items) for items, (uids, _, _) in plans])
+        
+        emails = []
+        for (_, (_, parts, sizes)), messages in zip(plans, responses):
+            for message in messages or []:
+                email_id = message['uid']
+                if email_id not in sizes:
+                    continue
+                
+                raw_email = self._raw_fetched(message, parts.get(email_id))
+                email_data = self._parse_email(email_id, raw_email, sizes[email_id] or message['size'])
+                if email_data:
+                    emails.append(email_data)
+        return emails
+
+    async def _afetch_items(self, chunk: List[str], items: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Fetch data items of the emails of one message set.
+        
+        Args:
+            chunk: UIDs of the emails to fetch.
+            items: FETCH data items, without the enclosing parentheses.
+        
+        Returns:
+            Optional[List[Dict[str, Any]]]: The messages of the response (see _group_fetch_response),
+            or None if the command failed.
+        """
+        try:
+            # Pipelining more commands only grows the server's queue and the buffered responses
+            async with self._fetch_slots:
+                response = await self.aconnection.uid('fetch', ','.join(chunk), f'(UID {items})')
+            if response.result != 'OK':
+                logger.error(f"Failed to fetch emails {','.join(chunk)}: {response.lines}")
+                return None
+        except Exception as e:
+            logger.error(f"Error fetching emails {','.join(chunk)}: {e}")
+            return None
+        
+        # Literals are returned as bytearray lines following the line that announces them
+        lines = response.lines
+        pieces = []
+        for i, line in enumerate(lines):
+            if isinstance(line, bytearray):
+                continue
+            literal = lines[i + 1] if i + 1 < len(lines) and isinstance(lines[i + 1], bytearray) else None
+            pieces.append((line, literal))
+        
+        return self._group_fetch_response(pieces)
+
+    async def afetch_emails_bulk(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetch and parse several emails, pipelining one UID FETCH command per chunk of IDs.
+        
+        Args:
+            email_ids: UIDs of the emails to fetch.
+        
+        Returns:
+            List[Dict[str, Any]]: Parsed email data, for every email that could be fetched.
+        """
+        chunk_size = max(1, min(self.batch_size, MAX_FETCH_BATCH))
+        chunks = [email_ids[i:i + chunk_size] for i in range(0, len(email_ids), chunk_size)]
+        
+        results = await asyncio.gather(*[self._afetch_chunk(chunk) for chunk in chunks])
+        return [email_data for emails in results for email_data in emails]
+
+    async def amark_as_processed(self, email_id: str) -> bool:
+        """
+        Mark an email as processed by adding a custom flag.
+        
+        Args:
+            email_id: UID of the email to mark, or a comma-separated UID set.
+        
+        Returns:
+            bool: True if marking was successful, False otherwise.
+        """
+        try:
+            response = await self.aconnection.uid('store', email_id, '+FLAGS.SILENT', '(PROCESSED)')
+            if response.result == 'OK':
+                logger.info(f"Marked email {email_id} as processed")
+                self._advance_high_water_uid(email_id)
+                return True
+            
+            logger.error(f"Failed to mark email {email_id} as processed: {response.lines}")
+            return False
+        except Exception as e:
+            logger.error(f"Error marking email as processed: {e}")
+            return False
+
+    async def amove_email(self, email_id: str, destination_folder: str) -> bool:
+        """
+        Move an email from the selected folder to another one.
+        
+        Without MOVE support the email is copied and queued to be flagged as deleted; the caller
+        flags the whole batch (see aflush_flags()) and expunges the folder once it has been moved.
+        
+        Args:
+            email_id: UID of the email to move.
+            destination_folder: Destination folder name.
+        
+        Returns:
+            bool: True if the move was successful, False otherwise.
+        """
+        mailbox = self._quote(self._canonical(destination_folder, self._folder_cache[2] if self._folder_cache else []))
+        try:
+            if self.aconnection.has_capability('MOVE'):
+                response = await self.aconnection.uid('move', email_id, mailbox)
+                if response.result == 'OK':
+                    logger.info(f"Successfully moved email {email_id} to {destination_folder} using MOVE command")
+                    self._advance_high_water_uid(email_id)
+                    return True
+                logger.debug(f"MOVE command failed: {response.lines}")
+            
+            # Fall back to copy+delete method
+            response = await self.aconnection.uid('copy', email_id, mailbox)
+            if response.result != 'OK':
+                logger.error(f"Failed to copy email {email_id} to {destination_folder}: {response.lines}")
+                return False
+            self._advance_high_water_uid(email_id)
+            self._pending_deleted.append(email_id)
+            
+            logger.info(f"Successfully copied email {email_id} to {destination_folder}")
+            return True
+        except Exception as e:
+            logger.error(f"Error moving email {email_id}: {e}")
+            return False
+
+    async def aroute_email(self, email_data: Dict[str, Any], category_idx: Optional[int],
+                           category_folders: Tuple[str, ...], dry_run: bool,
+                           folder_exists_cache: Dict[str, bool]) -> bool:
+        """
+        Move a classified email to the folder of its category, or queue it to be marked as processed.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            category_idx: Index of the email's category, or None if it could not be classified.
+            category_folders: Destination folder of each category index.
+            dry_run: Whether emails should only be classified and marked as processed.
+            folder_exists_cache: Whether each destination folder exists, by folder name.
+        
+        Returns:
+            bool: True if the email was successfully categorized, False otherwise.
+        """
+        email_id = email_data['id']
+        
+        if category_idx is None:
+            logger.warning(f"No category for email {email_id}")
+            self._pending_processed.append(email_id)
+            return False
+        
+        destination_folder = category_folders[category_idx]
+        if dry_run or not folder_exists_cache.get(destination_folder, False):
+            dry_run_reason = "DRY RUN mode" if dry_run else f"folder '{destination_folder}' does not exist"
+            logger.info(f"[{dry_run_reason}] Email {email_id} - Subject: '{email_data.get('subject', '')}' - "
+                       f"From: '{email_data.get('sender', '')}' would be moved to {destination_folder}")
+            self._pending_processed.append(email_id)
+            return True
+        
+        if await self.amove_email(email_id, destination_folder):
+            return True
+        
+        # If move fails, at least mark as processed
+        logger.warning(f"Failed to move email to {destination_folder}, marking as processed only")
+        self._pending_processed.append(email_id)
+        return False
+
+    async def aflush_flags(self) -> None:
+        """
+        Flag the emails aroute_email() copied as deleted and mark the ones it didn't move as
+        processed, with one STORE each for the whole batch.
+        """
+        deleted, self._pending_deleted = self._pending_deleted, []
+        if deleted:
+            uid_set = ','.join(deleted)
+            try:
+                response = await self.aconnection.uid('store', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+                if response.result == 'OK':
+                    self._pending_expunge.extend(deleted)
+                else:
+                    # Even if deletion fails, we've at least copied the emails
+                    logger.error(f"Failed to mark emails {uid_set} for deletion: {response.lines}")
+                    self._pending_processed.extend(deleted)
+            except Exception as e:
+                logger.error(f"Error marking emails {uid_set} for deletion: {e}")
+                self._pending_processed.extend(deleted)
+        
+        processed, self._pending_processed = self._pending_processed, []
+        if processed:
+            await self.amark_as_processed(','.join(processed))
+
+    async def aexpunge_pending(self) -> None:
+        """
+        Expunge the emails aflush_flags() flagged as deleted, with one command.
+        
+        UID EXPUNGE (UIDPLUS) leaves emails flagged as deleted by other clients alone.
+        """
+        pending, self._pending_expunge = self._pending_expunge, []
+        if not pending:
+            return
+        
+        try:
+            if self.aconnection.has_capability('UIDPLUS'):
+                response = await self.aconnection.uid('expunge', ','.join(pending))
+            else:
+                response = await self.aconnection.expunge()
+            if response.result != 'OK':
+                logger.error(f"Failed to expunge mailbox: {response.lines}")
+        except Exception as e:
+            logger.error(f"Error expunging mailbox: {e}")
+
+    async def aprocess_emails(self, processor_func, category_folders: Tuple[str, ...]) -> Tuple[int, int]:
+        """
+        Process emails from configured folders using the provided processor function.
+        
+        The fetches and moves of each batch are issued concurrently on the connection.
+        
+        Args:
+            processor_func: Function that takes a list of email dicts and returns a list with
+                the category index of each email (or None), in the same order. If it has a
+                `needs` attribute, only the email data fields listed there are fetched and parsed.
+            category_folders: Destination folder of each category index.
+        
+        Returns:
+            Tuple[int, int]: (Number of emails processed, number of emails successfully categorized)
+        """
+        if not await self.aconnect():
+            return 0, 0
+        self._set_needs(processor_func)
+        
+        processed_count = 0
+        success_count = 0
+        loop = asyncio.get_running_loop()
+        
+        # Check if we're in dry run mode (don't move emails, just classify)
+        dry_run = os.environ.get('DRY_RUN', 'false').lower() == 'true'
+        if dry_run:
+            logger.info("Running in DRY RUN mode - emails will be classified but not moved")
+        
+        try:
+            # Verify that destination folders exist
+            folders = await self.aget_folders()
+            folder_exists_cache = {}
+            for category, folder_name in CATEGORIES.folders().items():
+                folder_exists_cache[folder_name] = await self.afolder_exists(folder_name, folders)
+                if not folder_exists_cache[folder_name]:
+                    logger.warning(f"Destination folder '{folder_name}' for category '{category}' does not exist.")
+                    logger.warning(f"Please create it manually in Proton Mail or emails will be classified but not moved.")
+            
+            for folder in self.folders_to_process:
+                logger.info(f"Processing folder: {folder}")
+                
+                remaining = self.max_emails_per_run - processed_count
+                if remaining <= 0:
+                    break
+                
+                email_ids = await self.aget_unprocessed_emails(folder, limit=remaining)
+                logger.info(f"Found {len(email_ids)} unprocessed emails in {folder}")
+                
+                # Emails classified by an earlier run skip fetching and classification
+                known, email_ids = self.split_known_routes(email_ids, category_folders)
+                # (emails or UIDs, category indices if already known) per batch
+                batches = [([email_data for email_data, _ in known[i:i + self.batch_size]],
+                            [category_idx for _, category_idx in known[i:i + self.batch_size]])
+                           for i in range(0, len(known), self.batch_size)]
+                batches.extend((email_ids[i:i + self.batch_size], None) for i in range(0, len(email_ids), self.batch_size))
+                
+                for batch, category_indices in batches:
+                    batch_start = loop.time()
+                    if category_indices is not None:
+                        batch_emails = batch
+                    else:
+                        batch_emails = await self.afetch_emails_bulk(batch)
+                        if not batch_emails:
+                            # Mark the emails skipped for their size
+                            await self.aflush_flags()
+                            continue
+                        
+                        try:
+                            # The classifier is synchronous, keep the event loop free while it runs
+                            category_indices = await loop.run_in_executor(None, processor_func, batch_emails)
+                        except Exception as e:
+                            logger.error(f"Error classifying batch of {len(batch_emails)} emails: {e}")
+                            category_indices = [None] * len(batch_emails)
+                        self._record_routes(zip(batch_emails, category_indices), category_folders)
+                    
+                    processed_count += len(batch_emails)
+                    
+                    results = await asyncio.gather(
+                        *[self.aroute_email(email_data, category_idx, category_folders, dry_run, folder_exists_cache)
+                          for email_data, category_idx in zip(batch_emails, category_indices)],
+                        return_exceptions=True
+                    )
+                    for email_data, result in zip(batch_emails, results):
+                        if isinstance(result, Exception):
+                            logger.error(f"Error processing email {email_data['id']}: {result}")
+                        elif result:
+                            success_count += 1
+                    
+                    await self.aflush_flags()
+                    
+                    # Remove the emails that were copied and flagged as deleted
+                    await self.aexpunge_pending()
+                    
+                    # Only wait if the server answered faster than the minimum batch interval
+                    delay = self.min_batch_interval - (loop.time() - batch_start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+        finally:
+            await self.adisconnect()
+        
+        return processed_count, success_count
+
+    def process_emails(self, processor_func, category_folders: Tuple[str, ...]) -> Tuple[int, int]:
+        """
+        Process emails from configured folders using the provided processor function.
+        
+        Args:
+            processor_func: Function that takes a list of email dicts and returns a list with
+                the category index of each email (or None), in the same order.
+            category_folders: Destination folder of each category index.
+        
+        Returns:
+            Tuple[int, int]: (Number of emails processed, number of emails successfully categorized)
+        """
+        return asyncio.run(self.aprocess_emails(processor_func, category_folders))
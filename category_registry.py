@@ -0,0 +1,148 @@
+"""
+Shared registry of the email categories and their destination folders.
+"""
+import logging
+import threading
+import weakref
+from typing import Callable, Dict, List, Optional
+
+from config import EMAIL_CATEGORIES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Category that unclassifiable emails fall back to, it can't be removed
+FALLBACK_CATEGORY = 'requires_manual_intervention'
+
+
+class CategoryRegistry:
+    """
+    Thread-safe mapping of category names to destination folders.
+    
+    The registry owns the EMAIL_CATEGORIES dictionary and updates it in place; read it through
+    folders(), which takes a snapshot under the lock, rather than iterating it directly. Listeners
+    registered with on_change are notified of every change, so the classifier and the folder
+    manager never drift apart.
+    """
+
+    def __init__(self, folders: Dict[str, str]):
+        """
+        Initialize the registry.
+        
+        Args:
+            folders: Dictionary of category names to folder names, updated in place.
+        """
+        self._folders = folders
+        self._lock = threading.Lock()
+        self._listeners: List[weakref.ref] = []
+
+    def folders(self) -> Dict[str, str]:
+        """
+        Get a snapshot of the categories.
+        
+        Returns:
+            Dict[str, str]: Dictionary of category names to folder names, in configuration order.
+        """
+        with self._lock:
+            return dict(self._folders)
+
+    def get(self, category: str) -> Optional[str]:
+        """
+        Get the folder of a category.
+        
+        Args:
+            category: Category name.
+            
+        Returns:
+            Optional[str]: Folder name for the category, or None if the category doesn't exist.
+        """
+        return self._folders.get(category)
+
+    def __contains__(self, category: str) -> bool:
+        """Return True if the category exists."""
+        return category in self._folders
+
+    def on_change(self, callback: Callable[[], None]) -> None:
+        """
+        Register a function to call after the categories changed.
+        
+        Bound methods are held weakly, so registering does not keep their object alive.
+        
+        Args:
+            callback: Function without arguments.
+        """
+        ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+        with self._lock:
+            self._listeners.append(ref)
+
+    def _notify(self) -> None:
+        """Call the live listeners, dropping the ones whose object was garbage collected."""
+        with self._lock:
+            self._listeners = [ref for ref in self._listeners if ref() is not None]
+            callbacks = [ref() for ref in self._listeners]
+        for callback in callbacks:
+            if callback is not None:
+                callback()
+
+    def add(self, category: str, folder_name: str) -> bool:
+        """
+        Add a category.
+        
+        Args:
+            category: Category name.
+            folder_name: Folder name.
+            
+        Returns:
+            bool: True if the category was added, False if it already exists.
+        """
+        with self._lock:
+            if category in self._folders:
+                logger.warning("Category '%s' already exists", category)
+                return False
+            self._folders[category] = folder_name
+        self._notify()
+        return True
+
+    def update(self, category: str, folder_name: str) -> bool:
+        """
+        Change the folder of a category.
+        
+        Args:
+            category: Category name.
+            folder_name: New folder name.
+            
+        Returns:
+            bool: True if the category was updated, False if it doesn't exist.
+        """
+        with self._lock:
+            if category not in self._folders:
+                logger.warning("Category '%s' does not exist", category)
+                return False
+            self._folders[category] = folder_name
+        self._notify()
+        return True
+
+    def remove(self, category: str) -> bool:
+        """
+        Remove a category.
+        
+        Args:
+            category: Category name.
+            
+        Returns:
+            bool: True if the category was removed, False if it doesn't exist or can't be removed.
+        """
+        with self._lock:
+            if category not in self._folders:
+                logger.warning("Category '%s' does not exist", category)
+                return False
+            if category == FALLBACK_CATEGORY:
+                logger.error("Cannot remove the '%s' category", FALLBACK_CATEGORY)
+                return False
+            del self._folders[category]
+        self._notify()
+        return True
+
+
+# Registry shared by the whole process
+CATEGORIES = CategoryRegistry(EMAIL_CATEGORIES)
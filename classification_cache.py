@@ -0,0 +1,299 @@
+"""
+Persistent caches of email classifications, keyed by a hash of the email content or by UID.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Reply and forward prefixes, and numbers such as build, ticket or order numbers, which differ
+# between otherwise identical notifications
+_SUBJECT_PREFIX_RE = re.compile(r'^(?:\s*(?:re|fwd?|aw|wg)\s*(?:\[\d+\])?\s*:)+', re.IGNORECASE)
+_SUBJECT_NUMBER_RE = re.compile(r'\d+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Local parts of addresses that send automated emails, e.g. no-reply@, notifications@, alerts@
+_AUTOMATED_SENDER_RE = re.compile(
+    r'(?:^|[<\s"])(?:no[-_.]?reply|do[-_.]?not[-_.]?reply|notifications?|alerts?|mailer[-_.]daemon|bounces?)[^@\s]*@',
+    re.IGNORECASE
+)
+
+# Number of stores between checks of the maximum number of entries
+TRIM_INTERVAL = 500
+
+
+def is_automated(email_data: Dict[str, Any]) -> bool:
+    """
+    Check whether an email looks automated: sent by a mailing list or a no-reply style address.
+    
+    Args:
+        email_data: Dictionary containing email data.
+        
+    Returns:
+        bool: True if the email has a List-Unsubscribe header or an automated sender address.
+    """
+    return bool(email_data.get('list_unsubscribe')) or bool(_AUTOMATED_SENDER_RE.search(email_data.get('sender', '')))
+
+
+def normalize_subject(subject: str) -> str:
+    """
+    Normalize a subject so that repeated notifications of the same kind compare equal.
+    
+    Args:
+        subject: Email subject.
+        
+    Returns:
+        str: Lowercase subject without reply/forward prefixes, with numbers replaced by '#'.
+    """
+    subject = _SUBJECT_PREFIX_RE.sub('', subject)
+    subject = _SUBJECT_NUMBER_RE.sub('#', subject)
+    return _WHITESPACE_RE.sub(' ', subject).strip().lower()
+
+
+class ClassificationCache:
+    """
+    Stores the category of previously classified emails in a SQLite database so that
+    repeated emails (newsletters, recurring bills) do not need another LLM request.
+    """
+
+    def __init__(self, cache_dir: str, ttl_days: int, max_entries: int = 0):
+        """
+        Initialize the classification cache.
+        
+        Args:
+            cache_dir: Directory where the cache database is stored.
+            ttl_days: Number of days a cached classification stays valid.
+            max_entries: Maximum number of entries kept, the oldest are dropped first (0 for no limit).
+        """
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self._stores = 0
+        self._lock = threading.Lock()
+        
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        
+        self.db_path = os.path.join(cache_dir, 'classifications.db')
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS classifications ('
+                'key TEXT PRIMARY KEY, category TEXT NOT NULL, ts INTEGER NOT NULL)'
+            )
+            # Drop expired entries so the database does not grow without bound
+            self._db.execute('DELETE FROM classifications WHERE ts < ?', (self._cutoff(),))
+            self._trim()
+
+    def _cutoff(self) -> int:
+        """
+        Get the oldest timestamp that is still considered valid.
+        
+        Returns:
+            int: Unix timestamp.
+        """
+        return int(time.time()) - self.ttl_seconds
+
+    def _trim(self) -> None:
+        """Drop the oldest entries beyond max_entries. Must be called with the lock held."""
+        if self.max_entries > 0:
+            self._db.execute(
+                'DELETE FROM classifications WHERE key NOT IN '
+                '(SELECT key FROM classifications ORDER BY ts DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+
+    @staticmethod
+    def make_key(email_data: Dict[str, Any], categories: List[str]) -> str:
+        """
+        Build the cache key for an email.
+        
+        The key covers the sender, subject and the start of the body, plus the set of
+        categories, so changing the categories invalidates previous classifications.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            categories: List of category names.
+            
+        Returns:
+            str: Hex digest identifying the email content.
+        """
+        sender = email_data.get('sender', '')
+        subject = email_data.get('subject', '')
+        body = email_data.get('body', '')[:2048]
+        categories_str = ','.join(sorted(categories))
+        
+        content = f"{categories_str}\0{sender}\0{subject}\0{body}"
+        return hashlib.blake2b(content.encode('utf-8', errors='replace'), digest_size=16).hexdigest()
+
+    @staticmethod
+    def make_sender_key(email_data: Dict[str, Any], categories: List[str]) -> str:
+        """
+        Build the cache key shared by the emails of one sender with the same normalized subject.
+        
+        Mailing lists, notifications and alerts send many emails that only differ in their body
+        or in numbers in the subject, and nearly always belong to the same category. Only use it
+        for emails for which is_automated() is True, personal emails with generic subjects don't.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            categories: List of category names.
+            
+        Returns:
+            str: Hex digest identifying the sender and subject.
+        """
+        sender = email_data.get('sender', '').strip().lower()
+        subject = normalize_subject(email_data.get('subject', ''))
+        categories_str = ','.join(sorted(categories))
+        
+        content = f"{categories_str}\0sender\0{sender}\0{subject}"
+        return hashlib.blake2b(content.encode('utf-8', errors='replace'), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached classification.
+        
+        Args:
+            key: Cache key from make_key.
+            
+        Returns:
+            Optional[str]: The cached category, or None if missing or expired.
+        """
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    'SELECT category FROM classifications WHERE key = ? AND ts >= ?',
+                    (key, self._cutoff())
+                ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error reading classification cache: {e}")
+            return None
+
+    def set(self, key: str, category: str) -> None:
+        """
+        Store a classification in the cache.
+        
+        Args:
+            key: Cache key from make_key.
+            category: Category of the email.
+        """
+        self.set_many([key], category)
+
+    def set_many(self, keys: List[str], category: str) -> None:
+        """
+        Store a classification in the cache under several keys.
+        
+        Args:
+            keys: Cache keys from make_key or make_sender_key.
+            category: Category of the email.
+        """
+        now = int(time.time())
+        try:
+            with self._lock, self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO classifications (key, category, ts) VALUES (?, ?, ?)',
+                    [(key, category, now) for key in keys]
+                )
+                self._stores += 1
+                if self._stores % TRIM_INTERVAL == 0:
+                    self._trim()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing classification cache: {e}")
+
+
+class RoutedEmailCache:
+    """
+    Stores the destination folder of classified emails by mailbox and UID in a SQLite database,
+    so emails that are still in their folder on a later run (e.g. because moving them or setting
+    the processed flag failed) are routed again without being fetched or classified.
+    """
+
+    def __init__(self, cache_dir: str, ttl_days: int):
+        """
+        Initialize the routed email cache.
+        
+        Args:
+            cache_dir: Directory where the cache database is stored.
+            ttl_days: Number of days a cached destination stays valid.
+        """
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        
+        self.db_path = os.path.join(cache_dir, 'routed.db')
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS routed ('
+                'mailbox TEXT NOT NULL, uid INTEGER NOT NULL, folder TEXT NOT NULL, ts INTEGER NOT NULL, '
+                'PRIMARY KEY (mailbox, uid))'
+            )
+            # Drop expired entries so the database does not grow without bound
+            self._db.execute('DELETE FROM routed WHERE ts < ?', (self._cutoff(),))
+
+    def _cutoff(self) -> int:
+        """
+        Get the oldest timestamp that is still considered valid.
+        
+        Returns:
+            int: Unix timestamp.
+        """
+        return int(time.time()) - self.ttl_seconds
+
+    def get_many(self, mailbox: str, uids: List[str]) -> Dict[str, str]:
+        """
+        Look up the cached destination folders of several emails.
+        
+        Args:
+            mailbox: Key identifying the account, folder and UIDVALIDITY the UIDs belong to.
+            uids: UIDs of the emails.
+            
+        Returns:
+            Dict[str, str]: Destination folder by UID, for the emails that are cached.
+        """
+        found = {}
+        try:
+            with self._lock:
+                # Stay below SQLite's limit on the number of query parameters
+                for i in range(0, len(uids), 500):
+                    chunk = uids[i:i + 500]
+                    rows = self._db.execute(
+                        f"SELECT uid, folder FROM routed WHERE mailbox = ? AND ts >= ? "
+                        f"AND uid IN ({','.join('?' * len(chunk))})",
+                        (mailbox, self._cutoff(), *[int(uid) for uid in chunk])
+                    ).fetchall()
+                    found.update((str(uid), folder) for uid, folder in rows)
+        except sqlite3.Error as e:
+            logger.error(f"Error reading routed email cache: {e}")
+        return found
+
+    def set_many(self, mailbox: str, routes: List[Tuple[str, str]]) -> None:
+        """
+        Store the destination folders of several emails.
+        
+        Args:
+            mailbox: Key identifying the account, folder and UIDVALIDITY the UIDs belong to.
+            routes: (UID, destination folder) pairs.
+        """
+        if not routes:
+            return
+        
+        now = int(time.time())
+        try:
+            with self._lock, self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO routed (mailbox, uid, folder, ts) VALUES (?, ?, ?, ?)',
+                    [(mailbox, int(uid), folder, now) for uid, folder in routes]
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error writing routed email cache: {e}")
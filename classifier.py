@@ -1,26 +1,97 @@
 """
 Core classification logic for categorizing emails using the LLM.
 """
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple
 
-from config import EMAIL_CATEGORIES
+from config import PROCESSING_CONFIG, LLM_CONFIG, EMBEDDING_CONFIG
+from category_registry import CATEGORIES, FALLBACK_CATEGORY
+from classification_cache import ClassificationCache, is_automated
+from rule_classifier import RuleClassifier
 from llm_client import LLMClient
+from preprocess import clean_body, truncate_body, warm_up
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Email fields passed to the LLM client, in the order of its classify_email arguments
+_EMAIL_FIELDS = ('id', 'subject', 'sender', 'date', 'body')
+
 
 class EmailClassifier:
     """
     Handles the classification of emails into predefined categories using an LLM.
     """
 
+    # Email data fields the classifier reads, attachments are not part of the prompt
+    needs = frozenset(_EMAIL_FIELDS[1:])
+
     def __init__(self):
         """Initialize the email classifier."""
-        self.llm_client = LLMClient()
-        self.categories = list(EMAIL_CATEGORIES.keys())
-        logger.info(f"Initialized classifier with categories: {self.categories}")
+        self.categories = list(CATEGORIES.folders())
+        self._rebuild_category_tables()
+        # Shared across classifiers, so all of them reuse one HTTP connection pool
+        self.llm_client = LLMClient.instance()
+        self.batch_size = PROCESSING_CONFIG['batch_size']
+        self.max_concurrency = LLM_CONFIG['max_concurrency']
+        self.max_body_chars = LLM_CONFIG['max_body_chars']
+        
+        # Deterministic rules from CLASSIFICATION_RULES, checked before anything else
+        self.rule_classifier = RuleClassifier(self.categories)
+        
+        # Persistent cache of previous classifications, keyed by email content
+        # and optionally by sender and normalized subject
+        self.cache = None
+        self.cache_by_sender = LLM_CONFIG['cache_by_sender']
+        if LLM_CONFIG['cache_dir']:
+            try:
+                self.cache = ClassificationCache(LLM_CONFIG['cache_dir'], LLM_CONFIG['cache_ttl_days'],
+                                                 LLM_CONFIG['cache_max_entries'])
+            except Exception as e:
+                logger.error("Failed to open classification cache, continuing without it: %s", e)
+        
+        # Optional embedding classifier that resolves clear-cut emails without an LLM request
+        self.embedding_classifier = None
+        if EMBEDDING_CONFIG['enabled']:
+            try:
+                # Imported only when enabled, the embedding backends load numpy and torch
+                from embedding_classifier import EmbeddingClassifier
+                self.embedding_classifier = EmbeddingClassifier(self.categories)
+            except Exception as e:
+                logger.error("Failed to initialize embedding classifier, using the LLM only: %s", e)
+        
+        # Compile the body preprocessing kernel up front, rather than on the first email
+        warm_up()
+        
+        # Categories added or removed anywhere in the process apply to this classifier too
+        CATEGORIES.on_change(self._on_categories_changed)
+        
+        logger.info("Initialized classifier with categories: %s", self.categories)
+
+    def _rebuild_category_tables(self) -> None:
+        """Rebuild the lookup tables derived from the category list."""
+        # The list keeps the order used in prompts, the set gives O(1) membership tests
+        self._categories_set = set(self.categories)
+        # Hashable snapshot passed to the LLM client, which caches the prompt rendering and matcher per tuple
+        self._categories_tuple = tuple(self.categories)
+        # Category indices and the destination folder of each index, for routing without string lookups
+        self._cat_index = {category: i for i, category in enumerate(self.categories)}
+        folders = CATEGORIES.folders()
+        self._folder_by_idx = tuple(folders[category] for category in self.categories)
+
+    def _on_categories_changed(self) -> None:
+        """Follow a category added to or removed from the registry."""
+        try:
+            self.categories = list(CATEGORIES.folders())
+            self._rebuild_category_tables()
+            
+            self.rule_classifier.set_categories(self.categories)
+            if self.embedding_classifier:
+                self.embedding_classifier.set_categories(self.categories)
+        except Exception as e:
+            logger.error("Error updating categories: %s", e)
 
     def test_llm_connection(self) -> bool:
         """
@@ -35,6 +106,169 @@ class EmailClassifier:
         """
         Classify an email into one of the predefined categories.
         
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Optional[str]: The predicted category, or None if classification failed.
+        """
+        return self.classify_emails([email_data])[0]
+
+    def classify_email_idx(self, email_data: Dict[str, Any]) -> Optional[int]:
+        """
+        Classify an email and return the index of its category.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Optional[int]: Index of the predicted category in `categories`, or None if classification failed.
+        """
+        return self.classify_emails_idx([email_data])[0]
+
+    def classify_emails_idx(self, emails: List[Dict[str, Any]]) -> List[Optional[int]]:
+        """
+        Classify several emails and return the index of each category.
+        
+        The index can be used directly with get_category_folders() to route the email.
+        
+        Args:
+            emails: List of dictionaries containing email data.
+            
+        Returns:
+            List[Optional[int]]: Index of the predicted category for each email, in input order.
+            Entries are None for empty email data.
+        """
+        cat_index = self._cat_index
+        return [cat_index.get(category) for category in self.classify_emails(emails)]
+
+    def classify_emails(self, emails: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Classify several emails, packing up to `batch_size` of them into each LLM request.
+        
+        Emails matching a rule in CLASSIFICATION_RULES or found in the cache skip the LLM.
+        When the embedding classifier is enabled, only emails it cannot confidently
+        classify are sent to the LLM. Emails the LLM did not return a valid category
+        for are retried individually.
+        
+        Args:
+            emails: List of dictionaries containing email data.
+            
+        Returns:
+            List[Optional[str]]: The predicted category for each email, in input order.
+            Entries are None for empty email data.
+        """
+        results: List[Optional[str]] = [None] * len(emails)
+        
+        pending = []
+        for index, email_data in enumerate(emails):
+            if not email_data:
+                logger.error("Cannot classify empty email data")
+                continue
+            
+            if self.rule_classifier.enabled:
+                category = self.rule_classifier.classify(email_data)
+                if category:
+                    logger.info("Email %s classified as '%s' by rule", email_data.get('id', 'unknown'), category)
+                    results[index] = category
+                    continue
+            
+            email_data = self._prepare_email(email_data)
+            
+            category = self._cache_lookup(email_data)
+            if category:
+                logger.info("Email %s classified as '%s' from cache", email_data.get('id', 'unknown'), category)
+                results[index] = category
+                continue
+            
+            if self.embedding_classifier:
+                category = self.embedding_classifier.classify(email_data)
+                if category:
+                    logger.info("Email %s classified as '%s' by embedding similarity", email_data.get('id', 'unknown'), category)
+                    results[index] = category
+                    continue
+            
+            pending.append((index, email_data))
+        
+        # A single email gains nothing from the batch prompt
+        if len(pending) <= 1:
+            retry = pending
+        else:
+            retry = []
+            chunks = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+            if len(chunks) > 1:
+                # The batch requests are independent, send up to max_concurrency of them at the same time
+                with ThreadPoolExecutor(max_workers=min(len(chunks), self.max_concurrency)) as pool:
+                    responses = list(pool.map(self._classify_chunk, chunks))
+            else:
+                responses = [self._classify_chunk(chunks[0])]
+            
+            for chunk, categories_by_id in zip(chunks, responses):
+                if categories_by_id is None:
+                    logger.warning("Batch classification failed, classifying emails individually")
+                    retry.extend(chunk)
+                    continue
+                
+                for index, email_data in chunk:
+                    email_id = str(email_data.get('id', 'unknown'))
+                    category = categories_by_id.get(email_id)
+                    if category:
+                        logger.info("Email %s classified as '%s'", email_id, category)
+                        results[index] = category
+                        self._cache_store(email_data, category)
+                    else:
+                        logger.warning("Batch response missing a valid category for email %s, retrying individually", email_id)
+                        retry.append((index, email_data))
+        
+        if len(retry) > 1:
+            categories = self._classify_individually([email_data for _, email_data in retry])
+            for (index, _), category in zip(retry, categories):
+                results[index] = category
+        else:
+            for index, email_data in retry:
+                results[index] = self._classify_single(email_data)
+        
+        return results
+
+    def _classify_chunk(self, chunk: List[Tuple[int, Dict[str, Any]]]) -> Optional[Dict[str, str]]:
+        """
+        Classify several emails with one LLM request.
+        
+        Args:
+            chunk: (index, prepared email data) pairs.
+            
+        Returns:
+            Optional[Dict[str, str]]: Mapping of email ID to category (see LLMClient.classify_batch),
+            or None if the request failed.
+        """
+        logger.info("Classifying batch of %s emails", len(chunk))
+        try:
+            return self.llm_client.classify_batch([email_data for _, email_data in chunk], self._categories_tuple)
+        except Exception as e:
+            logger.error("Error during batch classification: %s", e)
+            return None
+
+    def _prepare_email(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Trim the email body down to what the classifier needs.
+        
+        Quoted lines and reply chains are dropped so only the new content is classified,
+        blank lines are collapsed, and the body is truncated to `max_body_chars` to bound the number of prompt tokens,
+        at a word boundary so no partial word is tokenized.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Dict[str, Any]: A shallow copy of the email data with the trimmed body.
+        """
+        body = truncate_body(clean_body(email_data.get('body', '')), self.max_body_chars)
+        return dict(email_data, body=body)
+
+    async def aclassify_email(self, email_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Asynchronously classify an email into one of the predefined categories.
+        
         Args:
             email_data: Dictionary containing email data.
             
@@ -46,27 +280,157 @@ class EmailClassifier:
             return None
         
         try:
-            # Extract relevant email information for logging
-            email_id = email_data.get('id', 'unknown')
-            subject = email_data.get('subject', '')
-            sender = email_data.get('sender', '')
-            
-            logger.info(f"Classifying email {email_id} - Subject: '{subject}' - From: '{sender}'")
+            fields = self._llm_fields(email_data)
+            category = await self.llm_client.aclassify_email(*fields, self._categories_tuple)
+            return self._llm_result(email_data, fields[0], category)
+        except Exception as e:
+            logger.error("Error during classification: %s", e)
+            return FALLBACK_CATEGORY
+
+    async def aclassify_many(self, emails: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Classify several emails concurrently, one LLM request per email.
+        
+        At most `max_concurrency` requests are in flight at any time.
+        
+        Args:
+            emails: List of dictionaries containing email data.
             
-            # Use the LLM client to classify the email
-            category = self.llm_client.classify_email(email_data, self.categories)
+        Returns:
+            List[Optional[str]]: The predicted category for each email, in input order.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def bounded(email_data):
+            async with semaphore:
+                return await self.aclassify_email(email_data)
+        
+        try:
+            return list(await asyncio.gather(*[bounded(email_data) for email_data in emails]))
+        finally:
+            # The async HTTP client is bound to this event loop
+            await self.llm_client.aclose()
+
+    def _classify_single(self, email_data: Dict[str, Any]) -> str:
+        """
+        Classify one email with its own LLM request.
+        
+        Args:
+            email_data: Dictionary containing email data.
             
-            if category:
-                logger.info(f"Email {email_id} classified as '{category}'")
-                return category
-            else:
-                logger.warning(f"Failed to classify email {email_id}")
-                # Default to 'requires_manual_intervention' if classification fails
-                return 'requires_manual_intervention'
+        Returns:
+            str: The predicted category, or FALLBACK_CATEGORY if classification failed.
+        """
+        try:
+            fields = self._llm_fields(email_data)
+            category = self.llm_client.classify_email(*fields, self._categories_tuple)
+            return self._llm_result(email_data, fields[0], category)
         except Exception as e:
-            logger.error(f"Error during classification: {e}")
-            # Default to 'requires_manual_intervention' on error
-            return 'requires_manual_intervention'
+            logger.error("Error during classification: %s", e)
+            return FALLBACK_CATEGORY
+
+    def _classify_individually(self, emails: List[Dict[str, Any]]) -> List[str]:
+        """
+        Classify several emails with one LLM request each, overlapping the requests.
+        
+        The requests run on an event loop, or on a thread pool when the caller is already
+        running one (e.g. inside the async pipeline), where asyncio.run() is not allowed.
+        
+        Args:
+            emails: List of prepared email data.
+            
+        Returns:
+            List[str]: The predicted category for each email, in input order.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aclassify_many(emails))
+        
+        with ThreadPoolExecutor(max_workers=min(len(emails), self.max_concurrency)) as pool:
+            return list(pool.map(self._classify_single, emails))
+
+    def _llm_fields(self, email_data: Dict[str, Any]) -> Tuple[str, str, str, str, str]:
+        """
+        Extract the email fields passed to the LLM client as scalars.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Tuple[str, str, str, str, str]: ID, subject, sender, date and body of the email.
+        """
+        email_id, subject, sender, date, body = [email_data.get(key, '') for key in _EMAIL_FIELDS]
+        email_id = email_id or 'unknown'
+        
+        logger.info("Classifying email %s - Subject: '%s' - From: '%s'", email_id, subject, sender)
+        return email_id, subject, sender, date, body
+
+    def _llm_result(self, email_data: Dict[str, Any], email_id: str, category: Optional[str]) -> str:
+        """
+        Record the category the LLM returned for a single email.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            email_id: Email identifier, used for logging.
+            category: The predicted category, or None if classification failed.
+            
+        Returns:
+            str: The category, or FALLBACK_CATEGORY if classification failed.
+        """
+        if category:
+            logger.info("Email %s classified as '%s'", email_id, category)
+            self._cache_store(email_data, category)
+            return category
+        
+        logger.warning("Failed to classify email %s", email_id)
+        return FALLBACK_CATEGORY
+
+    def _cache_lookup(self, email_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Look up the cached category of an email.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Optional[str]: The cached category, or None if not cached or the cache is disabled.
+        """
+        if not self.cache:
+            return None
+        
+        category = self.cache.get(ClassificationCache.make_key(email_data, self.categories))
+        if category is None and self._use_sender_key(email_data):
+            category = self.cache.get(ClassificationCache.make_sender_key(email_data, self.categories))
+        
+        # Ignore entries for categories that have since been removed
+        return category if category in self._categories_set else None
+
+    def _use_sender_key(self, email_data: Dict[str, Any]) -> bool:
+        """
+        Check whether an email is also cached by sender and normalized subject.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            bool: True if enabled and the email looks automated, personal emails are only cached by content.
+        """
+        return self.cache_by_sender and is_automated(email_data)
+
+    def _cache_store(self, email_data: Dict[str, Any], category: str) -> None:
+        """
+        Remember the category of an email.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            category: Category predicted by the LLM.
+        """
+        if self.cache:
+            keys = [ClassificationCache.make_key(email_data, self.categories)]
+            if self._use_sender_key(email_data):
+                keys.append(ClassificationCache.make_sender_key(email_data, self.categories))
+            self.cache.set_many(keys, category)
 
     def get_available_categories(self) -> List[str]:
         """
@@ -77,9 +441,18 @@ class EmailClassifier:
         """
         return self.categories
 
+    def get_category_folders(self) -> Tuple[str, ...]:
+        """
+        Get the destination folder of each category, indexed like `categories`.
+        
+        Returns:
+            Tuple[str, ...]: Folder names, one per category index.
+        """
+        return self._folder_by_idx
+
     def add_category(self, category: str, folder: str) -> bool:
         """
-        Add a new category to the classifier.
+        Add a new category, for all classifiers and folder managers of the process.
         
         Args:
             category: Name of the category.
@@ -88,26 +461,15 @@ class EmailClassifier:
         Returns:
             bool: True if the category was added successfully, False otherwise.
         """
-        if category in self.categories:
-            logger.warning(f"Category '{category}' already exists")
+        if not CATEGORIES.add(category, folder):
             return False
         
-        try:
-            # Add the category to the list
-            self.categories.append(category)
-            
-            # Add the category to the EMAIL_CATEGORIES dictionary
-            EMAIL_CATEGORIES[category] = folder
-            
-            logger.info(f"Added category '{category}' with folder '{folder}'")
-            return True
-        except Exception as e:
-            logger.error(f"Error adding category: {e}")
-            return False
+        logger.info("Added category '%s' with folder '%s'", category, folder)
+        return True
 
     def remove_category(self, category: str) -> bool:
         """
-        Remove a category from the classifier.
+        Remove a category, for all classifiers and folder managers of the process.
         
         Args:
             category: Name of the category to remove.
@@ -115,24 +477,8 @@ class EmailClassifier:
         Returns:
             bool: True if the category was removed successfully, False otherwise.
         """
-        if category not in self.categories:
-            logger.warning(f"Category '{category}' does not exist")
-            return False
-        
-        if category == 'requires_manual_intervention':
-            logger.error("Cannot remove the 'requires_manual_intervention' category")
+        if not CATEGORIES.remove(category):
             return False
         
-        try:
-            # Remove the category from the list
-            self.categories.remove(category)
-            
-            # Remove the category from the EMAIL_CATEGORIES dictionary
-            if category in EMAIL_CATEGORIES:
-                del EMAIL_CATEGORIES[category]
-            
-            logger.info(f"Removed category '{category}'")
-            return True
-        except Exception as e:
-            logger.error(f"Error removing category: {e}")
-            return False
+        logger.info("Removed category '%s'", category)
+        return True
@@ -2,10 +2,26 @@
 Configuration settings for the Email Classifier application.
 """
 import os
+from string import Formatter
+from typing import Callable
 from dotenv import load_dotenv
 
+
+def _load_env() -> None:
+    """
+    Load environment variables from the .env file.
+    
+    Locating and parsing .env is skipped when it was already done earlier in this process
+    (e.g. when the module is reloaded) or by a parent process, whose environment is inherited.
+    """
+    if os.environ.get('_EMAIL_CLASSIFIER_ENV_LOADED'):
+        return
+    load_dotenv()
+    os.environ['_EMAIL_CLASSIFIER_ENV_LOADED'] = '1'
+
+
 # Load environment variables from .env file
-load_dotenv()
+_load_env()
 
 # Email (IMAP) Configuration
 # These are typically provided by Proton Mail Bridge
@@ -15,6 +31,11 @@ EMAIL_CONFIG = {
     'username': os.getenv('EMAIL_USERNAME', ''),
     'password': os.getenv('EMAIL_PASSWORD', ''),
     'use_ssl': os.getenv('IMAP_USE_SSL', 'False').lower() == 'true',
+    # Pipeline IMAP commands with aioimaplib (optional dependency)
+    'async_imap': os.getenv('IMAP_ASYNC', 'False').lower() == 'true',
+    # Maximum number of folders processed in parallel, each on its own connection
+    # Many servers limit the number of connections per account
+    'max_connections': int(os.getenv('IMAP_MAX_CONNECTIONS', 4)),
 }
 
 # LLM API Configuration
@@ -24,17 +45,41 @@ LLM_CONFIG = {
     'model': os.getenv('LLM_MODEL', 'default'),  # Model identifier if needed
     'temperature': float(os.getenv('LLM_TEMPERATURE', 0.1)),  # Lower for more deterministic responses
     'max_tokens': int(os.getenv('LLM_MAX_TOKENS', 1024)),
+    'max_body_chars': int(os.getenv('LLM_MAX_BODY_CHARS', 4000)),  # Email body is truncated to this length before classification
+    # Constrain single-email classification output to the category names with a JSON schema,
+    # so the model only generates a handful of tokens (llama.cpp, vLLM and other OpenAI-compatible servers)
+    'structured_output': os.getenv('LLM_STRUCTURED_OUTPUT', 'True').lower() == 'true',
+    'classification_max_tokens': int(os.getenv('LLM_CLASSIFICATION_MAX_TOKENS', 32)),  # Token limit for single-email classification
     'timeout': int(os.getenv('LLM_TIMEOUT', 30)),  # Timeout in seconds
+    # Longest wait, in seconds, before retrying a rate-limited or overloaded response; longer Retry-After values are clamped
+    'max_retry_backoff': float(os.getenv('LLM_MAX_RETRY_BACKOFF', 60)),
+    # Maximum number of classification requests in flight at once, across all folders processed in parallel
+    # Should not exceed the number of parallel slots on the LLM server (e.g. OLLAMA_NUM_PARALLEL for ollama, --parallel for llama.cpp)
+    'max_concurrency': int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+    # Classifications are cached on disk by email content so repeated emails skip the LLM
+    # Set LLM_CACHE_DIR to an empty value to disable the cache
+    'cache_dir': os.getenv('LLM_CACHE_DIR', '.cache'),
+    'cache_ttl_days': int(os.getenv('LLM_CACHE_TTL_DAYS', 30)),
+    'cache_max_entries': int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10000)),  # Oldest entries are dropped first, 0 for no limit
+    # Also reuse the category of earlier automated emails (mailing lists, no-reply senders) from the same
+    # sender with the same subject, ignoring numbers and reply prefixes, so repeated notifications skip the LLM
+    'cache_by_sender': os.getenv('LLM_CACHE_BY_SENDER', 'False').lower() == 'true',
 }
 
 # Email Processing Configuration
 PROCESSING_CONFIG = {
     'batch_size': int(os.getenv('BATCH_SIZE', 10)),  # Number of emails to process in one batch
     'max_emails_per_run': int(os.getenv('MAX_EMAILS_PER_RUN', 100)),  # Maximum emails to process in one run
+    # Only takes effect for processor functions that read attachments, the built-in classifier doesn't
     'include_attachments': os.getenv('INCLUDE_ATTACHMENTS', 'False').lower() == 'true',
     'max_email_size_kb': int(os.getenv('MAX_EMAIL_SIZE_KB', 500)),  # Skip emails larger than this
     'folders_to_process': os.getenv('FOLDERS_TO_PROCESS', 'INBOX').split(','),
     'skip_processed': os.getenv('SKIP_PROCESSED', 'True').lower() == 'true',  # Skip already processed emails
+    # Batches finishing faster than this wait for the rest, to avoid overwhelming the server
+    'min_batch_interval_ms': int(os.getenv('MIN_BATCH_INTERVAL_MS', 100)),
+    # Highest processed UID of every folder, so later runs only search newer emails
+    # Set UID_STATE_FILE to an empty value to disable it
+    'uid_state_file': os.getenv('UID_STATE_FILE', os.path.join('.cache', 'uid_state.json')),
 }
 
 # Email Categories and Corresponding Folders
@@ -48,6 +93,44 @@ EMAIL_CATEGORIES = {
     # Add more categories as needed
 }
 
+# Category descriptions used by the embedding classifier
+# Emails are compared against these descriptions, so they should describe the typical content of each category
+# Categories without a description are compared against their name
+EMAIL_CATEGORY_DESCRIPTIONS = {
+    'requires_manual_intervention': 'Personal correspondence, important questions or anything that needs a human response, such as emails from friends, family or colleagues.',
+    'bills': 'Financial transactions, invoices, receipts, payment confirmations, account statements and other financial notifications.',
+    'promotional': 'Marketing emails, newsletters, advertisements, special offers, company updates and other non-personal mass communications.',
+}
+
+# Embedding Classifier Configuration
+# When enabled, emails are first classified by comparing a local sentence embedding of the email
+# with the category descriptions above; only emails that match no category closely enough are sent to the LLM
+EMBEDDING_CONFIG = {
+    'enabled': os.getenv('EMBEDDING_CLASSIFIER', 'False').lower() == 'true',
+    # 'local' embeds with sentence-transformers, 'server' with the embeddings endpoint of the LLM server
+    # (e.g. llama.cpp started with --embeddings, or any OpenAI-compatible server)
+    'backend': os.getenv('EMBEDDING_BACKEND', 'local').lower(),
+    'model': os.getenv('EMBEDDING_MODEL', 'BAAI/bge-small-en-v1.5'),  # Any sentence-transformers model, or the server's model name
+    'max_body_chars': int(os.getenv('EMBEDDING_MAX_BODY_CHARS', 200)),  # Only the start of the body is embedded
+    'min_similarity': float(os.getenv('EMBEDDING_MIN_SIMILARITY', 0.5)),  # Below this cosine similarity the LLM decides
+}
+
+# Classification Rules
+# Emails matching a rule are classified without the LLM or the cache, the rules are checked in the order below
+# Rules for categories that don't exist in EMAIL_CATEGORIES are ignored
+CLASSIFICATION_RULES = {
+    # Sender domain -> category, a domain also matches its subdomains (e.g. 'example.com' matches 'mail.example.com')
+    'domain_to_category': {
+        # 'paypal.com': 'bills',
+    },
+    # Category of emails with a List-Unsubscribe header (mailing lists, newsletters), empty to disable
+    'list_unsubscribe_category': os.getenv('LIST_UNSUBSCRIBE_CATEGORY', ''),
+    # (regular expression, category) pairs, searched case-insensitively in the subject
+    'subject_patterns': [
+        # (r'\binvoice\b', 'bills'),
+    ],
+}
+
 # LLM Prompt Configuration
 # This is the prompt that will be sent to the LLM for classification
 CLASSIFICATION_PROMPT_TEMPLATE = """
@@ -75,9 +158,71 @@ Guidelines for classification:
 Analyze the content and respond with only the category name that best matches this email.
 """
 
+# Prompt used when several emails are classified in a single LLM request
+# The {emails} placeholder is filled with a numbered list of emails, each tagged with its ID
+BATCH_CLASSIFICATION_PROMPT_TEMPLATE = """
+You are an email classification assistant. Your task is to categorize each of the following emails into exactly one of these categories:
+{categories}
+
+Category Definitions:
+- 'requires_manual_intervention': Emails that need personal attention, such as personal correspondence, important questions, or anything that requires a human response. This includes emails from friends, family, or colleagues discussing personal matters.
+- 'bills': Emails related to financial transactions, invoices, receipts, payment confirmations, account statements, or any financial notifications.
+- 'promotional': Marketing emails, newsletters, advertisements, special offers, updates from companies, or any non-personal mass communications.
+
+Emails:
+{emails}
+
+Guidelines for classification:
+1. For emails that are part of ongoing conversations (like "Re:" threads), classify based on the content and context, not just the subject line.
+2. Newsletters and updates from companies should generally be 'promotional' unless they contain billing information.
+3. Only use 'requires_manual_intervention' when the email truly needs personal attention or response.
+4. Account statements, payment confirmations, and receipts should be classified as 'bills'.
+
+Respond with only a JSON array containing one object per email, using the email ID shown above, for example:
+[{{"id": "<email_id>", "category": "<category_name>"}}]
+"""
+
+
+def compile_prompt_template(template: str) -> Callable[..., str]:
+    """
+    Compile a str.format-style prompt template into a render function.
+    
+    The template is split into literal text and field names once, so rendering only joins
+    the pieces instead of re-parsing the template on every call.
+    
+    Args:
+        template: Template using plain {field} placeholders.
+        
+    Returns:
+        Callable[..., str]: Function taking the fields as keyword arguments and returning the prompt.
+    """
+    segments = []
+    for literal, field_name, format_spec, conversion in Formatter().parse(template):
+        if format_spec or conversion:
+            # Format specs and conversions are not supported by the fast path
+            return template.format
+        segments.append((literal, field_name))
+    
+    def render(**fields) -> str:
+        return ''.join([
+            literal if field_name is None else literal + str(fields[field_name])
+            for literal, field_name in segments
+        ])
+    
+    return render
+
+
+# Prompt render functions, compiled once from the templates above
+RENDER_PROMPT = compile_prompt_template(CLASSIFICATION_PROMPT_TEMPLATE)
+RENDER_BATCH_PROMPT = compile_prompt_template(BATCH_CLASSIFICATION_PROMPT_TEMPLATE)
+
 # Logging Configuration
 LOGGING_CONFIG = {
     'log_level': os.getenv('LOG_LEVEL', 'INFO'),
     'log_file': os.getenv('LOG_FILE', 'email_classifier.log'),
-    'log_to_console': os.getenv('LOG_TO_CONSOLE', 'True').lower() == 'true',
+    # The log file is rotated at this size, keeping LOG_BACKUP_COUNT old files
+    'log_max_bytes': int(os.getenv('LOG_MAX_BYTES', 5_000_000)),
+    'log_backup_count': int(os.getenv('LOG_BACKUP_COUNT', 3)),
+    # 'auto' only logs to the console when it is a terminal, not when run by cron
+    'log_to_console': os.getenv('LOG_TO_CONSOLE', 'auto').lower(),
 }
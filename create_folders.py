@@ -5,8 +5,10 @@ Script to create the necessary folders for email classification.
 import logging
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email_processor import EmailProcessor
-from config import EMAIL_CATEGORIES
+from category_registry import CATEGORIES
 
 # Configure logging
 logging.basicConfig(
@@ -33,26 +35,74 @@ def create_category_folders():
         for existing_folder in existing_folders:
             print(f"Found existing folder: {existing_folder}\n")
 
-        logger.info(f"Existing folders: {existing_folders}")
+        logger.info("Existing folders: %s", existing_folders)
         
-        # Create folders for each category
-        success = True
-        for category, folder_name in EMAIL_CATEGORIES.items():
+        # Find the folders that still need to be created
+        missing = {}
+        for category, folder_name in CATEGORIES.folders().items():
             if folder_name in existing_folders:
-                logger.info(f"Folder '{folder_name}' for category '{category}' already exists")
-                continue
-            
-            logger.info(f"Creating folder '{folder_name}' for category '{category}'")
-            if processor.create_folder_if_not_exists(folder_name):
-                logger.info(f"Successfully created folder '{folder_name}'")
+                logger.info("Folder '%s' for category '%s' already exists", folder_name, category)
             else:
-                logger.error(f"Failed to create folder '{folder_name}'")
-                success = False
+                missing[category] = folder_name
+        
+        if not missing:
+            return True
         
-        return success
+        return _create_folders_concurrently(missing)
     finally:
         processor.disconnect()
 
+def _create_folders_concurrently(missing):
+    """
+    Create folders in parallel, one IMAP connection per worker thread.
+    
+    imaplib connections are not thread-safe, so each worker gets its own EmailProcessor.
+    
+    Args:
+        missing: Dictionary mapping category names to the folders to create.
+        
+    Returns:
+        bool: True if all folders were created successfully, False otherwise.
+    """
+    worker_state = threading.local()
+    worker_processors = []
+    worker_lock = threading.Lock()
+    
+    def init_worker():
+        worker_state.processor = EmailProcessor()
+        with worker_lock:
+            worker_processors.append(worker_state.processor)
+    
+    def create_folder(folder_name):
+        return worker_state.processor.create_folder_if_not_exists(folder_name)
+    
+    success = True
+    try:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing)), initializer=init_worker) as executor:
+            futures = {}
+            for category, folder_name in missing.items():
+                logger.info("Creating folder '%s' for category '%s'", folder_name, category)
+                futures[executor.submit(create_folder, folder_name)] = folder_name
+            
+            for future in as_completed(futures):
+                folder_name = futures[future]
+                try:
+                    created = future.result()
+                except Exception as e:
+                    logger.error("Error creating folder '%s': %s", folder_name, e)
+                    created = False
+                
+                if created:
+                    logger.info("Successfully created folder '%s'", folder_name)
+                else:
+                    logger.error("Failed to create folder '%s'", folder_name)
+                    success = False
+    finally:
+        for worker_processor in worker_processors:
+            worker_processor.disconnect()
+    
+    return success
+
 if __name__ == "__main__":
     logger.info("Creating category folders...")
     if create_category_folders():
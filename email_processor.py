@@ -1,21 +1,492 @@
 """
 Email processing module for fetching and manipulating emails via IMAP.
 """
+import asyncio
+import atexit
+import binascii
+import codecs
 import imaplib
-import email
+import hashlib
+import json
 from email.header import decode_header
+from email.parser import BytesParser
+from email.policy import compat32
 import logging
 import os
 import re
-from typing import List, Dict, Tuple, Optional, Any
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import List, Dict, Set, Tuple, Optional, Any, Iterator, Iterable
 import time
 import ssl
 
-from config import EMAIL_CONFIG, PROCESSING_CONFIG, EMAIL_CATEGORIES
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+from classification_cache import RoutedEmailCache
+from config import EMAIL_CONFIG, LLM_CONFIG, PROCESSING_CONFIG
+from category_registry import CATEGORIES
+from pipeline import EmailBudget, run_pipeline
+from preprocess import html_to_text
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Idle connections by (server, port, username), reused instead of repeating TLS + LOGIN
+_CONNECTION_POOL: Dict[Tuple[str, int, str], List[imaplib.IMAP4]] = {}
+_POOL_LOCK = threading.Lock()
+_noop_timer = None
+
+# Capabilities after LOGIN by (server, port, username)
+_CAPABILITIES: Dict[Tuple[str, int, str], frozenset] = {}
+
+# Socket receive buffer and read buffer of IMAP connections, so large literals take fewer reads
+SOCKET_RCVBUF_SIZE = 1 << 20
+READ_BUFFER_SIZE = 1 << 16
+
+# Personal namespace (prefix, delimiter) by (server, port, username), from NAMESPACE
+_NAMESPACES: Dict[Tuple[str, int, str], Tuple[str, str]] = {}
+_NAMESPACE_RE = re.compile(rb'^\(\("([^"]*)" (?:"([^"]*)"|NIL)\)')
+
+# Idle connections are pinged before servers drop them (commonly after 30 minutes)
+NOOP_INTERVAL = 25 * 60
+
+# Highest processed UID by folder key, with the UIDVALIDITY it belongs to, loaded from the UID state file
+_UID_STATE: Optional[Dict[str, Dict[str, int]]] = None
+_UID_STATE_LOCK = threading.Lock()
+
+# Destination folder of classified emails by UID, shared by all processors; False if unavailable
+_ROUTED_CACHE: Any = None
+_ROUTED_CACHE_LOCK = threading.Lock()
+_UIDVALIDITY_RE = re.compile(rb'\[UIDVALIDITY (\d+)\]')
+
+# Seconds the folder list is reused before it is listed again
+FOLDER_CACHE_TTL = 300
+
+# Maximum number of messages requested in one FETCH command
+MAX_FETCH_BATCH = 100
+# Maximum number of UIDs in the message set of one MOVE, COPY or STORE command (RFC 2683 3.2.1.5)
+MAX_UID_SET = 1000
+
+# Stateless, shared by all processors; compat32 is the fastest policy and the one the parsing code expects
+_MESSAGE_PARSER = BytesParser(policy=compat32)
+
+# Longer headers are truncated before decoding, RFC 2047 decoding is slow on crafted headers
+MAX_HEADER_LENGTH = 2048
+
+# Headers fetched for classification; the MIME headers are needed to parse the body
+FETCH_HEADER_FIELDS = 'SUBJECT FROM DATE LIST-UNSUBSCRIBE MIME-VERSION CONTENT-TYPE CONTENT-TRANSFER-ENCODING'
+# Headers fetched with a single body part, whose MIME headers are rebuilt from its BODYSTRUCTURE
+PART_HEADER_FIELDS = 'SUBJECT FROM DATE LIST-UNSUBSCRIBE'
+
+# Items of the first FETCH, which finds the size and text part of each email before any body is downloaded
+STRUCTURE_FETCH_ITEMS = 'RFC822.SIZE BODYSTRUCTURE'
+# Items of the first FETCH when whole emails are downloaded anyway, to skip the ones over the size limit
+SIZE_FETCH_ITEMS = 'RFC822.SIZE'
+
+# Email data fields a processor function can read, it can list the ones it does in a `needs` attribute
+ALL_NEEDS = frozenset({'subject', 'sender', 'date', 'body', 'attachments'})
+
+# LIST response line: (flags) "delimiter" name, with the name quoted or as an atom
+_LIST_RE = re.compile(r'^\([^)]*\) (?:"(?:[^"\\]|\\.)*"|NIL) (?:"((?:[^"\\]|\\.)*)"|([^"\s]+))$')
+_LIST_UNESCAPE_RE = re.compile(r'\\(.)')
+# Fallbacks for servers that don't follow the LIST format
+_FOLDER_QUOTED_RE = re.compile(r'"([^"]*)"$')
+_FOLDER_TAIL_RE = re.compile(r'(?:\s|\|)\s*"?([^"]+)"?$')
+_FOLDER_INBOX_RE = re.compile(r'INBOX\.(.+?)(?:\s|$)')
+# Shifted run of a modified UTF-7 folder name (RFC 3501 5.1.3), '&-' stands for '&'
+_MUTF7_RE = re.compile(r'&([A-Za-z0-9+,]*)-')
+
+# Start of a message in a FETCH response, with (imaplib) or without (aioimaplib) the command name stripped
+_FETCH_START_RE = re.compile(rb'^(\d+) (?:FETCH )?\(')
+_FETCH_UID_RE = re.compile(rb'UID (\d+)')
+_FETCH_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+_LITERAL_MARKER_RE = re.compile(rb'\{\d+\}$')
+
+# Tokens of a parenthesized IMAP list: (, ), quoted string, atom (including NIL and numbers)
+_IMAP_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))', re.DOTALL)
+_IMAP_UNESCAPE_RE = re.compile(rb'\\(.)', re.DOTALL)
+
+# Runs of whitespace other than line breaks, left behind by markup and indentation
+_HTML_SPACE_RE = re.compile(r'[^\S\n]+')
+
+# Text of recently converted HTML bodies by digest, since newsletters often repeat the same body
+HTML_CACHE_SIZE = 256
+_HTML_CACHE: 'OrderedDict[bytes, str]' = OrderedDict()
+_HTML_CACHE_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=64)
+def _codec_name(charset: Optional[str]) -> str:
+    """
+    Resolve a MIME charset to a Python codec name, falling back to UTF-8.
+    
+    Args:
+        charset: Charset from the Content-Type header, or None.
+        
+    Returns:
+        str: Name of a codec that can decode the payload.
+    """
+    if not charset:
+        return 'utf-8'
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        logger.debug(f"Unknown charset {charset}, decoding as UTF-8")
+        return 'utf-8'
+
+
+@lru_cache(maxsize=1024)
+def _decode_encoded_words(header: str) -> str:
+    """
+    Decode the RFC 2047 encoded words of a header.
+    
+    Memoized, since the emails of mailing lists and newsletters share the same senders and subjects.
+    
+    Args:
+        header: Header containing encoded words.
+        
+    Returns:
+        str: Decoded header.
+    """
+    try:
+        header_parts = []
+        for content, encoding in decode_header(header):
+            if isinstance(content, bytes):
+                header_parts.append(content.decode(_codec_name(encoding), errors='replace'))
+            else:
+                header_parts.append(str(content))
+        
+        return ''.join(header_parts)
+    except Exception as e:
+        logger.error(f"Error decoding header: {e}")
+        return header
+
+
+def _html_to_text(html_body: str) -> str:
+    """
+    Convert an HTML email body to plain text.
+    
+    Args:
+        html_body: HTML content.
+        
+    Returns:
+        str: The text content, without scripts and styles and with runs of spaces collapsed.
+    """
+    # Key by digest, so the cache doesn't keep the HTML bodies themselves alive
+    key = hashlib.blake2b(html_body.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+    with _HTML_CACHE_LOCK:
+        text = _HTML_CACHE.get(key)
+        if text is not None:
+            _HTML_CACHE.move_to_end(key)
+            return text
+    
+    if HTMLParser is not None:
+        tree = HTMLParser(html_body)
+        tree.strip_tags(['script', 'style'])
+        root = tree.body or tree.root
+        text = root.text(separator=' ') if root is not None else ''
+    else:
+        text = html_to_text(html_body)
+    text = _HTML_SPACE_RE.sub(' ', text)
+    
+    with _HTML_CACHE_LOCK:
+        _HTML_CACHE[key] = text
+        if len(_HTML_CACHE) > HTML_CACHE_SIZE:
+            _HTML_CACHE.popitem(last=False)
+    return text
+
+
+def _decode_mutf7(name: str) -> str:
+    """
+    Decode a folder name from modified UTF-7, as folder names are sent over IMAP.
+    
+    Args:
+        name: Folder name as returned by LIST.
+        
+    Returns:
+        str: The decoded folder name, or the name itself if it is not valid modified UTF-7.
+    """
+    if '&' not in name:
+        return name
+    
+    def decode_run(match):
+        encoded = match.group(1)
+        if not encoded:
+            return '&'
+        encoded = encoded.replace(',', '/')
+        return binascii.a2b_base64(encoded + '=' * (-len(encoded) % 4)).decode('utf-16-be')
+    
+    try:
+        return _MUTF7_RE.sub(decode_run, name)
+    except (binascii.Error, UnicodeDecodeError):
+        return name
+
+
+def _encode_mutf7(name: str) -> str:
+    """
+    Encode a folder name in modified UTF-7, for use in IMAP commands.
+    
+    Args:
+        name: Folder name.
+        
+    Returns:
+        str: The encoded folder name.
+    """
+    if '&' not in name and all(' ' <= c <= '~' for c in name):
+        return name
+    
+    encoded = []
+    run = []
+    for c in name + ' ':
+        if ' ' <= c <= '~':
+            if run:
+                data = binascii.b2a_base64(''.join(run).encode('utf-16-be'), newline=False)
+                encoded.append('&' + data.decode('ascii').rstrip('=').replace('/', ',') + '-')
+                run = []
+            encoded.append('&-' if c == '&' else c)
+        else:
+            run.append(c)
+    return ''.join(encoded)[:-1]
+
+
+def _parse_imap_list(data: bytes) -> Optional[list]:
+    """
+    Parse the parenthesized IMAP list at the start of data, e.g. a BODYSTRUCTURE.
+    
+    Args:
+        data: Response bytes starting with the opening parenthesis.
+        
+    Returns:
+        Optional[list]: Nested lists of str, with None for NIL, or None if there is no list.
+    """
+    stack = [[]]
+    pos = 0
+    while True:
+        match = _IMAP_TOKEN_RE.match(data, pos)
+        if not match:
+            break
+        pos = match.end()
+        
+        opening, closing, quoted, atom = match.groups()
+        if opening:
+            nested = []
+            stack[-1].append(nested)
+            stack.append(nested)
+        elif closing:
+            if len(stack) > 1:
+                stack.pop()
+            if len(stack) == 1:
+                break
+        elif quoted is not None:
+            stack[-1].append(_IMAP_UNESCAPE_RE.sub(rb'\1', quoted).decode('utf-8', errors='replace'))
+        elif atom.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(atom.decode('utf-8', errors='replace'))
+    
+    return stack[0][0] if stack[0] and isinstance(stack[0][0], list) else None
+
+
+def _find_text_part(structure: list, section: str = '') -> Optional[Tuple[str, str, Optional[str], str]]:
+    """
+    Find the part of a BODYSTRUCTURE holding the text to classify.
+    
+    The first inline text/plain part is preferred, like in _get_email_body, then the first
+    inline text/html part.
+    
+    Args:
+        structure: Parsed BODYSTRUCTURE.
+        section: Section number of `structure`, empty for the whole message.
+        
+    Returns:
+        Optional[Tuple[str, str, Optional[str], str]]: (section, content type, charset, transfer
+        encoding) of the part, or None if the email has no inline text part.
+    """
+    html_part = None
+    for part_section, part in _iter_leaf_parts(structure, section):
+        if len(part) < 7 or not isinstance(part[0], str) or not isinstance(part[1], str):
+            continue
+        content_type = f"{part[0]}/{part[1]}".lower()
+        if content_type not in ('text/plain', 'text/html'):
+            continue
+        
+        # Body extension data: text parts have the line count before MD5 and disposition
+        disposition = part[9] if len(part) > 9 else None
+        if isinstance(disposition, list) and disposition and str(disposition[0]).lower() == 'attachment':
+            continue
+        
+        params = part[2] if isinstance(part[2], list) else []
+        charset = next((params[i + 1] for i in range(0, len(params) - 1, 2)
+                        if str(params[i]).lower() == 'charset'), None)
+        found = (part_section, content_type, charset, (part[5] or '7bit').lower())
+        if content_type == 'text/plain':
+            return found
+        html_part = html_part or found
+    
+    return html_part
+
+
+def _iter_leaf_parts(structure: list, section: str) -> Iterator[Tuple[str, list]]:
+    """
+    Iterate over the non-multipart parts of a BODYSTRUCTURE in order.
+    
+    Args:
+        structure: Parsed BODYSTRUCTURE.
+        section: Section number of `structure`, empty for the whole message.
+        
+    Yields:
+        Tuple[str, list]: Section number (TEXT for a single-part message) and structure of each part.
+    """
+    if structure and isinstance(structure[0], list):
+        # Multipart: the parts come first, followed by the subtype and extension data
+        for index, part in enumerate(structure):
+            if not isinstance(part, list):
+                break
+            yield from _iter_leaf_parts(part, f"{section}.{index + 1}" if section else str(index + 1))
+    else:
+        yield section or 'TEXT', structure
+
+
+class _BufferedIMAPMixin:
+    """Open IMAP connections with a large socket receive buffer and read buffer."""
+
+    def open(self, *args, **kwargs):
+        super().open(*args, **kwargs)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF_SIZE)
+        except OSError as e:
+            logger.debug(f"Could not enlarge the socket receive buffer: {e}")
+        
+        # Nothing has been read yet, the greeting is read after open()
+        self.file.close()
+        self.file = self.sock.makefile('rb', buffering=READ_BUFFER_SIZE)
+
+
+class _BufferedIMAP4(_BufferedIMAPMixin, imaplib.IMAP4):
+    pass
+
+
+class _BufferedIMAP4_SSL(_BufferedIMAPMixin, imaplib.IMAP4_SSL):
+    pass
+
+
+def _schedule_noop() -> None:
+    """Start the keepalive timer of the connection pool, if it is not running."""
+    global _noop_timer
+    
+    with _POOL_LOCK:
+        if _noop_timer is not None:
+            return
+        _noop_timer = threading.Timer(NOOP_INTERVAL, _noop_idle_connections)
+        _noop_timer.daemon = True
+        _noop_timer.start()
+
+
+def _noop_idle_connections() -> None:
+    """Send a NOOP on every idle pooled connection, dropping the ones that fail."""
+    global _noop_timer
+    
+    # Take the connections out of the pool, so connect() and disconnect() don't wait for the round trips
+    with _POOL_LOCK:
+        _noop_timer = None
+        idle = [(key, connections[:]) for key, connections in _CONNECTION_POOL.items() if connections]
+        for connections in _CONNECTION_POOL.values():
+            connections.clear()
+    
+    alive = {}
+    for key, connections in idle:
+        for connection in connections:
+            try:
+                status, _ = connection.noop()
+                if status == 'OK':
+                    alive.setdefault(key, []).append(connection)
+            except Exception as e:
+                logger.debug(f"Dropping idle IMAP connection to {key[0]}: {e}")
+    
+    with _POOL_LOCK:
+        for key, connections in alive.items():
+            _CONNECTION_POOL.setdefault(key, []).extend(connections)
+        pending = any(_CONNECTION_POOL.values())
+    
+    if pending:
+        _schedule_noop()
+
+
+def close_pool() -> None:
+    """Log out of all idle pooled connections."""
+    with _POOL_LOCK:
+        connections = [connection for pooled in _CONNECTION_POOL.values() for connection in pooled]
+        _CONNECTION_POOL.clear()
+    
+    for connection in connections:
+        try:
+            connection.logout()
+        except Exception as e:
+            logger.debug(f"Error during IMAP logout: {e}")
+    if connections:
+        logger.info("Disconnected from IMAP server")
+
+
+atexit.register(close_pool)
+
+
+def _uid_state() -> Dict[str, Dict[str, int]]:
+    """Return the UID state, loading it from the UID state file on first use. Call with _UID_STATE_LOCK held."""
+    global _UID_STATE
+    if _UID_STATE is None:
+        _UID_STATE = {}
+        path = PROCESSING_CONFIG['uid_state_file']
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    _UID_STATE = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable UID state file {path}: {e}")
+    return _UID_STATE
+
+
+def _routed_cache() -> Optional[RoutedEmailCache]:
+    """Return the routed email cache, opening it on first use, or None if it is disabled."""
+    global _ROUTED_CACHE
+    with _ROUTED_CACHE_LOCK:
+        if _ROUTED_CACHE is None:
+            _ROUTED_CACHE = False
+            if LLM_CONFIG['cache_dir']:
+                try:
+                    _ROUTED_CACHE = RoutedEmailCache(LLM_CONFIG['cache_dir'], LLM_CONFIG['cache_ttl_days'])
+                except Exception as e:
+                    logger.error(f"Failed to open routed email cache, continuing without it: {e}")
+        return _ROUTED_CACHE or None
+
+
+def save_uid_state() -> None:
+    """Write the highest processed UID of every folder to the UID state file."""
+    path = PROCESSING_CONFIG['uid_state_file']
+    if not path:
+        return
+    
+    with _UID_STATE_LOCK:
+        if not _UID_STATE:
+            return
+        data = json.dumps(_UID_STATE, indent=2, sort_keys=True)
+    
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # Replace the file atomically, so an interrupted run can't leave it truncated
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.error(f"Error saving UID state to {path}: {e}")
+
 
 class EmailProcessor:
     """
@@ -23,6 +494,9 @@ class EmailProcessor:
     Uses IMAP protocol to interact with the email server (Proton Mail Bridge).
     """
 
+    # Whether process_emails() works on its own asyncio IMAP session instead of `connection`
+    uses_async_session = False
+
     def __init__(self):
         """Initialize the email processor with configuration from config.py."""
         self.imap_server = EMAIL_CONFIG['imap_server']
@@ -30,113 +504,328 @@ class EmailProcessor:
         self.username = EMAIL_CONFIG['username']
         self.password = EMAIL_CONFIG['password']
         self.use_ssl = EMAIL_CONFIG['use_ssl']
+        self.max_connections = EMAIL_CONFIG['max_connections']
         self.connection = None
+        # Folder selected on the connection, restored after reconnecting
+        self._selected_folder = None
+        # (listed at, folder names, folder names by lowercase name) of the last LIST
+        self._folder_cache: Optional[Tuple[float, List[str], Dict[str, str]]] = None
+        self._folder_cache_ttl = FOLDER_CACHE_TTL
+        # UIDs waiting to be moved out of the selected folder, by destination folder
+        self._pending_moves: Dict[str, List[str]] = {}
+        # UIDs copied out of the selected folder and flagged as deleted, expunged together by expunge_pending()
+        self._pending_expunge: List[str] = []
+        # Capabilities of the connection, looked up once after LOGIN
+        self._caps: frozenset = frozenset()
+        self._supports_move = False
+        self._supports_uidplus = False
+        self._supports_condstore = False
+        # Personal namespace prefix and hierarchy delimiter, used to build folder names
+        self._ns_prefix = ''
+        self._ns_delim = '/'
+        # UIDVALIDITY of the selected folder; UIDs of other values can't be compared
+        self._uidvalidity: Optional[int] = None
+        # Per UID state key: UIDs found by the last search (ascending), the ones completed since,
+        # and how many of the lowest are all completed; the high-water mark never passes the rest
+        self._search_progress: Dict[str, Tuple[List[int], Set[int], int]] = {}
         self.folders_to_process = PROCESSING_CONFIG['folders_to_process']
         self.max_email_size_kb = PROCESSING_CONFIG['max_email_size_kb']
         self.include_attachments = PROCESSING_CONFIG['include_attachments']
+        # Email data fields the processor function reads, the others are not fetched or parsed
+        self.needs = ALL_NEEDS
         self.batch_size = PROCESSING_CONFIG['batch_size']
         self.max_emails_per_run = PROCESSING_CONFIG['max_emails_per_run']
         self.skip_processed = PROCESSING_CONFIG['skip_processed']
+        # Minimum duration of a batch, in seconds
+        self.min_batch_interval = PROCESSING_CONFIG['min_batch_interval_ms'] / 1000
 
     def connect(self) -> bool:
         """
-        Establish a connection to the IMAP server.
+        Establish a connection to the IMAP server, reusing an idle pooled connection if there is one.
         
         Returns:
             bool: True if connection was successful, False otherwise.
         """
+        if self.connection is not None:
+            # Still logged in, nothing to do
+            if self.connection.state in ('AUTH', 'SELECTED'):
+                return True
+            self.connection = None
+            self._selected_folder = None
+        
+        with _POOL_LOCK:
+            pooled = _CONNECTION_POOL.get(self._pool_key())
+            while pooled and self.connection is None:
+                connection = pooled.pop()
+                if connection.state in ('AUTH', 'SELECTED'):
+                    self.connection = connection
+        if self.connection is not None:
+            logger.debug(f"Reusing pooled connection to {self.imap_server}")
+            self._set_capabilities(_CAPABILITIES.get(self._pool_key(), frozenset(self.connection.capabilities)))
+            self._ns_prefix, self._ns_delim = _NAMESPACES.get(self._pool_key(), ('', '/'))
+            return True
+        
+        return self._open_connection()
+
+    def __enter__(self) -> 'EmailProcessor':
+        """Connect, for use as a context manager; check `connection` to see if it succeeded."""
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Release the connection back to the pool."""
+        self.disconnect()
+
+    def keep_alive(self) -> bool:
+        """
+        Send a NOOP on the active connection so the server doesn't drop it while idle,
+        reconnecting if it was dropped already. Idle pooled connections are kept alive automatically.
+        
+        Returns:
+            bool: True if the connection is alive, False otherwise.
+        """
+        if not self.connection:
+            return self.connect()
+        
+        try:
+            status, _ = self._imap('noop')
+            return status == 'OK'
+        except Exception as e:
+            logger.error(f"Error keeping the IMAP connection alive: {e}")
+            return False
+
+    def _pool_key(self) -> Tuple[str, int, str]:
+        """
+        Get the key of this processor's connections in the connection pool.
+        
+        Returns:
+            Tuple[str, int, str]: (server, port, username)
+        """
+        return self.imap_server, self.imap_port, self.username
+
+    def _open_connection(self) -> bool:
+        """
+        Open and log in a new connection to the IMAP server.
+        
+        Returns:
+            bool: True if connection was successful, False otherwise.
+        """
+        self._selected_folder = None
         try:
             # Try different connection methods
             try:
                 if self.use_ssl:
                     # Try with SSL first
                     logger.debug("Attempting to connect with SSL")
-                    self.connection = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+                    self.connection = _BufferedIMAP4_SSL(self.imap_server, self.imap_port)
                 else:
                     # Try without SSL
                     logger.debug("Attempting to connect without SSL")
-                    self.connection = imaplib.IMAP4(self.imap_server, self.imap_port)
+                    self.connection = _BufferedIMAP4(self.imap_server, self.imap_port)
             except Exception as e:
                 logger.debug(f"First connection attempt failed: {e}")
                 # If the first attempt fails, try the opposite approach
                 if self.use_ssl:
                     logger.debug("Retrying without SSL")
-                    self.connection = imaplib.IMAP4(self.imap_server, self.imap_port)
+                    self.connection = _BufferedIMAP4(self.imap_server, self.imap_port)
                 else:
                     logger.debug("Retrying with SSL")
-                    self.connection = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+                    self.connection = _BufferedIMAP4_SSL(self.imap_server, self.imap_port)
             
             # Login to the server
             self.connection.login(self.username, self.password)
+            self._discover_capabilities()
+            self._discover_namespace()
             
             logger.info(f"Successfully connected to {self.imap_server}")
             return True
         except imaplib.IMAP4.error as e:
             logger.error(f"Failed to login to IMAP server: {e}")
+            self.connection = None
             return False
         except Exception as e:
             logger.error(f"Failed to connect to IMAP server: {e}")
+            self.connection = None
             return False
 
+    def _discover_capabilities(self) -> None:
+        """Ask for the capabilities once after LOGIN, since servers may announce more than in the greeting."""
+        capabilities = frozenset(self.connection.capabilities)
+        try:
+            status, data = self.connection.capability()
+            if status == 'OK' and data and data[0]:
+                capabilities = frozenset(data[0].decode('ascii', errors='replace').upper().split())
+        except Exception as e:
+            logger.debug(f"CAPABILITY command failed, using the greeting's capabilities: {e}")
+        
+        _CAPABILITIES[self._pool_key()] = capabilities
+        self._set_capabilities(capabilities)
+
+    def _set_capabilities(self, capabilities: frozenset) -> None:
+        """
+        Set the capabilities of the connection and the extensions they enable.
+        
+        Args:
+            capabilities: Capability names, in upper case.
+        """
+        self._caps = capabilities
+        self._supports_move = 'MOVE' in capabilities
+        self._supports_uidplus = 'UIDPLUS' in capabilities
+        self._supports_condstore = 'CONDSTORE' in capabilities
+
+    def _discover_namespace(self) -> None:
+        """Learn the personal namespace prefix and hierarchy delimiter with one NAMESPACE command."""
+        if 'NAMESPACE' not in self._caps:
+            return
+        
+        try:
+            status, data = self.connection.namespace()
+            if status != 'OK' or not data or not data[0]:
+                return
+            
+            match = _NAMESPACE_RE.match(data[0])
+            if match:
+                self._ns_prefix = match.group(1).decode('utf-8')
+                self._ns_delim = (match.group(2) or b'/').decode('utf-8')
+                _NAMESPACES[self._pool_key()] = (self._ns_prefix, self._ns_delim)
+                logger.debug(f"Personal namespace: prefix '{self._ns_prefix}', delimiter '{self._ns_delim}'")
+        except Exception as e:
+            logger.debug(f"NAMESPACE command failed: {e}")
+
+    def _find_folder(self, folder_name: str, folders: Iterable[str]) -> Optional[str]:
+        """
+        Find the name under which a folder appears in the folder list.
+        
+        Args:
+            folder_name: Name of the folder, as configured.
+            folders: Folder names from LIST.
+            
+        Returns:
+            Optional[str]: The folder's name on the server, or None if it is not in the list.
+        """
+        by_lower = folders if isinstance(folders, dict) else {folder.lower(): folder for folder in folders}
+        
+        nested = folder_name.replace('/', self._ns_delim)
+        candidates = [
+            folder_name,                                # As configured
+            f'{self._ns_prefix}{nested}',               # In the personal namespace
+            f'Folders{self._ns_delim}{nested}',         # As a subfolder of Folders
+            f'Labels{self._ns_delim}{nested}'           # As a subfolder of Labels
+        ]
+        for candidate in candidates:
+            found = by_lower.get(candidate.lower())
+            if found:
+                return found
+        return None
+
+    def _canonical(self, folder_name: str, folders: Optional[Iterable[str]] = None) -> str:
+        """
+        Build the server-side name of a folder.
+        
+        Existing folders are looked up in the (cached) folder list, new ones are placed in the
+        personal namespace using the server's hierarchy delimiter.
+        
+        Args:
+            folder_name: Name of the folder, as configured.
+            folders: Optional folder names from LIST, defaults to the cached folder list.
+            
+        Returns:
+            str: The folder name to use in IMAP commands, unquoted.
+        """
+        if folders is None:
+            self.get_folders()
+            folders = self._folder_cache[2] if self._folder_cache else {}
+        
+        found = self._find_folder(folder_name, folders)
+        if found:
+            return found
+        if folder_name.upper() == 'INBOX':
+            return 'INBOX'
+        return f'{self._ns_prefix}{folder_name.replace("/", self._ns_delim)}'
+
+    @staticmethod
+    def _quote(folder_name: str) -> str:
+        """
+        Encode (in modified UTF-7) and quote a folder name for use in an IMAP command.
+        
+        Args:
+            folder_name: Folder name.
+            
+        Returns:
+            str: The folder name as an IMAP quoted string.
+        """
+        escaped = _encode_mutf7(folder_name).replace('\\', '\\\\').replace('"', '\\"')
+        return f'"{escaped}"'
+
     def disconnect(self) -> None:
-        """Close the connection to the IMAP server."""
+        """
+        Release the connection to the IMAP server.
+        
+        The connection is kept logged in in the connection pool, pinged with NOOP while idle,
+        and logged out when the process exits (see close_pool()). The highest processed UID of
+        every folder is saved to the UID state file.
+        """
+        save_uid_state()
         if self.connection:
-            try:
-                self.connection.logout()
-                logger.info("Disconnected from IMAP server")
-            except Exception as e:
-                logger.error(f"Error during IMAP logout: {e}")
-            finally:
-                self.connection = None
+            self.expunge_pending()
+            with _POOL_LOCK:
+                _CONNECTION_POOL.setdefault(self._pool_key(), []).append(self.connection)
+            self.connection = None
+            self._selected_folder = None
+            _schedule_noop()
+
+    def _imap(self, command: str, *args):
+        """
+        Run an IMAP command, reconnecting once if the connection was dropped.
+        
+        Args:
+            command: Name of the imaplib command method, e.g. 'fetch'.
+            *args: Arguments of the command.
+            
+        Returns:
+            The (status, data) response of the command.
+        """
+        try:
+            response = getattr(self.connection, command)(*args)
+        except (imaplib.IMAP4.abort, OSError) as e:
+            logger.warning(f"IMAP connection lost during {command.upper()}, reconnecting: {e}")
+            selected_folder = self._selected_folder
+            self.connection = None
+            if not self._open_connection():
+                raise
+            if selected_folder and command != 'select':
+                self.connection.select(selected_folder)
+                self._selected_folder = selected_folder
+            response = getattr(self.connection, command)(*args)
+        
+        if command == 'select' and response[0] == 'OK':
+            self._selected_folder = args[0]
+        return response
 
     def get_folders(self) -> List[str]:
         """
         Get a list of all folders in the mailbox.
         
+        The list is cached for `FOLDER_CACHE_TTL` seconds.
+        
         Returns:
             List[str]: List of folder names.
         """
+        if self._folder_cache and time.monotonic() - self._folder_cache[0] < self._folder_cache_ttl:
+            return self._folder_cache[1]
+        
         if not self.connection:
             if not self.connect():
                 return []
         
         try:
-            status, folders = self.connection.list()
+            status, folders = self._imap('list')
             if status != 'OK':
                 logger.error(f"Failed to get folders: {status}")
                 return []
             
-            # Parse folder names from response
-            folder_list = []
-            for folder in folders:
-                if isinstance(folder, bytes):
-                    folder = folder.decode('utf-8', errors='replace')
-                
-                logger.debug(f"Raw folder entry: {folder}")
-                
-                # Try different regex patterns to extract folder names
-                # Pattern 1: Standard quoted format at the end
-                match = re.search(r'"([^"]*)"$', folder)
-                if match:
-                    folder_list.append(match.group(1))
-                    continue
-                
-                # Pattern 2: Look for folder name after the last delimiter
-                match = re.search(r'(?:\s|\|)\s*"?([^"]+)"?$', folder)
-                if match:
-                    folder_list.append(match.group(1))
-                    continue
-                
-                # Pattern 3: Look for anything after "INBOX."
-                match = re.search(r'INBOX\.(.+?)(?:\s|$)', folder)
-                if match:
-                    folder_list.append(match.group(1))
-                    continue
-                
-                # Add INBOX if it's in the response
-                if "INBOX" in folder:
-                    if "INBOX" not in folder_list:
-                        folder_list.append("INBOX")
+            folder_list = self._parse_folder_list(folders)
+            self._folder_cache = (time.monotonic(), folder_list, {folder.lower(): folder for folder in folder_list})
             
             logger.info(f"Detected folders: {folder_list}")
             return folder_list
@@ -144,6 +833,62 @@ class EmailProcessor:
             logger.error(f"Error getting folders: {e}")
             return []
 
+    def _parse_folder_list(self, folders: List[Any]) -> List[str]:
+        """
+        Parse folder names from the lines of a LIST response.
+        
+        Args:
+            folders: Lines of the LIST response, as bytes or str.
+            
+        Returns:
+            List[str]: List of folder names, decoded from modified UTF-7.
+        """
+        folder_list = []
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for folder in folders:
+            if isinstance(folder, tuple):
+                # Name sent as a literal: (b'(flags) "delimiter" {length}', name)
+                folder_list.append(_decode_mutf7(folder[1].decode('utf-8', errors='replace')))
+                continue
+            if isinstance(folder, bytes):
+                folder = folder.decode('utf-8', errors='replace')
+            
+            if debug:
+                logger.debug(f"Raw folder entry: {folder}")
+            
+            # Standard format: (flags) "delimiter" name
+            match = _LIST_RE.match(folder)
+            if match:
+                quoted, atom = match.groups()
+                folder_list.append(_decode_mutf7(_LIST_UNESCAPE_RE.sub(r'\1', quoted) if quoted is not None else atom))
+                continue
+            
+            # Try different regex patterns to extract folder names
+            # Pattern 1: Standard quoted format at the end
+            match = _FOLDER_QUOTED_RE.search(folder)
+            if match:
+                folder_list.append(_decode_mutf7(match.group(1)))
+                continue
+            
+            # Pattern 2: Look for folder name after the last delimiter
+            match = _FOLDER_TAIL_RE.search(folder)
+            if match:
+                folder_list.append(_decode_mutf7(match.group(1)))
+                continue
+            
+            # Pattern 3: Look for anything after "INBOX."
+            match = _FOLDER_INBOX_RE.search(folder)
+            if match:
+                folder_list.append(_decode_mutf7(match.group(1)))
+                continue
+            
+            # Add INBOX if it's in the response
+            if "INBOX" in folder:
+                if "INBOX" not in folder_list:
+                    folder_list.append("INBOX")
+        
+        return folder_list
+
     def create_folder_if_not_exists(self, folder_name: str) -> bool:
         """
         Create a folder if it doesn't already exist.
@@ -159,186 +904,587 @@ class EmailProcessor:
                 return False
         
         try:
-            folders = self.get_folders()
-            if folder_name in folders:
+            if self.folder_exists(folder_name):
                 return True
             
-            # Try different formats for folder creation
-            # Some IMAP servers are picky about the format
-            formats_to_try = [
-                f'"{folder_name}"',  # Standard format with quotes
-                folder_name,         # Without quotes
-                f'INBOX.{folder_name}',  # As a subfolder of INBOX
-                f'INBOX/{folder_name}',  # As a subfolder of INBOX with slash
-                f'Folders/{folder_name}',  # As a subfolder of Folders
-                f'Labels/{folder_name}'  # As a subfolder of Labels
-            ]
-            
-            for folder_format in formats_to_try:
-                try:
-                    logger.debug(f"Attempting to create folder with format: {folder_format}")
-                    status, response = self.connection.create(folder_format)
-                    if status == 'OK':
-                        logger.info(f"Created folder: {folder_name}")
-                        return True
-                except Exception as e:
-                    logger.debug(f"Failed to create folder with format {folder_format}: {e}")
-                    continue
+            created = self._canonical(folder_name)
+            status, response = self._imap('create', self._quote(created))
+            if status == 'OK':
+                logger.info(f"Created folder: {folder_name}")
+                # Add the folder to the cached list instead of listing all folders again
+                if self._folder_cache:
+                    listed_at, folder_list, folders_by_lower = self._folder_cache
+                    self._folder_cache = (listed_at, folder_list + [created], {**folders_by_lower, created.lower(): created})
+                return True
             
-            # If we get here, all formats failed
-            logger.error(f"Failed to create folder {folder_name} with all attempted formats")
+            logger.error(f"Failed to create folder {folder_name}: {response}")
             return False
         except Exception as e:
             logger.error(f"Error creating folder {folder_name}: {e}")
             return False
 
-    def select_folder(self, folder_name: str) -> int:
+    def select_folder(self, folder_name: str) -> int:
+        """
+        Select a folder to work with.
+        
+        Args:
+            folder_name: Name of the folder to select.
+            
+        Returns:
+            int: Number of messages in the folder, or -1 if selection failed.
+        """
+        if not self.connection:
+            if not self.connect():
+                return -1
+        
+        try:
+            mailbox = self._quote(self._canonical(folder_name))
+            # EXPUNGE only applies to the selected folder
+            if self._pending_expunge and self._selected_folder != mailbox:
+                self.expunge_pending()
+            status, data = self._imap('select', mailbox)
+            if status == 'OK':
+                message_count = int(data[0])
+                uidvalidity = self.connection.response('UIDVALIDITY')[1]
+                self._uidvalidity = int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else None
+                logger.info(f"Selected folder {folder_name} with {message_count} messages")
+                return message_count
+            
+            logger.error(f"Failed to select folder {folder_name}: {data}")
+            return -1
+        except Exception as e:
+            logger.error(f"Error selecting folder {folder_name}: {e}")
+            return -1
+
+    def search_emails(self, criteria: str = 'ALL') -> List[str]:
+        """
+        Search for emails matching the given criteria.
+        
+        Args:
+            criteria: IMAP search criteria (default: 'ALL').
+            
+        Returns:
+            List[str]: List of email UIDs matching the criteria.
+        """
+        return self._search(criteria) or []
+
+    def _search(self, criteria: str) -> Optional[List[str]]:
+        """
+        Search for emails matching the given criteria.
+        
+        Args:
+            criteria: IMAP search criteria.
+            
+        Returns:
+            Optional[List[str]]: List of email UIDs matching the criteria, or None if the search failed.
+        """
+        if not self.connection:
+            logger.error("Not connected to IMAP server")
+            return None
+        
+        try:
+            # UIDs stay valid while other messages are moved out of the folder, sequence numbers don't
+            status, data = self._imap('uid', 'SEARCH', criteria)
+            if status != 'OK':
+                logger.error(f"Search failed: {data}")
+                return None
+            
+            # Parse email IDs
+            email_ids = data[0].split()
+            return [eid.decode('utf-8') for eid in email_ids]
+        except Exception as e:
+            logger.error(f"Error searching emails: {e}")
+            return None
+
+    def get_unprocessed_emails(self, folder_name: str, limit: int = None) -> List[str]:
+        """
+        Get a list of unprocessed email UIDs from the specified folder.
+        
+        Args:
+            folder_name: Name of the folder to search in.
+            limit: Maximum number of emails to return.
+            
+        Returns:
+            List[str]: List of unprocessed email UIDs.
+        """
+        if self.select_folder(folder_name) <= 0:
+            return []
+        
+        # If we're not skipping processed emails, just get all emails
+        if not self.skip_processed:
+            email_ids = self.search_emails('ALL')
+        else:
+            # Only search emails above the highest UID processed by earlier runs
+            high_water_uid = self._high_water_uid()
+            uid_range = f'UID {high_water_uid + 1}:* ' if high_water_uid else ''
+            
+            # Some IMAP servers might not support UNKEYWORD search, the UID range still skips processed emails then
+            email_ids = self._search(f'{uid_range}UNDELETED UNKEYWORD PROCESSED')
+            if email_ids is None:
+                logger.warning("Failed to search with UNKEYWORD criteria, searching by UID only")
+                email_ids = self.search_emails(f'{uid_range}UNDELETED')
+            
+            # n:* always matches the newest email, even when its UID is below n
+            if high_water_uid:
+                email_ids = [eid for eid in email_ids if int(eid) > high_water_uid]
+        
+        # Apply limit if specified
+        if limit and len(email_ids) > limit:
+            email_ids = email_ids[:limit]
+        
+        self._remember_search(email_ids)
+        return email_ids
+
+    def _remember_search(self, email_ids: List[str]) -> None:
+        """
+        Remember the UIDs a search of the selected folder returned, for _advance_high_water_uid.
+        
+        Args:
+            email_ids: UIDs returned by the search.
+        """
+        key = self._uid_state_key()
+        if key is not None:
+            self._search_progress[key] = (sorted(int(eid) for eid in email_ids), set(), 0)
+
+    def _uid_state_key(self) -> Optional[str]:
+        """
+        Build the UID state key of the selected folder.
+        
+        Returns:
+            Optional[str]: The key, or None if no folder with a known UIDVALIDITY is selected.
+        """
+        if not PROCESSING_CONFIG['uid_state_file'] or not self._selected_folder or self._uidvalidity is None:
+            return None
+        return f"{self.username}@{self.imap_server}:{self.imap_port}/{self._selected_folder}"
+
+    def _high_water_uid(self) -> int:
+        """
+        Get the highest UID processed in the selected folder by earlier runs.
+        
+        Returns:
+            int: The UID, or 0 if all emails of the folder should be searched.
+        """
+        key = self._uid_state_key()
+        if key is None:
+            return 0
+        
+        with _UID_STATE_LOCK:
+            entry = _uid_state().get(key)
+        # A new UIDVALIDITY means the folder's UIDs were reassigned
+        if not entry or entry.get('uidvalidity') != self._uidvalidity:
+            return 0
+        return entry.get('uid', 0)
+
+    def _advance_high_water_uid(self, uid_set: str) -> None:
+        """
+        Record that the emails of a UID set in the selected folder were flagged or moved.
+        
+        The high-water mark only advances across the lowest searched UIDs that are all completed,
+        so emails that failed to fetch or parse, or weren't reached before the run ended, are
+        searched again by the next run. The PROCESSED keyword stays authoritative below the mark.
+        
+        Args:
+            uid_set: UID of an email, or a comma-separated UID set.
+        """
+        key = self._uid_state_key()
+        progress = self._search_progress.get(key) if key is not None else None
+        if progress is None:
+            return
+        
+        searched, completed, done = progress
+        completed.update(int(eid) for eid in uid_set.split(','))
+        while done < len(searched) and searched[done] in completed:
+            done += 1
+        self._search_progress[key] = (searched, completed, done)
+        if done == 0:
+            return
+        
+        uid = searched[done - 1]
+        with _UID_STATE_LOCK:
+            state = _uid_state()
+            entry = state.get(key)
+            if not entry or entry.get('uidvalidity') != self._uidvalidity:
+                state[key] = {'uidvalidity': self._uidvalidity, 'uid': uid}
+            elif uid > entry['uid']:
+                entry['uid'] = uid
+
+    def _mailbox_key(self) -> Optional[str]:
+        """
+        Build a key identifying the UIDs of the selected folder.
+        
+        Returns:
+            Optional[str]: The key, or None if no folder with a known UIDVALIDITY is selected.
+        """
+        if not self._selected_folder or self._uidvalidity is None:
+            return None
+        return f"{self.username}@{self.imap_server}:{self.imap_port}/{self._selected_folder};UIDVALIDITY={self._uidvalidity}"
+
+    def split_known_routes(self, email_ids: List[str], category_folders: Tuple[str, ...]
+                           ) -> Tuple[List[Tuple[Dict[str, Any], int]], List[str]]:
+        """
+        Separate the emails of the selected folder that an earlier run already classified.
+        
+        Args:
+            email_ids: UIDs of the emails to process.
+            category_folders: Destination folder of each category index.
+            
+        Returns:
+            Tuple: ((email data, category index) pairs of the known emails, ready for
+            route_emails, and the UIDs that still need to be fetched and classified)
+        """
+        cache = _routed_cache()
+        mailbox = self._mailbox_key()
+        if not cache or not mailbox or not email_ids:
+            return [], email_ids
+        
+        known = cache.get_many(mailbox, email_ids)
+        if not known:
+            return [], email_ids
+        
+        category_idx_by_folder = {folder: idx for idx, folder in enumerate(category_folders)}
+        routed = []
+        remaining = []
+        for email_id in email_ids:
+            category_idx = category_idx_by_folder.get(known.get(email_id))
+            if category_idx is None:
+                # Unknown, or the category was removed since
+                remaining.append(email_id)
+            else:
+                routed.append(({'id': email_id, 'subject': '', 'sender': ''}, category_idx))
+        
+        if routed:
+            logger.info(f"Routing {len(routed)} emails classified by an earlier run without fetching them")
+        return routed, remaining
+
+    def _record_routes(self, routed: Iterable[Tuple[Dict[str, Any], Optional[int]]],
+                       category_folders: Tuple[str, ...]) -> None:
+        """
+        Remember the destination folder of classified emails of the selected folder.
+        
+        Args:
+            routed: (email data, category index or None) pairs.
+            category_folders: Destination folder of each category index.
+        """
+        cache = _routed_cache()
+        mailbox = self._mailbox_key()
+        if not cache or not mailbox:
+            return
+        
+        cache.set_many(mailbox, [(email_data['id'], category_folders[category_idx])
+                                 for email_data, category_idx in routed if category_idx is not None])
+
+    def fetch_email(self, email_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch and parse an email by UID.
+        
+        Args:
+            email_id: UID of the email to fetch.
+            
+        Returns:
+            Optional[Dict[str, Any]]: Parsed email data or None if fetching failed.
+        """
+        return next(self.fetch_emails_bulk([email_id]), None)
+
+    def fetch_emails_bulk(self, email_ids: List[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Fetch and parse several emails, with few UID FETCH commands per batch of UIDs.
+        
+        The sizes of the batch are fetched first, so emails over the size limit are marked as
+        processed without downloading them. Unless attachments are needed, the BODYSTRUCTURE is
+        fetched along with them, so only the start of each email's text part is downloaded.
+        
+        Args:
+            email_ids: UIDs of the emails to fetch.
+            
+        Yields:
+            Dict[str, Any]: Parsed email data, for every email that could be fetched.
+        """
+        if not self.connection:
+            logger.error("Not connected to IMAP server")
+            return
+        
+        # Servers limit the length of a command line, so keep the message sets short
+        chunk_size = max(1, min(self.batch_size, MAX_FETCH_BATCH))
+        
+        for i in range(0, len(email_ids), chunk_size):
+            chunk = email_ids[i:i + chunk_size]
+            
+            # Without the probe (it failed, even for a single email) the whole chunk is fetched with _fetch_items()
+            structures = self._fetch_chunk(chunk, self._probe_items())
+            oversized: List[str] = []
+            plans = self._plan_fetches(chunk, structures, oversized)
+            if oversized:
+                self.mark_as_processed(','.join(oversized))
+            
+            for items, (uids, parts, sizes) in plans.items():
+                for message in self._fetch_messages(uids, items) or []:
+                    email_id = message['uid']
+                    if email_id not in sizes:
+                        continue
+                    
+                    raw_email = self._raw_fetched(message, parts.get(email_id))
+                    email_data = self._parse_email(email_id, raw_email, sizes[email_id] or message['size'])
+                    if email_data:
+                        yield email_data
+
+    def _fetch_messages(self, chunk: List[str], items: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Fetch data items of the emails of one UID set, one by one if fetching them at once fails.
+        
+        Args:
+            chunk: UIDs of the emails to fetch.
+            items: FETCH data items, without the enclosing parentheses.
+            
+        Returns:
+            Optional[List[Dict[str, Any]]]: The messages of the response (see _group_fetch_response),
+            or None if the command failed for every email.
+        """
+        messages = self._fetch_chunk(chunk, items)
+        if messages is None and len(chunk) > 1:
+            # One bad message (or a server limit) fails the whole command, fetch them one by one
+            logger.warning(f"Fetching {len(chunk)} emails at once failed, fetching them one by one")
+            responses = [self._fetch_chunk([email_id], items) for email_id in chunk]
+            if all(response is None for response in responses):
+                return None
+            messages = [message for response in responses for message in response or []]
+        return messages
+
+    def _fetch_chunk(self, chunk: List[str], items: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Fetch data items of the emails of one UID set with a single UID FETCH command.
+        
+        Args:
+            chunk: UIDs of the emails to fetch.
+            items: FETCH data items, without the enclosing parentheses.
+            
+        Returns:
+            Optional[List[Dict[str, Any]]]: The messages of the response (see _group_fetch_response),
+            or None if the command failed.
+        """
+        try:
+            status, data = self._imap('uid', 'FETCH', ','.join(chunk), f'(UID {items})')
+            if status != 'OK':
+                logger.error(f"Failed to fetch emails {','.join(chunk)}: {data}")
+                return None
+        except Exception as e:
+            logger.error(f"Error fetching emails {','.join(chunk)}: {e}")
+            return None
+        
+        # Literals come as (prefix, literal) tuples, each message ends with a closing b')'
+        pieces = [item if isinstance(item, tuple) else (item, None) for item in data]
+        return self._group_fetch_response(pieces)
+
+    def _fetch_items(self) -> str:
+        """
+        Build the FETCH data items needed to classify an email.
+        
+        Only the headers used for classification and the first `max_email_size_kb` of the text
+        are fetched, unless attachments are needed, which requires the whole message, or the
+        body is not needed at all. BODY.PEEK leaves the \\Seen flag untouched.
+        
+        Returns:
+            str: The FETCH data items, without the enclosing parentheses.
+        """
+        if self._needs_attachments():
+            return 'RFC822.SIZE RFC822'
+        if 'body' not in self.needs:
+            return f'RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({PART_HEADER_FIELDS})]'
+        
+        max_bytes = self.max_email_size_kb * 1024
+        return f'RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({FETCH_HEADER_FIELDS})] BODY.PEEK[TEXT]<0.{max_bytes}>'
+
+    def _probe_items(self) -> str:
+        """
+        Get the FETCH data items fetched for a batch before any email is downloaded.
+        
+        Returns:
+            str: SIZE_FETCH_ITEMS if whole emails are needed for their attachments or only the
+            headers are needed, otherwise STRUCTURE_FETCH_ITEMS.
+        """
+        if self._needs_attachments() or 'body' not in self.needs:
+            return SIZE_FETCH_ITEMS
+        return STRUCTURE_FETCH_ITEMS
+
+    def _needs_attachments(self) -> bool:
+        """Whether attachments are enabled and read by the processor function."""
+        return self.include_attachments and 'attachments' in self.needs
+
+    def _set_needs(self, processor_func) -> None:
         """
-        Select a folder to work with.
+        Only fetch and parse the email data fields the processor function reads.
         
         Args:
-            folder_name: Name of the folder to select.
+            processor_func: Processor function, with an optional `needs` attribute listing the
+                fields it reads (see ALL_NEEDS); all fields are parsed without one.
+        """
+        self.needs = frozenset(getattr(processor_func, 'needs', ALL_NEEDS))
+
+    def _plan_fetches(self, chunk: List[str], structures: Optional[List[Dict[str, Any]]],
+                      oversized: Optional[List[str]] = None
+                      ) -> Dict[str, Tuple[List[str], Dict[str, Tuple[str, str, Optional[str], str]], Dict[str, Optional[int]]]]:
+        """
+        Decide which data items to fetch for each email of a UID set.
+        
+        Args:
+            chunk: UIDs of the emails to fetch.
+            structures: Response of the _probe_items() fetch of `chunk`, or None to fetch all
+                emails with _fetch_items().
+            oversized: If given, the UIDs of the emails over the size limit, which are not
+                fetched, are appended to this list.
             
         Returns:
-            int: Number of messages in the folder, or -1 if selection failed.
+            Dict: For each FETCH data items string, the UIDs to fetch with it, the text part of
+            each of them (see _find_text_part) and the size of each of them, if known.
         """
-        if not self.connection:
-            if not self.connect():
-                return -1
+        if structures is None:
+            return {self._fetch_items(): (chunk, {}, {email_id: None for email_id in chunk})}
         
-        try:
-            # Try different formats for folder selection
-            formats_to_try = [
-                folder_name,                # Standard format
-                f'"{folder_name}"',         # Quoted format
-                f'INBOX/{folder_name}',     # As a subfolder of INBOX with slash
-                f'INBOX.{folder_name}',     # As a subfolder of INBOX with dot
-                f'Folders/{folder_name}',   # As a subfolder of Folders
-                f'Labels/{folder_name}'     # As a subfolder of Labels
-            ]
-            
-            for folder_format in formats_to_try:
-                try:
-                    logger.debug(f"Attempting to select folder with format: {folder_format}")
-                    status, data = self.connection.select(folder_format)
-                    if status == 'OK':
-                        message_count = int(data[0])
-                        logger.info(f"Selected folder {folder_name} with {message_count} messages")
-                        return message_count
-                except Exception as e:
-                    logger.debug(f"Failed to select folder with format {folder_format}: {e}")
-                    continue
+        requested = set(chunk)
+        max_bytes = self.max_email_size_kb * 1024
+        plans = {}
+        for message in structures:
+            email_id = message['uid']
+            if email_id not in requested:
+                continue
             
-            # If we get here, all formats failed
-            logger.error(f"Failed to select folder {folder_name} with all attempted formats")
-            return -1
-        except Exception as e:
-            logger.error(f"Error selecting folder {folder_name}: {e}")
-            return -1
+            size = message['size']
+            if size is not None and size > max_bytes:
+                logger.warning(f"Email {email_id} exceeds size limit ({size / 1024:.2f} KB > {self.max_email_size_kb} KB)")
+                if oversized is not None:
+                    oversized.append(email_id)
+                continue
+            
+            part = _find_text_part(message['structure']) if message['structure'] else None
+            if part is None:
+                # No text part found, fetch the start of the whole text instead
+                items = self._fetch_items()
+            else:
+                items = f'BODY.PEEK[HEADER.FIELDS ({PART_HEADER_FIELDS})] BODY.PEEK[{part[0]}]<0.{max_bytes}>'
+            
+            uids, parts, sizes = plans.setdefault(items, ([], {}, {}))
+            uids.append(email_id)
+            sizes[email_id] = size
+            if part is not None:
+                parts[email_id] = part
+        
+        return plans
 
-    def search_emails(self, criteria: str = 'ALL') -> List[str]:
+    def _group_fetch_response(self, pieces: List[Tuple[bytes, Optional[bytes]]]) -> List[Dict[str, Any]]:
         """
-        Search for emails matching the given criteria.
+        Group the pieces of a FETCH response by message.
         
         Args:
-            criteria: IMAP search criteria (default: 'ALL').
+            pieces: (prefix, literal) pairs in response order; literal is None for lines without one.
             
         Returns:
-            List[str]: List of email IDs matching the criteria.
+            List[Dict[str, Any]]: For each message, its sequence number, UID and size if returned,
+            the 'header', 'text' (or body part) and 'full' literals that were returned, and its
+            parsed 'structure' if BODYSTRUCTURE was fetched.
         """
-        if not self.connection:
-            logger.error("Not connected to IMAP server")
-            return []
-        
-        try:
-            status, data = self.connection.search(None, criteria)
-            if status != 'OK':
-                logger.error(f"Search failed: {data}")
-                return []
+        messages = []
+        message = None
+        for prefix, literal in pieces:
+            prefix = bytes(prefix)
+            match = _FETCH_START_RE.match(prefix)
+            if match:
+                message = {'seq': match.group(1).decode('utf-8'), 'uid': None, 'size': None,
+                           'header': b'', 'text': b'', 'full': None, 'structure': None, 'items': bytearray()}
+                messages.append(message)
+            if message is None:
+                continue
             
-            # Parse email IDs
-            email_ids = data[0].split()
-            return [eid.decode('utf-8') for eid in email_ids]
-        except Exception as e:
-            logger.error(f"Error searching emails: {e}")
-            return []
+            # Keep the data items outside of body literals, to parse the BODYSTRUCTURE from
+            message['items'] += prefix
+            
+            uid_match = _FETCH_UID_RE.search(prefix)
+            if uid_match:
+                message['uid'] = uid_match.group(1).decode('utf-8')
+            size_match = _FETCH_SIZE_RE.search(prefix)
+            if size_match:
+                message['size'] = int(size_match.group(1))
+            
+            if literal is None:
+                continue
+            # The literal belongs to the last data item of its prefix
+            item = prefix[prefix.rfind(b'BODY['):] if b'BODY[' in prefix else b''
+            if item.startswith(b'BODY[HEADER'):
+                message['header'] = bytes(literal)
+            elif item.startswith(b'BODY[TEXT') or item[5:6].isdigit():
+                message['text'] = bytes(literal)
+            elif item or b'BODYSTRUCTURE' not in message['items']:
+                message['full'] = bytes(literal)
+            else:
+                # A string inside the BODYSTRUCTURE, e.g. a file name, put it back as a quoted string
+                escaped = bytes(literal).replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+                message['items'][-len(prefix):] = _LITERAL_MARKER_RE.sub(b'', prefix) + b'"' + escaped + b'"'
+        
+        for message in messages:
+            items = message.pop('items')
+            start = items.find(b'BODYSTRUCTURE (')
+            if start >= 0:
+                message['structure'] = _parse_imap_list(bytes(items[start + len(b'BODYSTRUCTURE '):]))
+        
+        return messages
 
-    def get_unprocessed_emails(self, folder_name: str, limit: int = None) -> List[str]:
+    def _raw_fetched(self, message: Dict[str, Any],
+                     part: Optional[Tuple[str, str, Optional[str], str]] = None) -> bytes:
         """
-        Get a list of unprocessed email IDs from the specified folder.
+        Get the raw message bytes of a grouped FETCH response.
         
         Args:
-            folder_name: Name of the folder to search in.
-            limit: Maximum number of emails to return.
+            message: Message as returned by _group_fetch_response().
+            part: Text part that was fetched instead of the whole text (see _find_text_part), if any.
             
         Returns:
-            List[str]: List of unprocessed email IDs.
+            bytes: The whole message, or the fetched headers followed by the fetched text, as
+            a single-part message with the MIME headers of the text part if one was fetched.
         """
-        if self.select_folder(folder_name) <= 0:
-            return []
-        
-        # If we're not skipping processed emails, just get all emails
-        if not self.skip_processed:
-            email_ids = self.search_emails('ALL')
-        else:
-            try:
-                # Try to search for emails without our processed flag
-                # Some IMAP servers might not support KEYWORD search
-                email_ids = self.search_emails('NOT KEYWORD PROCESSED')
-            except Exception as e:
-                logger.warning(f"Failed to search with KEYWORD criteria: {e}")
-                # Fall back to getting all emails
-                email_ids = self.search_emails('ALL')
-                
-                # We'll filter processed emails manually later in the process_emails method
-        
-        # Apply limit if specified
-        if limit and len(email_ids) > limit:
-            return email_ids[:limit]
+        if message['full'] is not None:
+            return message['full']
+        if part is None:
+            return message['header'] + message['text']
         
-        return email_ids
+        _, content_type, charset, encoding = part
+        content_type_header = f'{content_type}; charset="{charset}"' if charset else content_type
+        mime_headers = (f"MIME-Version: 1.0\r\nContent-Type: {content_type_header}\r\n"
+                        f"Content-Transfer-Encoding: {encoding}\r\n\r\n")
+        headers = message['header'].rstrip(b'\r\n')
+        return (headers + b'\r\n' if headers else b'') + mime_headers.encode('ascii', errors='replace') + message['text']
 
-    def fetch_email(self, email_id: str) -> Optional[Dict[str, Any]]:
+    def _parse_email(self, email_id: str, raw_email: bytes, size: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """
-        Fetch and parse an email by ID.
+        Parse a raw RFC822 message into email data.
         
         Args:
-            email_id: ID of the email to fetch.
+            email_id: UID of the email.
+            raw_email: Raw message bytes, possibly only the headers and part of the text.
+            size: Size of the whole message as reported by the server, if known.
             
         Returns:
-            Optional[Dict[str, Any]]: Parsed email data or None if fetching failed.
+            Optional[Dict[str, Any]]: Parsed email data or None if parsing failed or the email is too large.
         """
-        if not self.connection:
-            logger.error("Not connected to IMAP server")
-            return None
-        
         try:
-            status, data = self.connection.fetch(email_id, '(RFC822)')
-            if status != 'OK':
-                logger.error(f"Failed to fetch email {email_id}: {data}")
-                return None
-            
-            raw_email = data[0][1]
-            email_message = email.message_from_bytes(raw_email)
-            
             # Check email size
-            email_size_kb = len(raw_email) / 1024
+            email_size_kb = (len(raw_email) if size is None else size) / 1024
             if email_size_kb > self.max_email_size_kb:
                 logger.warning(f"Email {email_id} exceeds size limit ({email_size_kb:.2f} KB > {self.max_email_size_kb} KB)")
                 return None
             
+            email_message = _MESSAGE_PARSER.parsebytes(raw_email)
+            
             # Parse email data
             subject = self._decode_header(email_message.get('Subject', ''))
             sender = self._decode_header(email_message.get('From', ''))
             date = self._decode_header(email_message.get('Date', ''))
             
-            # Get email body
-            body = self._get_email_body(email_message)
-            
-            # Get attachments if needed
+            # Get email body, and the attachments if needed, in one walk over the parts
             attachments = []
-            if self.include_attachments:
-                attachments = self._get_attachments(email_message)
+            if 'body' in self.needs:
+                body = self._get_email_body(email_message, attachments if self._needs_attachments() else None)
+            else:
+                body = ''
+                if self._needs_attachments():
+                    attachments = self._get_attachments(email_message)
             
             return {
                 'id': email_id,
@@ -347,10 +1493,11 @@ class EmailProcessor:
                 'date': date,
                 'body': body,
                 'attachments': attachments,
-                'raw_message': email_message
+                # Set by mailing lists and newsletters
+                'list_unsubscribe': 'List-Unsubscribe' in email_message
             }
         except Exception as e:
-            logger.error(f"Error fetching email {email_id}: {e}")
+            logger.error(f"Error parsing email {email_id}: {e}")
             return None
 
     def _decode_header(self, header: str) -> str:
@@ -366,74 +1513,97 @@ class EmailProcessor:
         if not header:
             return ""
         
-        try:
-            decoded_header = decode_header(header)
-            header_parts = []
-            
-            for content, encoding in decoded_header:
-                if isinstance(content, bytes):
-                    if encoding:
-                        header_parts.append(content.decode(encoding or 'utf-8', errors='replace'))
-                    else:
-                        header_parts.append(content.decode('utf-8', errors='replace'))
-                else:
-                    header_parts.append(str(content))
-            
-            return ''.join(header_parts)
-        except Exception as e:
-            logger.error(f"Error decoding header: {e}")
+        header = str(header)
+        # Plain ASCII headers without encoded words need no decoding
+        if header.isascii() and '=?' not in header:
             return header
+        
+        if len(header) > MAX_HEADER_LENGTH:
+            header = header[:MAX_HEADER_LENGTH]
+        
+        return _decode_encoded_words(header)
 
-    def _get_email_body(self, email_message) -> str:
+    def _get_email_body(self, email_message, attachments: Optional[List[Dict[str, Any]]] = None) -> str:
         """
-        Extract the body text from an email message.
+        Extract the body text from an email message, in a single walk over its parts.
+        
+        Unless the attachments are needed, the walk stops at the first plain text part.
         
         Args:
             email_message: Email message object.
+            attachments: If given, the information of the attachments found along the way
+                (see _get_attachments) is appended to this list.
             
         Returns:
             str: Email body text.
         """
         body = ""
         
+        if attachments is not None and not email_message.is_multipart():
+            attachment = self._attachment_info(email_message)
+            if attachment:
+                attachments.append(attachment)
+        
         if email_message.is_multipart():
+            # Collect the parts and join them once, instead of repeatedly copying a growing string
+            parts: List[str] = []
+            total = 0
+            max_chars = self.max_email_size_kb * 1024
             for part in email_message.walk():
                 content_type = part.get_content_type()
                 content_disposition = str(part.get("Content-Disposition"))
                 
                 # Skip attachments
                 if "attachment" in content_disposition:
+                    if attachments is not None:
+                        attachment = self._attachment_info(part)
+                        if attachment:
+                            attachments.append(attachment)
+                    continue
+                
+                # Only the attachments are still needed
+                if total >= max_chars:
                     continue
                 
                 if content_type == "text/plain":
                     try:
-                        payload = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or 'utf-8'
-                        body += payload.decode(charset, errors='replace')
+                        payload = self._decode_payload(part, max_chars - total)
+                        chunk = payload.decode(_codec_name(part.get_content_charset()), errors='replace')
                     except Exception as e:
                         logger.error(f"Error decoding plain text part: {e}")
-                elif content_type == "text/html" and not body:
+                        continue
+                elif content_type == "text/html" and not parts:
                     # Use HTML content if no plain text is available
                     try:
-                        payload = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or 'utf-8'
-                        html_body = payload.decode(charset, errors='replace')
-                        # Simple HTML to text conversion
-                        body += re.sub('<[^<]+?>', ' ', html_body)
+                        payload = self._decode_payload(part, max_chars - total)
+                        html_body = payload.decode(_codec_name(part.get_content_charset()), errors='replace')
+                        chunk = _html_to_text(html_body)
                     except Exception as e:
                         logger.error(f"Error decoding HTML part: {e}")
+                        continue
+                else:
+                    continue
+                
+                parts.append(chunk)
+                total += len(chunk)
+                if attachments is None:
+                    # The first plain text part is the body, later ones are mostly footers and quotes,
+                    # and anything beyond the size limit is truncated before classification anyway
+                    if (content_type == "text/plain" and chunk.strip()) or total >= max_chars:
+                        break
+            body = "".join(parts)
         else:
             # Not multipart - get the content directly
             content_type = email_message.get_content_type()
             try:
-                payload = email_message.get_payload(decode=True)
-                charset = email_message.get_content_charset() or 'utf-8'
+                payload = self._decode_payload(email_message, self.max_email_size_kb * 1024)
+                charset = _codec_name(email_message.get_content_charset())
                 
                 if content_type == "text/plain":
                     body = payload.decode(charset, errors='replace')
                 elif content_type == "text/html":
                     html_body = payload.decode(charset, errors='replace')
-                    body = re.sub('<[^<]+?>', ' ', html_body)
+                    body = _html_to_text(html_body)
                 else:
                     body = f"[Unsupported content type: {content_type}]"
             except Exception as e:
@@ -441,6 +1611,41 @@ class EmailProcessor:
         
         return body
 
+    @staticmethod
+    def _decode_payload(part, max_bytes: int) -> bytes:
+        """
+        Decode the payload of a message part, or only about its first `max_bytes` if it is longer.
+        
+        Args:
+            part: Message part.
+            max_bytes: Number of decoded bytes that are needed.
+            
+        Returns:
+            bytes: The decoded payload, or a prefix of at least about `max_bytes` of it.
+        """
+        payload = part.get_payload()
+        encoding = part.get('Content-Transfer-Encoding', '').strip().lower()
+        if not isinstance(payload, str) or encoding not in ('base64', 'quoted-printable'):
+            return part.get_payload(decode=True) or b''
+        
+        # Encoded characters needed, with room for line breaks (and escapes for quoted-printable)
+        needed = max(max_bytes, 0) * 4 // 3 + 1024 if encoding == 'base64' else max(max_bytes, 0) * 3 + 1024
+        # Base64 is always decoded here, since fetched text may end in an incomplete group
+        if len(payload) <= needed and encoding != 'base64':
+            return part.get_payload(decode=True) or b''
+        
+        try:
+            if encoding == 'base64':
+                # Drop line breaks and any incomplete group of 4 characters at the end
+                data = b''.join(payload[:needed].encode('ascii', errors='ignore').split())
+                return binascii.a2b_base64(data[:len(data) // 4 * 4])
+            
+            # Cut at a line break, so no escape is split
+            cut = payload.rfind('\n', 0, needed)
+            return binascii.a2b_qp(payload[:cut if cut > 0 else needed].encode('ascii', errors='ignore'))
+        except binascii.Error:
+            return part.get_payload(decode=True) or b''
+
     def _get_attachments(self, email_message) -> List[Dict[str, Any]]:
         """
         Extract attachments from an email message.
@@ -454,29 +1659,74 @@ class EmailProcessor:
         attachments = []
         
         for part in email_message.walk():
-            content_disposition = str(part.get("Content-Disposition"))
-            
-            if "attachment" in content_disposition:
-                filename = part.get_filename()
-                if filename:
-                    # Decode filename if needed
-                    if isinstance(filename, bytes):
-                        filename = filename.decode('utf-8', errors='replace')
-                    
-                    content_type = part.get_content_type()
-                    size = len(part.get_payload(decode=True))
-                    
-                    attachments.append({
-                        'filename': filename,
-                        'content_type': content_type,
-                        'size': size
-                    })
+            attachment = self._attachment_info(part)
+            if attachment:
+                attachments.append(attachment)
         
         return attachments
 
+    def _attachment_info(self, part) -> Optional[Dict[str, Any]]:
+        """
+        Get the information of an attachment.
+        
+        Args:
+            part: Message part.
+            
+        Returns:
+            Optional[Dict[str, Any]]: Filename, content type and size, or None if the part
+            is not an attachment with a filename.
+        """
+        content_disposition = str(part.get("Content-Disposition"))
+        if "attachment" not in content_disposition:
+            return None
+        
+        filename = part.get_filename()
+        if not filename:
+            return None
+        
+        # Decode filename if needed
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8', errors='replace')
+        
+        return {
+            'filename': filename,
+            'content_type': part.get_content_type(),
+            'size': self._attachment_size(part)
+        }
+
+    @staticmethod
+    def _attachment_size(part) -> int:
+        """
+        Get the decoded size of an attachment without decoding it.
+        
+        Args:
+            part: Message part of the attachment.
+            
+        Returns:
+            int: Size of the attachment in bytes (estimated for quoted-printable).
+        """
+        # The size parameter of Content-Disposition (RFC 2183) or a Content-Length header, if the sender set one
+        size = part.get_param('size', header='content-disposition')
+        if not isinstance(size, str):
+            size = part.get('Content-Length', '').strip()
+        if size.isdigit():
+            return int(size)
+        
+        payload = part.get_payload()
+        if not isinstance(payload, str):
+            # Attached message or multipart, add up the sizes of its parts
+            parts = payload if isinstance(payload, list) else [payload]
+            return sum(EmailProcessor._attachment_size(subpart) for subpart in parts if hasattr(subpart, 'get_payload'))
+        
+        if part.get('Content-Transfer-Encoding', '').strip().lower() == 'base64':
+            # 4 encoded characters per 3 bytes, ignoring line breaks and padding
+            encoded = len(payload) - payload.count('\n') - payload.count('\r') - payload.count(' ')
+            return max(0, encoded * 3 // 4 - payload.count('='))
+        return len(payload)
+
     def folder_exists(self, folder_name: str) -> bool:
         """
-        Check if a folder actually exists by trying to select it.
+        Check if a folder exists in the (cached) folder list.
         
         Args:
             folder_name: Name of the folder to check.
@@ -489,65 +1739,27 @@ class EmailProcessor:
                 return False
         
         try:
-            # Get the raw folder list first for debugging
-            status, folders_raw = self.connection.list()
-            if status == 'OK':
-                logger.debug(f"Raw folder list from IMAP server:")
-                for f in folders_raw:
-                    if isinstance(f, bytes):
-                        f_str = f.decode('utf-8', errors='replace')
-                    else:
-                        f_str = str(f)
-                    logger.debug(f"  {f_str}")
+            # Get the raw folder list first for debugging, only worth a round trip when it is logged
+            if logger.isEnabledFor(logging.DEBUG):
+                status, folders_raw = self._imap('list')
+                if status == 'OK':
+                    logger.debug(f"Raw folder list from IMAP server:")
+                    for f in folders_raw:
+                        if isinstance(f, bytes):
+                            f_str = f.decode('utf-8', errors='replace')
+                        else:
+                            f_str = str(f)
+                        logger.debug(f"  {f_str}")
             
             # Check if the folder exists in the folder list
-            folders = self.get_folders()
-            if folder_name in folders:
-                logger.info(f"Folder '{folder_name}' exists in folder list")
+            self.get_folders()
+            found = self._find_folder(folder_name, self._folder_cache[2] if self._folder_cache else {})
+            if found:
+                logger.info(f"Folder '{folder_name}' exists as '{found}'")
                 return True
             
-            # Try different formats for the folder name
-            formats_to_check = [
-                folder_name.upper(),        # Uppercase
-                folder_name.lower(),        # Lowercase
-                f'INBOX/{folder_name}',     # As a subfolder of INBOX with slash
-                f'INBOX.{folder_name}',     # As a subfolder of INBOX with dot
-                f'Folders/{folder_name}',   # As a subfolder of Folders
-                f'Labels/{folder_name}'     # As a subfolder of Labels
-            ]
-            
-            for folder_format in formats_to_check:
-                if folder_format in folders:
-                    logger.info(f"Folder '{folder_name}' exists with format: {folder_format}")
-                    return True
-            
-            # Try to select the folder directly using different formats
-            formats_to_try = [
-                folder_name,                # Standard format
-                f'"{folder_name}"',         # Quoted format
-                folder_name.upper(),        # Uppercase
-                folder_name.lower(),        # Lowercase
-                f'INBOX/{folder_name}',     # As a subfolder of INBOX with slash
-                f'INBOX.{folder_name}',     # As a subfolder of INBOX with dot
-                f'Folders/{folder_name}',   # As a subfolder of Folders
-                f'Labels/{folder_name}'     # As a subfolder of Labels
-            ]
-            
-            for folder_format in formats_to_try:
-                try:
-                    logger.debug(f"Trying to select folder with format: {folder_format}")
-                    status, data = self.connection.select(folder_format)
-                    if status == 'OK':
-                        # Deselect the folder by selecting INBOX
-                        self.connection.select('INBOX')
-                        logger.info(f"Verified folder '{folder_name}' exists with format: {folder_format}")
-                        return True
-                except Exception as e:
-                    logger.debug(f"Exception when selecting {folder_format}: {e}")
-                    continue
-            
-            # If we get here, the folder doesn't exist
-            logger.warning(f"Folder '{folder_name}' does not exist or cannot be selected")
+            # LIST is authoritative, no need to probe with SELECT
+            logger.warning(f"Folder '{folder_name}' does not exist")
             return False
         except Exception as e:
             logger.error(f"Error checking if folder '{folder_name}' exists: {e}")
@@ -558,127 +1770,193 @@ class EmailProcessor:
         Move an email from one folder to another.
         
         Args:
-            email_id: ID of the email to move.
+            email_id: UID of the email to move.
             source_folder: Source folder name.
             destination_folder: Destination folder name.
             
         Returns:
             bool: True if the move was successful, False otherwise.
         """
+        return self.move_emails([(email_id, destination_folder)], source_folder) > 0
+
+    def move_emails(self, moves: List[Tuple[str, str]], source_folder: str) -> int:
+        """
+        Move several emails out of one folder, with one command per destination folder.
+        
+        Args:
+            moves: (UID, destination folder name) of each email to move.
+            source_folder: Source folder name.
+            
+        Returns:
+            int: Number of emails that were moved.
+        """
+        for email_id, destination_folder in moves:
+            self._enqueue_move(email_id, destination_folder)
+        moved_count = self.flush_moves(source_folder)
+        self.expunge_pending()
+        return moved_count
+
+    def _enqueue_move(self, email_id: str, destination_folder: str) -> None:
+        """
+        Queue an email to be moved by the next flush_moves().
+        
+        Args:
+            email_id: UID of the email to move.
+            destination_folder: Destination folder name.
+        """
+        self._pending_moves.setdefault(destination_folder, []).append(email_id)
+
+    def flush_moves(self, source_folder: str, check_destinations: bool = True) -> int:
+        """
+        Move all queued emails out of the source folder, with one command per destination folder
+        (per MAX_UID_SET emails).
+        
+        Uses UID MOVE when the server supports it. Otherwise the emails are copied per destination,
+        then flagged as deleted with a single STORE and left for expunge_pending(), which expunges
+        them all at once before another folder is selected or the connection is released.
+        Emails that could not be moved are marked as processed, with a single STORE as well.
+        
+        Args:
+            source_folder: Folder the queued emails are in.
+            check_destinations: Whether to check that the destination folders exist, which
+                callers that already checked can skip.
+            
+        Returns:
+            int: Number of emails that were moved.
+        """
+        pending, self._pending_moves = self._pending_moves, {}
+        if not pending:
+            return 0
+        
         if not self.connection:
             if not self.connect():
-                return False
-        
-        # Check if destination folder actually exists by trying to select it
-        if not self.folder_exists(destination_folder):
-            logger.warning(f"Destination folder '{destination_folder}' does not exist. Please create it manually in Proton Mail.")
-            logger.warning(f"Marking email as processed without moving it.")
-            self.mark_as_processed(email_id)
-            return False
+                return 0
         
-        # Select source folder
-        if self.select_folder(source_folder) <= 0:
-            return False
+        # Select source folder, unless it still is
+        if self._selected_folder != self._quote(self._canonical(source_folder)) and self.select_folder(source_folder) <= 0:
+            return 0
         
         # Maximum number of retries
         max_retries = 3
         retry_delay = 2  # seconds
         
-        for retry in range(max_retries):
-            try:
-                # Try to use the MOVE command directly if supported
+        moved_count = 0
+        to_delete: List[str] = []
+        to_mark: List[str] = []
+        # Servers limit the length of a command line, so keep the message sets short
+        batches = [(destination_folder, email_ids[i:i + MAX_UID_SET])
+                   for destination_folder, email_ids in pending.items()
+                   for i in range(0, len(email_ids), MAX_UID_SET)]
+        for destination_folder, email_ids in batches:
+            uid_set = ','.join(email_ids)
+            mailbox = self._quote(self._canonical(destination_folder))
+            
+            # Check if destination folder actually exists
+            if check_destinations and not self.folder_exists(destination_folder):
+                logger.warning(f"Destination folder '{destination_folder}' does not exist. Please create it manually in Proton Mail.")
+                logger.warning(f"Marking emails as processed without moving them.")
+                to_mark.extend(email_ids)
+                continue
+            
+            # Try to use the MOVE command directly if supported
+            if self._supports_move:
                 try:
-                    logger.debug(f"Attempting to move email {email_id} using MOVE command")
-                    # Check if MOVE is supported
-                    capabilities = self.connection.capabilities
-                    if b'MOVE' in capabilities:
-                        logger.debug("Server supports MOVE command")
-                        status, data = self.connection.uid('MOVE', email_id, destination_folder)
-                        if status == 'OK':
-                            logger.info(f"Successfully moved email {email_id} from {source_folder} to {destination_folder} using MOVE command")
-                            return True
-                    else:
-                        logger.debug("Server does not support MOVE command, falling back to copy+delete")
-                except Exception as e:
-                    logger.debug(f"Error using MOVE command: {e}")
-                
-                # Fall back to copy+delete method
-                # Try different formats for the destination folder
-                formats_to_try = [
-                    destination_folder,                # Standard format
-                    f'"{destination_folder}"',         # Quoted format
-                    f'INBOX/{destination_folder}',     # As a subfolder of INBOX with slash
-                    f'INBOX.{destination_folder}',     # As a subfolder of INBOX with dot
-                    f'Folders/{destination_folder}',   # As a subfolder of Folders
-                    f'Labels/{destination_folder}',    # As a subfolder of Labels
-                    destination_folder.upper(),        # Uppercase
-                    destination_folder.lower()         # Lowercase
-                ]
-                
-                copy_success = False
-                for folder_format in formats_to_try:
-                    try:
-                        logger.debug(f"Trying to copy email to folder format: {folder_format}")
-                        status, data = self.connection.copy(email_id, folder_format)
-                        if status == 'OK':
-                            logger.info(f"Successfully copied email {email_id} to {destination_folder} using format {folder_format}")
-                            copy_success = True
-                            break
-                    except Exception as e:
-                        logger.debug(f"Failed to copy email with format {folder_format}: {e}")
-                        continue
-                
-                if not copy_success:
-                    if retry < max_retries - 1:
-                        logger.warning(f"Failed to copy email on attempt {retry+1}, retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
+                    logger.debug(f"Attempting to move emails {uid_set} using MOVE command")
+                    status, data = self._imap('uid', 'MOVE', uid_set, mailbox)
+                    if status == 'OK':
+                        logger.info(f"Successfully moved {len(email_ids)} emails from {source_folder} to {destination_folder} using MOVE command")
+                        moved_count += len(email_ids)
+                        self._advance_high_water_uid(uid_set)
                         continue
-                    else:
-                        logger.error(f"Failed to copy email {email_id} to {destination_folder} with all attempted formats after {max_retries} retries")
-                        # Mark as processed even if we couldn't move it
-                        self.mark_as_processed(email_id)
-                        return False
-                
-                # Mark the original email for deletion
-                status, data = self.connection.store(email_id, '+FLAGS', '\\Deleted')
-                if status != 'OK':
-                    logger.error(f"Failed to mark email {email_id} for deletion: {data}")
-                    # Even if deletion fails, we've at least copied the email
-                    # Mark as processed and return partial success
-                    self.mark_as_processed(email_id)
-                    return True
-                
-                # Expunge to actually delete the email
-                status, data = self.connection.expunge()
-                if status != 'OK':
-                    logger.error(f"Failed to expunge mailbox: {data}")
-                    # Even if expunge fails, we've at least copied the email and marked for deletion
-                    # Mark as processed and return partial success
-                    self.mark_as_processed(email_id)
-                    return True
-                
-                logger.info(f"Successfully moved email {email_id} from {source_folder} to {destination_folder}")
-                return True
+                    logger.debug(f"MOVE command failed: {data}")
+                except (imaplib.IMAP4.error, OSError) as e:
+                    logger.debug(f"Error using MOVE command: {e}")
+            else:
+                logger.debug("Server does not support MOVE command, falling back to copy+delete")
+            
+            # Fall back to copy+delete method
+            copy_success = False
+            for retry in range(max_retries):
+                try:
+                    status, data = self._imap('uid', 'COPY', uid_set, mailbox)
+                    if status == 'OK':
+                        logger.info(f"Successfully copied {len(email_ids)} emails to {destination_folder}")
+                        copy_success = True
+                        break
+                    logger.debug(f"Failed to copy emails: {data}")
+                except imaplib.IMAP4.abort as e:
+                    logger.debug(f"Failed to copy emails: {e}")
+                except imaplib.IMAP4.error as e:
+                    # BAD response, the same command won't succeed when retried
+                    logger.debug(f"Failed to copy emails: {e}")
+                    break
+                except OSError as e:
+                    logger.debug(f"Failed to copy emails: {e}")
                 
-            except Exception as e:
-                logger.error(f"Error moving email {email_id} (attempt {retry+1}): {e}")
                 if retry < max_retries - 1:
-                    logger.warning(f"Retrying in {retry_delay} seconds...")
+                    logger.warning(f"Failed to copy emails on attempt {retry+1}, retrying in {retry_delay} seconds...")
                     time.sleep(retry_delay)
+            
+            if not copy_success:
+                logger.error(f"Failed to copy emails {uid_set} to {destination_folder} after {max_retries} retries")
+                # Mark as processed even if we couldn't move them
+                to_mark.extend(email_ids)
+                continue
+            
+            moved_count += len(email_ids)
+            self._advance_high_water_uid(uid_set)
+            to_delete.extend(email_ids)
+        
+        # Mark the original emails of all destinations for deletion
+        # Even if this fails, we've at least copied the emails
+        for i in range(0, len(to_delete), MAX_UID_SET):
+            email_ids = to_delete[i:i + MAX_UID_SET]
+            uid_set = ','.join(email_ids)
+            try:
+                status, data = self._imap('uid', 'STORE', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+                if status == 'OK':
+                    self._pending_expunge.extend(email_ids)
                 else:
-                    logger.error(f"Failed to move email after {max_retries} attempts")
-                    # Mark as processed even if we couldn't move it
-                    self.mark_as_processed(email_id)
-                    return False
+                    logger.error(f"Failed to mark emails {uid_set} for deletion: {data}")
+                    to_mark.extend(email_ids)
+            except Exception as e:
+                logger.error(f"Error marking emails {uid_set} for deletion: {e}")
+                to_mark.extend(email_ids)
+        
+        for i in range(0, len(to_mark), MAX_UID_SET):
+            self.mark_as_processed(','.join(to_mark[i:i + MAX_UID_SET]))
+        
+        return moved_count
+
+    def expunge_pending(self) -> None:
+        """
+        Expunge the emails flush_moves() copied out of the selected folder, with one command.
+        
+        UID EXPUNGE (UIDPLUS) leaves emails flagged as deleted by other clients alone.
+        """
+        pending, self._pending_expunge = self._pending_expunge, []
+        if not pending or not self.connection:
+            return
         
-        return False
+        try:
+            if self._supports_uidplus:
+                for i in range(0, len(pending), MAX_UID_SET):
+                    status, data = self._imap('uid', 'EXPUNGE', ','.join(pending[i:i + MAX_UID_SET]))
+                    if status != 'OK':
+                        logger.error(f"Failed to expunge mailbox: {data}")
+            else:
+                status, data = self._imap('expunge')
+                if status != 'OK':
+                    logger.error(f"Failed to expunge mailbox: {data}")
+        except Exception as e:
+            logger.error(f"Error expunging mailbox: {e}")
 
     def mark_as_processed(self, email_id: str) -> bool:
         """
         Mark an email as processed by adding a custom flag.
         
         Args:
-            email_id: ID of the email to mark.
+            email_id: UID of the email to mark, or a comma-separated UID set.
             
         Returns:
             bool: True if marking was successful, False otherwise.
@@ -688,9 +1966,11 @@ class EmailProcessor:
             return False
         
         try:
-            status, data = self.connection.store(email_id, '+FLAGS', 'PROCESSED')
+            # .SILENT: the server doesn't answer with the new flags of every email
+            status, data = self._imap('uid', 'STORE', email_id, '+FLAGS.SILENT', '(PROCESSED)')
             if status == 'OK':
                 logger.info(f"Marked email {email_id} as processed")
+                self._advance_high_water_uid(email_id)
                 return True
             else:
                 logger.error(f"Failed to mark email {email_id} as processed: {data}")
@@ -699,21 +1979,87 @@ class EmailProcessor:
             logger.error(f"Error marking email as processed: {e}")
             return False
 
-    def process_emails(self, processor_func) -> Tuple[int, int]:
+    def route_emails(self, routed: List[Tuple[Dict[str, Any], Optional[int]]], source_folder: str,
+                     category_folders: Tuple[str, ...], dry_run: bool, folder_exists_cache: Dict[str, bool]) -> int:
+        """
+        Move classified emails to the folders of their categories, or only mark them as processed.
+        
+        The moves are queued and issued together, with one command per destination folder,
+        and the emails that are not moved are marked as processed with a single STORE.
+        
+        Args:
+            routed: (email data, category index or None) pairs, all fetched from `source_folder`.
+            source_folder: Folder the emails were fetched from.
+            category_folders: Destination folder of each category index.
+            dry_run: Whether emails should only be classified and marked as processed.
+            folder_exists_cache: Whether each destination folder exists, by folder name.
+            
+        Returns:
+            int: Number of emails that were successfully categorized.
+        """
+        success_count = 0
+        queued_count = 0
+        to_mark: List[str] = []
+        self._record_routes(routed, category_folders)
+        for email_data, category_idx in routed:
+            email_id = email_data['id']
+            
+            try:
+                if category_idx is not None:
+                    destination_folder = category_folders[category_idx]
+                    
+                    # Check if we should run in dry run mode
+                    # Either explicitly enabled or the destination folder doesn't exist
+                    should_dry_run = dry_run or not folder_exists_cache.get(destination_folder, False)
+                    
+                    if should_dry_run:
+                        # In dry run mode, just log the classification and mark as processed
+                        dry_run_reason = "DRY RUN mode" if dry_run else f"folder '{destination_folder}' does not exist"
+                        logger.info(f"[{dry_run_reason}] Email {email_id} - Subject: '{email_data.get('subject', '')}' - "
+                                   f"From: '{email_data.get('sender', '')}' would be moved to {destination_folder}")
+                        to_mark.append(email_id)
+                        success_count += 1
+                    else:
+                        # Queue the email to be moved to the appropriate folder
+                        self._enqueue_move(email_id, destination_folder)
+                        queued_count += 1
+                else:
+                    # No category, just mark as processed
+                    logger.warning(f"No category for email {email_id}")
+                    to_mark.append(email_id)
+            except Exception as e:
+                logger.error(f"Error processing email {email_id}: {e}")
+                # Mark as processed to avoid reprocessing
+                to_mark.append(email_id)
+        
+        if to_mark:
+            self.mark_as_processed(','.join(to_mark))
+        
+        if queued_count:
+            # Only emails whose destination is in folder_exists_cache were queued
+            moved_count = self.flush_moves(source_folder, check_destinations=False)
+            if moved_count < queued_count:
+                logger.warning(f"Moved {moved_count} of {queued_count} emails from {source_folder}, the others were marked as processed only")
+            success_count += moved_count
+        
+        return success_count
+
+    def process_emails(self, processor_func, category_folders: Tuple[str, ...]) -> Tuple[int, int]:
         """
         Process emails from configured folders using the provided processor function.
         
         Args:
-            processor_func: Function that takes an email dict and returns a category.
+            processor_func: Function that takes a list of email dicts and returns a list with
+                the category index of each email (or None), in the same order. If it has a
+                `needs` attribute, only the email data fields listed there are fetched and parsed.
+            category_folders: Destination folder of each category index.
             
         Returns:
             Tuple[int, int]: (Number of emails processed, number of emails successfully categorized)
         """
         if not self.connect():
             return 0, 0
-        
-        processed_count = 0
-        success_count = 0
+        self._set_needs(processor_func)
         
         # Check if we're in dry run mode (don't move emails, just classify)
         dry_run = os.environ.get('DRY_RUN', 'false').lower() == 'true'
@@ -722,73 +2068,66 @@ class EmailProcessor:
         
         # Verify that destination folders exist
         folder_exists_cache = {}
-        for category, folder_name in EMAIL_CATEGORIES.items():
+        for category, folder_name in CATEGORIES.folders().items():
             folder_exists_cache[folder_name] = self.folder_exists(folder_name)
             if not folder_exists_cache[folder_name]:
                 logger.warning(f"Destination folder '{folder_name}' for category '{category}' does not exist.")
                 logger.warning(f"Please create it manually in Proton Mail or emails will be classified but not moved.")
         
-        try:
-            for folder in self.folders_to_process:
-                logger.info(f"Processing folder: {folder}")
-                
-                # Get unprocessed emails
-                remaining = self.max_emails_per_run - processed_count
-                if remaining <= 0:
-                    break
-                
-                email_ids = self.get_unprocessed_emails(folder, limit=remaining)
-                logger.info(f"Found {len(email_ids)} unprocessed emails in {folder}")
-                
-                # Process emails in batches
-                for i in range(0, len(email_ids), self.batch_size):
-                    batch = email_ids[i:i + self.batch_size]
-                    
-                    for email_id in batch:
-                        email_data = self.fetch_email(email_id)
-                        if not email_data:
-                            continue
-                        
-                        processed_count += 1
-                        
-                        try:
-                            # Call the processor function to get the category
-                            category = processor_func(email_data)
-                            
-                            if category and category in EMAIL_CATEGORIES:
-                                destination_folder = EMAIL_CATEGORIES[category]
-                                
-                                # Check if we should run in dry run mode
-                                # Either explicitly enabled or the destination folder doesn't exist
-                                should_dry_run = dry_run or not folder_exists_cache.get(destination_folder, False)
-                                
-                                if should_dry_run:
-                                    # In dry run mode, just log the classification and mark as processed
-                                    dry_run_reason = "DRY RUN mode" if dry_run else f"folder '{destination_folder}' does not exist"
-                                    logger.info(f"[{dry_run_reason}] Email {email_id} - Subject: '{email_data.get('subject', '')}' - "
-                                               f"From: '{email_data.get('sender', '')}' would be moved to {destination_folder}")
-                                    self.mark_as_processed(email_id)
-                                    success_count += 1
-                                else:
-                                    # Move the email to the appropriate folder
-                                    if self.move_email(email_id, folder, destination_folder):
-                                        success_count += 1
-                                    else:
-                                        # If move fails, at least mark as processed
-                                        logger.warning(f"Failed to move email to {destination_folder}, marking as processed only")
-                                        self.mark_as_processed(email_id)
-                            else:
-                                # Unknown category, just mark as processed
-                                logger.warning(f"Unknown category '{category}' for email {email_id}")
-                                self.mark_as_processed(email_id)
-                        except Exception as e:
-                            logger.error(f"Error processing email {email_id}: {e}")
-                            # Mark as processed to avoid reprocessing
-                            self.mark_as_processed(email_id)
-                    
-                    # Small delay between batches to avoid overwhelming the server
-                    time.sleep(1)
-        finally:
-            self.disconnect()
+        if len(self.folders_to_process) <= 1 or self.max_connections <= 1:
+            try:
+                # Classify the next batch while the previous one is being moved
+                return asyncio.run(run_pipeline(self, processor_func, category_folders, dry_run, folder_exists_cache))
+            finally:
+                self.disconnect()
+        
+        # Hand the connection back to the pool, so one of the folder workers can reuse it
+        self.disconnect()
+        
+        processed_count = 0
+        success_count = 0
+        budget = EmailBudget(self.max_emails_per_run)
+        workers = min(len(self.folders_to_process), self.max_connections)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='folder') as pool:
+            futures = {
+                pool.submit(self._process_one_folder, folder, processor_func, category_folders,
+                            dry_run, folder_exists_cache, budget): folder
+                for folder in self.folders_to_process
+            }
+            for future in as_completed(futures):
+                try:
+                    folder_processed, folder_success = future.result()
+                    processed_count += folder_processed
+                    success_count += folder_success
+                except Exception as e:
+                    logger.error(f"Error processing folder {futures[future]}: {e}")
         
         return processed_count, success_count
+
+    def _process_one_folder(self, folder: str, processor_func, category_folders: Tuple[str, ...], dry_run: bool,
+                            folder_exists_cache: Dict[str, bool], budget: EmailBudget) -> Tuple[int, int]:
+        """
+        Process one folder on its own IMAP connection, for running folders in parallel.
+        
+        imaplib connections are not thread-safe, so each worker uses a separate processor.
+        
+        Args:
+            folder: Folder to process.
+            processor_func: Function that takes a list of email dicts and returns a list with
+                the category index of each email (or None), in the same order.
+            category_folders: Destination folder of each category index.
+            dry_run: Whether emails should only be classified and marked as processed.
+            folder_exists_cache: Whether each destination folder exists, by folder name.
+            budget: Number of emails the run may still process, shared by all folders.
+            
+        Returns:
+            Tuple[int, int]: (Number of emails processed, number of emails successfully categorized)
+        """
+        with EmailProcessor() as worker:
+            if not worker.connection:
+                return 0, 0
+            worker.needs = self.needs
+            
+            worker.folders_to_process = [folder]
+            return asyncio.run(run_pipeline(worker, processor_func, category_folders, dry_run,
+                                            folder_exists_cache, budget))
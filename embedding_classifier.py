@@ -0,0 +1,123 @@
+"""
+Embedding-based classification of emails by similarity to category descriptions.
+"""
+import logging
+from typing import Dict, Any, Optional, List
+
+from config import EMBEDDING_CONFIG, EMAIL_CATEGORY_DESCRIPTIONS
+from llm_client import LLMClient
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingClassifier:
+    """
+    Classifies emails by the cosine similarity between a sentence embedding of the email
+    and precomputed embeddings of the category descriptions.
+    Embeddings are computed locally with the optional 'sentence-transformers' package, or by the
+    embeddings endpoint of the LLM server when EMBEDDING_BACKEND is 'server'.
+    """
+
+    def __init__(self, categories: List[str]):
+        """
+        Initialize the embedding classifier.
+        
+        Args:
+            categories: List of category names.
+            
+        Raises:
+            ImportError: If 'numpy', or 'sentence-transformers' for the local backend, is not installed.
+            ValueError: If the backend is unknown.
+        """
+        self.backend = EMBEDDING_CONFIG['backend']
+        if np is None:
+            raise ImportError("The 'numpy' package is required for the embedding classifier")
+        if self.backend == 'local':
+            # Imported here, it loads torch, which the server backend doesn't need
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise ImportError("The 'sentence-transformers' package is required for the local embedding classifier")
+            self.model = SentenceTransformer(EMBEDDING_CONFIG['model'])
+        elif self.backend == 'server':
+            self.model = None
+            self.llm_client = LLMClient.instance()
+        else:
+            raise ValueError(f"Unknown embedding backend '{self.backend}'")
+        
+        self.min_similarity = EMBEDDING_CONFIG['min_similarity']
+        self.max_body_chars = EMBEDDING_CONFIG['max_body_chars']
+        self.set_categories(categories)
+        logger.info(f"Initialized {self.backend} embedding classifier with model '{EMBEDDING_CONFIG['model']}'")
+
+    def _encode(self, texts: List[str]):
+        """
+        Embed texts as unit vectors.
+        
+        Args:
+            texts: Texts to embed.
+            
+        Returns:
+            N x D float32 matrix with the normalized embedding of each text.
+            
+        Raises:
+            RuntimeError: If the LLM server did not return embeddings.
+        """
+        if self.model is not None:
+            return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+        
+        embeddings = self.llm_client.get_embeddings(texts, EMBEDDING_CONFIG['model'])
+        if embeddings is None:
+            raise RuntimeError("The LLM server did not return embeddings")
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def set_categories(self, categories: List[str]) -> None:
+        """
+        Compute the category embeddings used for classification.
+        
+        Args:
+            categories: List of category names.
+        """
+        self.categories = list(categories)
+        descriptions = [
+            EMAIL_CATEGORY_DESCRIPTIONS.get(category, category.replace('_', ' '))
+            for category in self.categories
+        ]
+        
+        # K x D matrix of unit vectors, so a matrix-vector product gives the cosine similarities
+        self._category_embeddings = self._encode(descriptions)
+
+    def classify(self, email_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Classify an email by its most similar category description.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Optional[str]: The most similar category, or None if no category is similar enough.
+        """
+        # The subject, sender and start of the body are enough to tell the categories apart
+        body = email_data.get('body', '')[:self.max_body_chars]
+        text = f"{email_data.get('subject', '')}\n{email_data.get('sender', '')}\n{body}"
+        
+        try:
+            scores = self._category_embeddings @ self._encode([text])[0]
+        except Exception as e:
+            logger.error(f"Error computing email embedding: {e}")
+            return None
+        
+        best = int(scores.argmax())
+        if scores[best] < self.min_similarity:
+            logger.debug(f"Best embedding similarity {scores[best]:.3f} for '{self.categories[best]}' is below threshold")
+            return None
+        
+        return self.categories[best]
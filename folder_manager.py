@@ -2,24 +2,77 @@
 Logic for managing email folders and moving emails between them.
 """
 import logging
-from typing import List, Dict, Optional
+import time
+from typing import List, Dict, Optional, Tuple
 
 from email_processor import EmailProcessor
-from config import EMAIL_CATEGORIES
+from category_registry import CATEGORIES
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Seconds a session may be idle before it is checked with NOOP, servers drop connections after ~30 minutes
+SESSION_IDLE_CHECK = 25 * 60
+
 
 class FolderManager:
     """
     Manages email folders and handles moving emails between folders.
+    
+    One IMAP session is opened on first use and kept until close(), so consecutive
+    operations don't log in again; use the manager as a context manager to close it.
+    A session of an email processor passed in is left open for its owner.
     """
 
-    def __init__(self):
-        """Initialize the folder manager."""
-        self.email_processor = EmailProcessor()
-        self.category_folders = EMAIL_CATEGORIES
+    def __init__(self, email_processor: Optional[EmailProcessor] = None):
+        """
+        Initialize the folder manager.
+        
+        Args:
+            email_processor: Email processor whose IMAP session is shared, a new one is created if None.
+        """
+        self._owns_processor = email_processor is None
+        self.email_processor = email_processor if email_processor is not None else EmailProcessor()
+        # When the session was last used, to check idle sessions before reusing them
+        self._last_used = 0.0
+
+    @property
+    def category_folders(self) -> Dict[str, str]:
+        """Snapshot of the categories and their folders, from the shared registry."""
+        return CATEGORIES.folders()
+
+    def __enter__(self) -> 'FolderManager':
+        """Use the manager as a context manager, closing its session on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Close the session."""
+        self.close()
+
+    def close(self) -> None:
+        """Release the IMAP session, if one is open and not shared."""
+        if self._owns_processor:
+            self.email_processor.disconnect()
+
+    def _ensure_connected(self) -> bool:
+        """
+        Open the IMAP session, or reuse the open one.
+        
+        Returns:
+            bool: True if the session is usable, False otherwise.
+        """
+        if self.email_processor.connection:
+            # Servers drop idle sessions, check one that was idle for long (reconnecting if needed)
+            if time.monotonic() - self._last_used < SESSION_IDLE_CHECK or self.email_processor.keep_alive():
+                self._last_used = time.monotonic()
+                return True
+        
+        if not self.email_processor.connect():
+            logger.error("Failed to connect to email server")
+            return False
+        
+        self._last_used = time.monotonic()
+        return True
 
     def ensure_category_folders_exist(self) -> bool:
         """
@@ -30,21 +83,17 @@ class FolderManager:
         Returns:
             bool: True if all folders exist, False otherwise.
         """
-        if not self.email_processor.connect():
-            logger.error("Failed to connect to email server")
+        if not self._ensure_connected():
             return False
         
-        success = True
-        try:
-            folders = self.email_processor.get_folders()
-            for category, folder_name in self.category_folders.items():
-                if folder_name not in folders:
-                    logger.warning(f"Folder '{folder_name}' for category '{category}' does not exist. Please create it manually in Proton Mail.")
-                    success = False
-        finally:
-            self.email_processor.disconnect()
+        # The folder list is cached by the email processor for the session
+        category_folders = self.category_folders
+        missing = set(category_folders.values()).difference(self.email_processor.get_folders())
+        for category, folder_name in category_folders.items():
+            if folder_name in missing:
+                logger.warning(f"Folder '{folder_name}' for category '{category}' does not exist. Please create it manually in Proton Mail.")
         
-        return success
+        return not missing
 
     def get_available_folders(self) -> List[str]:
         """
@@ -53,16 +102,12 @@ class FolderManager:
         Returns:
             List[str]: List of folder names.
         """
-        if not self.email_processor.connect():
-            logger.error("Failed to connect to email server")
+        if not self._ensure_connected():
             return []
         
-        try:
-            folders = self.email_processor.get_folders()
-            logger.info(f"Found {len(folders)} folders")
-            return folders
-        finally:
-            self.email_processor.disconnect()
+        folders = self.email_processor.get_folders()
+        logger.info(f"Found {len(folders)} folders")
+        return folders
 
     def create_folder(self, folder_name: str) -> bool:
         """
@@ -74,45 +119,65 @@ class FolderManager:
         Returns:
             bool: True if the folder was created successfully, False otherwise.
         """
-        if not self.email_processor.connect():
-            logger.error("Failed to connect to email server")
+        if not self._ensure_connected():
             return False
         
-        try:
-            result = self.email_processor.create_folder_if_not_exists(folder_name)
-            if result:
-                logger.info(f"Created folder: {folder_name}")
-            else:
-                logger.error(f"Failed to create folder: {folder_name}")
-            return result
-        finally:
-            self.email_processor.disconnect()
+        result = self.email_processor.create_folder_if_not_exists(folder_name)
+        if result:
+            logger.info(f"Created folder: {folder_name}")
+        else:
+            logger.error(f"Failed to create folder: {folder_name}")
+        return result
 
     def move_email(self, email_id: str, source_folder: str, destination_folder: str) -> bool:
         """
         Move an email from one folder to another.
         
         Args:
-            email_id: ID of the email to move.
+            email_id: UID of the email to move.
             source_folder: Source folder name.
             destination_folder: Destination folder name.
             
         Returns:
             bool: True if the move was successful, False otherwise.
         """
-        if not self.email_processor.connect():
-            logger.error("Failed to connect to email server")
+        if not self._ensure_connected():
             return False
         
-        try:
-            result = self.email_processor.move_email(email_id, source_folder, destination_folder)
-            if result:
-                logger.info(f"Moved email {email_id} from {source_folder} to {destination_folder}")
-            else:
-                logger.error(f"Failed to move email {email_id} from {source_folder} to {destination_folder}")
-            return result
-        finally:
-            self.email_processor.disconnect()
+        result = self.email_processor.move_email(email_id, source_folder, destination_folder)
+        if result:
+            logger.info(f"Moved email {email_id} from {source_folder} to {destination_folder}")
+        else:
+            logger.error(f"Failed to move email {email_id} from {source_folder} to {destination_folder}")
+        return result
+
+    def move_emails_batch(self, moves: List[Tuple[str, str, str]]) -> int:
+        """
+        Move several emails, with one command per source and destination folder.
+        
+        Args:
+            moves: (UID, source folder, destination folder) of each email to move.
+            
+        Returns:
+            int: Number of emails that were moved.
+        """
+        if not moves:
+            return 0
+        
+        if not self._ensure_connected():
+            return 0
+        
+        by_source: Dict[str, List[Tuple[str, str]]] = {}
+        for email_id, source_folder, destination_folder in moves:
+            by_source.setdefault(source_folder, []).append((email_id, destination_folder))
+        
+        moved_count = 0
+        for source_folder, source_moves in by_source.items():
+            moved = self.email_processor.move_emails(source_moves, source_folder)
+            logger.info(f"Moved {moved} of {len(source_moves)} emails out of {source_folder}")
+            moved_count += moved
+        
+        return moved_count
 
     def get_folder_for_category(self, category: str) -> Optional[str]:
         """
@@ -124,7 +189,7 @@ class FolderManager:
         Returns:
             Optional[str]: Folder name for the category, or None if the category doesn't exist.
         """
-        return self.category_folders.get(category)
+        return CATEGORIES.get(category)
 
     def add_category_folder(self, category: str, folder_name: str) -> bool:
         """
@@ -137,7 +202,7 @@ class FolderManager:
         Returns:
             bool: True if the category and folder were added successfully, False otherwise.
         """
-        if category in self.category_folders:
+        if category in CATEGORIES:
             logger.warning(f"Category '{category}' already exists")
             return False
         
@@ -145,8 +210,9 @@ class FolderManager:
         if not self.create_folder(folder_name):
             return False
         
-        # Add the category to the dictionary
-        self.category_folders[category] = folder_name
+        # Add the category to the registry
+        if not CATEGORIES.add(category, folder_name):
+            return False
         logger.info(f"Added category '{category}' with folder '{folder_name}'")
         return True
 
@@ -160,16 +226,9 @@ class FolderManager:
         Returns:
             bool: True if the category was removed successfully, False otherwise.
         """
-        if category not in self.category_folders:
-            logger.warning(f"Category '{category}' does not exist")
-            return False
-        
-        if category == 'requires_manual_intervention':
-            logger.error("Cannot remove the 'requires_manual_intervention' category")
+        # Remove the category from the registry, which refuses to remove the fallback category
+        if not CATEGORIES.remove(category):
             return False
-        
-        # Remove the category from the dictionary
-        del self.category_folders[category]
         logger.info(f"Removed category '{category}'")
         return True
 
@@ -184,7 +243,7 @@ class FolderManager:
         Returns:
             bool: True if the category was updated successfully, False otherwise.
         """
-        if category not in self.category_folders:
+        if category not in CATEGORIES:
             logger.warning(f"Category '{category}' does not exist")
             return False
         
@@ -192,7 +251,8 @@ class FolderManager:
         if not self.create_folder(new_folder_name):
             return False
         
-        # Update the category in the dictionary
-        self.category_folders[category] = new_folder_name
+        # Update the category in the registry
+        if not CATEGORIES.update(category, new_folder_name):
+            return False
         logger.info(f"Updated category '{category}' to use folder '{new_folder_name}'")
         return True
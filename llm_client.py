@@ -1,21 +1,240 @@
 """
 Client for interacting with an OpenAI-compatible LLM API.
 """
+import asyncio
+import contextvars
 import json
 import logging
-import requests
-from typing import Dict, Any, Optional
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import httpx
+from typing import Dict, Any, Optional, List, Tuple
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from config import LLM_CONFIG
+from preprocess import truncate_body
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Process-wide client returned by LLMClient.instance()
+_INSTANCE = None
+_INSTANCE_LOCK = threading.Lock()
+
+# Responses of an overloaded, rate limiting or restarting server, retried after their Retry-After
+# header or with exponential backoff
+RETRY_STATUS_CODES = frozenset({429, 502, 503, 504})
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.2  # seconds
+# Seconds between checks for a free request slot while an event loop waits for one
+SLOT_POLL_INTERVAL = 0.005
+# Timeout of the connection test against the models endpoint, in seconds
+MODELS_PROBE_TIMEOUT = 5
+
+# Line of a batch response numbered like the emails of the prompt, e.g. "2. bills"
+_NUMBERED_LINE_RE = re.compile(r'^\W*(\d+)[.):\]]\s*(.+)$', re.MULTILINE)
+
+# Whether the last request of the current thread or task could not reach the server at all
+# (connection error or timeout), in which case trying another endpoint only waits again
+_UNREACHABLE = contextvars.ContextVar('llm_unreachable', default=False)
+
+
+# Email fields block expected between the static parts of CLASSIFICATION_PROMPT_TEMPLATE
+_EMAIL_FIELDS_TEMPLATE = "Subject: {subject}\nFrom: {sender}\nDate: {date}\nBody:\n"
+
+
+def _encode_payload(payload: Dict[str, Any]) -> bytes:
+    """
+    Serialize a request body to compact UTF-8 JSON in one pass.
+    
+    Non-ASCII text is kept as is instead of being escaped, which keeps bodies in other
+    languages about half as long as with `\\uXXXX` escapes.
+    
+    Args:
+        payload: Request body.
+        
+    Returns:
+        bytes: The encoded JSON.
+    """
+    # Lone surrogates can't be encoded, replace them rather than failing the request
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8', errors='replace')
+
+
+def _decode_json(data):
+    """
+    Parse JSON with orjson when it is installed, which is several times faster than the json module.
+    
+    Args:
+        data: JSON document as bytes or str.
+        
+    Returns:
+        The decoded value.
+        
+    Raises:
+        json.JSONDecodeError: If the document is not valid JSON (orjson's error is a subclass).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@lru_cache(maxsize=16)
+def _format_categories(categories: tuple) -> str:
+    """
+    Format the categories as a comma-separated list of quoted names.
+    
+    Args:
+        categories: Tuple of category names.
+        
+    Returns:
+        str: The formatted categories.
+    """
+    return ", ".join([f"'{cat}'" for cat in categories])
+
+
+@lru_cache(maxsize=16)
+def _build_prompt_parts(categories: tuple) -> Optional[Tuple[str, str]]:
+    """
+    Render the static parts of the classification prompt for a set of categories.
+    
+    The text before the email fields (which lists the categories) and the guidelines after
+    them only change with the categories, so they are rendered once per categories tuple.
+    
+    Args:
+        categories: Tuple of category names.
+        
+    Returns:
+        Optional[Tuple[str, str]]: (prefix, suffix) surrounding the email fields, or None if
+        the template does not use the standard email fields block.
+    """
+    from config import CLASSIFICATION_PROMPT_TEMPLATE
+    
+    head, separator, tail = CLASSIFICATION_PROMPT_TEMPLATE.partition("Email:\n")
+    email_fields, body_field, suffix = tail.partition("{body}")
+    if not separator or not body_field or email_fields != _EMAIL_FIELDS_TEMPLATE:
+        return None
+    
+    return head.format(categories=_format_categories(categories)), suffix.format()
+
+
+def _is_word_char(char: str) -> bool:
+    """Return True if char is part of a word, as matched by \\w."""
+    return char.isalnum() or char == '_'
+
+
+@lru_cache(maxsize=16)
+def _category_response_format(categories: tuple) -> Dict[str, Any]:
+    """
+    Build the JSON schema response format for a set of categories (see LLMClient._build_category_response_format).
+    
+    Args:
+        categories: Tuple of category names.
+        
+    Returns:
+        Dict[str, Any]: The response_format value for the chat completions request.
+    """
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'email_category',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'category': {'type': 'string', 'enum': list(categories)}
+                },
+                'required': ['category']
+            }
+        }
+    }
+
+
+class CategoryMatcher:
+    """
+    Finds the first category name mentioned in an LLM response in a single pass over the text.
+    Uses an Aho-Corasick automaton when 'pyahocorasick' is installed, and a compiled regular
+    expression otherwise. Names only match as whole words, so one category isn't found inside
+    a longer word or another category's name.
+    """
+
+    def __init__(self, categories: list):
+        """
+        Build the matcher for a list of categories.
+        
+        Args:
+            categories: List of category names.
+        """
+        self.categories = tuple(categories)
+        
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for category in self.categories:
+                self._automaton.add_word(category.lower(), category)
+            self._automaton.make_automaton()
+            self._pattern = None
+        else:
+            self._automaton = None
+            # Longest names first so a category is not shadowed by one that is a prefix of it
+            alternatives = sorted(self.categories, key=len, reverse=True)
+            self._pattern = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(cat) for cat in alternatives) + r')(?!\w)',
+                                       re.IGNORECASE)
+            self._by_lower = {cat.lower(): cat for cat in self.categories}
+
+    def match(self, text: str) -> Optional[str]:
+        """
+        Find the first category mentioned in a text.
+        
+        Args:
+            text: Text to search, typically an LLM response.
+            
+        Returns:
+            Optional[str]: The first category found, or None if no category is mentioned.
+        """
+        if not self.categories:
+            return None
+        
+        if self._automaton is not None:
+            text = text.lower()
+            for end, category in self._automaton.iter(text):
+                start = end - len(category) + 1
+                if (start == 0 or not _is_word_char(text[start - 1])) and (end + 1 == len(text) or not _is_word_char(text[end + 1])):
+                    return category
+            return None
+        
+        match = self._pattern.search(text)
+        return self._by_lower[match.group(0).lower()] if match else None
+
+
+@lru_cache(maxsize=16)
+def _get_category_matcher(categories: tuple) -> CategoryMatcher:
+    """
+    Get the category matcher for a set of categories, building it on first use.
+    
+    Args:
+        categories: Tuple of category names.
+        
+    Returns:
+        CategoryMatcher: The matcher for these categories.
+    """
+    return CategoryMatcher(categories)
+
 
 class LLMClient:
     """
     Client for interacting with an OpenAI-compatible LLM API.
     Supports local LLM servers like llama.cpp or ollama that implement the OpenAI API format.
+    Use LLMClient.instance() to share one client, and its connection pool, across the process.
     """
 
     def __init__(self):
@@ -26,6 +245,19 @@ class LLMClient:
         self.temperature = LLM_CONFIG['temperature']
         self.max_tokens = LLM_CONFIG['max_tokens']
         self.timeout = LLM_CONFIG['timeout']
+        self.max_retry_backoff = LLM_CONFIG['max_retry_backoff']
+        self.max_concurrency = LLM_CONFIG['max_concurrency']
+        self.structured_output = LLM_CONFIG['structured_output']
+        self.classification_max_tokens = LLM_CONFIG['classification_max_tokens']
+        # Bodies in batch prompts get half the single-email limit, so the whole batch fits in the context window
+        self.batch_body_chars = LLM_CONFIG['max_body_chars'] // 2
+        
+        # Requests in flight across all threads and event loops using this client, so parallel
+        # folder workers together stay within max_concurrency
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        
+        # Async HTTP clients, one per thread, created lazily inside that thread's event loop
+        self._local = threading.local()
         
         # Ensure the API endpoint ends with a slash if it doesn't already
         if not self.api_endpoint.endswith('/'):
@@ -39,6 +271,97 @@ class LLMClient:
         # Add API key to headers if provided
         if self.api_key:
             self.headers['Authorization'] = f'Bearer {self.api_key}'
+        
+        # Keep-alive HTTP client shared by all synchronous requests, the transport retries failed connects
+        self._client = httpx.Client(
+            headers=self.headers,
+            timeout=self.timeout,
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=MAX_RETRIES,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+            )
+        )
+
+    @classmethod
+    def instance(cls) -> 'LLMClient':
+        """
+        Get the process-wide LLM client, creating it on first use.
+        
+        Returns:
+            LLMClient: The shared client.
+        """
+        global _INSTANCE
+        with _INSTANCE_LOCK:
+            _INSTANCE = _INSTANCE or cls()
+        return _INSTANCE
+
+    @classmethod
+    def close_instance(cls) -> None:
+        """Close the process-wide LLM client, if it was created."""
+        global _INSTANCE
+        with _INSTANCE_LOCK:
+            client, _INSTANCE = _INSTANCE, None
+        if client:
+            client.close()
+
+    def close(self) -> None:
+        """Close the connections of the synchronous HTTP client."""
+        self._client.close()
+
+    def _post(self, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        Send a JSON request, retrying responses in RETRY_STATUS_CODES.
+        
+        Args:
+            url: URL of the endpoint.
+            payload: Request body.
+            
+        Returns:
+            httpx.Response: The response of the last attempt.
+        """
+        _UNREACHABLE.set(False)
+        content = _encode_payload(payload)
+        for attempt in range(MAX_RETRIES + 1):
+            with self._slots:
+                response = self._client.post(url, content=content)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+            delay = self._retry_delay(response, attempt)
+            logger.warning("LLM server answered %s, retrying in %.1fs", response.status_code, delay)
+            time.sleep(delay)
+
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        """
+        Get the delay before retrying a response.
+        
+        A Retry-After header (seconds or an HTTP date), as sent by rate limiting servers, is
+        honored up to `max_retry_backoff`; otherwise the delay grows exponentially.
+        
+        Args:
+            response: Response to retry.
+            attempt: Number of the failed attempt, starting at 0.
+            
+        Returns:
+            float: Delay in seconds.
+        """
+        retry_after = response.headers.get('Retry-After') if response.headers else None
+        if retry_after:
+            retry_after = retry_after.strip()
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError, OverflowError):
+                    delay = None
+            if delay is not None:
+                if delay > self.max_retry_backoff:
+                    logger.warning("Retry-After of %.1fs exceeds LLM_MAX_RETRY_BACKOFF, waiting %.1fs",
+                                   delay, self.max_retry_backoff)
+                    return self.max_retry_backoff
+                return max(delay, 0.0)
+        return RETRY_BACKOFF * 2 ** attempt
 
     def _build_completion_url(self) -> str:
         """
@@ -58,43 +381,195 @@ class LLMClient:
         """
         return f"{self.api_endpoint}chat/completions"
 
-    def get_completion(self, prompt: str) -> Optional[str]:
+    def _build_models_url(self) -> str:
+        """
+        Build the URL for the models endpoint.
+        
+        Returns:
+            str: The models API URL.
+        """
+        return f"{self.api_endpoint}models"
+
+    def _build_embeddings_url(self) -> str:
+        """
+        Build the URL for the embeddings endpoint.
+        
+        Returns:
+            str: The embeddings API URL.
+        """
+        return f"{self.api_endpoint}embeddings"
+
+    def get_completion(self, prompt: str, max_tokens: Optional[int] = None) -> Optional[str]:
         """
         Get a completion from the LLM using the completions endpoint.
         
         Args:
             prompt: The prompt to send to the LLM.
+            max_tokens: Optional limit on generated tokens, overriding the configured default.
             
         Returns:
             Optional[str]: The generated text, or None if the request failed.
         """
-        url = self._build_completion_url()
+        return self._send(self._build_completion_url(), self._completion_payload(prompt, max_tokens), chat=False)
+
+    def get_chat_completion(self, messages: list, response_format: Optional[Dict[str, Any]] = None,
+                            max_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Get a completion from the LLM using the chat completions endpoint.
         
-        payload = {
+        Args:
+            messages: List of message objects in the format expected by the chat API.
+            response_format: Optional OpenAI-style response format, e.g. a JSON schema to constrain the output.
+            max_tokens: Optional limit on generated tokens, overriding the configured default.
+            
+        Returns:
+            Optional[str]: The generated text, or None if the request failed.
+        """
+        return self._send(self._build_chat_url(), self._chat_payload(messages, response_format, max_tokens), chat=True)
+
+    def _send(self, url: str, payload: Dict[str, Any], chat: bool) -> Optional[str]:
+        """
+        Send a completions or chat completions request and extract the generated text.
+        
+        Args:
+            url: URL of the endpoint.
+            payload: Request body.
+            chat: Whether the request goes to the chat completions endpoint.
+            
+        Returns:
+            Optional[str]: The generated text, or None if the request failed.
+        """
+        try:
+            return self._read_text(self._post(url, payload), chat)
+        except Exception as e:
+            return self._request_failed(e, chat)
+
+    def _completion_payload(self, prompt: str, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Build the request body for the completions endpoint.
+        
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Optional limit on generated tokens, overriding the configured default.
+            
+        Returns:
+            Dict[str, Any]: The request body.
+        """
+        return {
             'model': self.model,
             'prompt': prompt,
             'temperature': self.temperature,
-            'max_tokens': self.max_tokens
+            'max_tokens': max_tokens or self.max_tokens
+        }
+
+    def _chat_payload(self, messages: list, response_format: Optional[Dict[str, Any]] = None,
+                      max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Build the request body for the chat completions endpoint.
+        
+        Args:
+            messages: List of message objects in the format expected by the chat API.
+            response_format: Optional OpenAI-style response format.
+            max_tokens: Optional limit on generated tokens, overriding the configured default.
+            
+        Returns:
+            Dict[str, Any]: The request body.
+        """
+        payload = {
+            'model': self.model,
+            'messages': messages,
+            'temperature': self.temperature,
+            'max_tokens': max_tokens or self.max_tokens
+        }
+        
+        if response_format:
+            payload['response_format'] = response_format
+        
+        return payload
+
+    def _read_text(self, response: httpx.Response, chat: bool) -> Optional[str]:
+        """
+        Extract the generated text from a completions or chat completions response.
+        
+        Args:
+            response: Response of the LLM server.
+            chat: Whether the response comes from the chat completions endpoint.
+            
+        Returns:
+            Optional[str]: The generated text, or None if the response has no choices.
+        """
+        response.raise_for_status()
+        result = _decode_json(response.content)
+        
+        if 'choices' in result and len(result['choices']) > 0:
+            choice = result['choices'][0]
+            text = choice.get('message', {}).get('content', '') if chat else choice.get('text', '')
+            return text.strip()
+        else:
+            logger.error(f"Unexpected response format: {result}")
+            return None
+
+    def _request_failed(self, error: Exception, chat: bool) -> None:
+        """
+        Log a failed completion request, remembering whether the server was unreachable.
+        
+        Args:
+            error: The exception raised while sending the request or reading its response.
+            chat: Whether the request went to the chat completions endpoint.
+            
+        Returns:
+            None, so callers can return the result directly.
+        """
+        description = "chat completion" if chat else "completion"
+        if isinstance(error, httpx.TransportError):
+            _UNREACHABLE.set(True)
+            logger.error(f"Error getting {description}: {error}")
+        elif isinstance(error, httpx.HTTPError):
+            logger.error(f"Error getting {description}: {error}")
+        elif isinstance(error, json.JSONDecodeError):
+            logger.error(f"Error decoding response: {error}")
+        else:
+            logger.error(f"Unexpected error: {error}")
+        return None
+
+    def get_embeddings(self, texts: List[str], model: Optional[str] = None) -> Optional[List[List[float]]]:
+        """
+        Get embeddings of texts from the embeddings endpoint of the LLM server.
+        
+        Args:
+            texts: Texts to embed.
+            model: Embedding model identifier, defaults to the configured LLM model.
+            
+        Returns:
+            Optional[List[List[float]]]: The embedding of each text, in the same order,
+            or None if the request failed.
+        """
+        url = self._build_embeddings_url()
+        
+        payload = {
+            'model': model or self.model,
+            'input': texts,
         }
         
         try:
-            response = requests.post(
-                url,
-                headers=self.headers,
-                data=json.dumps(payload),
-                timeout=self.timeout
-            )
+            response = self._post(url, payload)
             
             response.raise_for_status()
-            result = response.json()
+            result = _decode_json(response.content)
             
-            if 'choices' in result and len(result['choices']) > 0:
-                return result['choices'][0].get('text', '').strip()
-            else:
-                logger.error(f"Unexpected response format: {result}")
+            data = result.get('data') if isinstance(result, dict) else None
+            if not data or len(data) != len(texts):
+                logger.error(f"Unexpected embeddings response format: {result}")
                 return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error getting completion: {e}")
+            # Entries carry their position in the input, which servers are not required to keep
+            data = sorted(data, key=lambda entry: entry.get('index', 0))
+            return [entry['embedding'] for entry in data]
+        except httpx.TransportError as e:
+            _UNREACHABLE.set(True)
+            logger.error(f"Error getting embeddings: {e}")
+            return None
+        except httpx.HTTPError as e:
+            logger.error(f"Error getting embeddings: {e}")
             return None
         except json.JSONDecodeError as e:
             logger.error(f"Error decoding response: {e}")
@@ -103,77 +578,326 @@ class LLMClient:
             logger.error(f"Unexpected error: {e}")
             return None
 
-    def get_chat_completion(self, messages: list) -> Optional[str]:
+    def _get_async_client(self) -> httpx.AsyncClient:
         """
-        Get a completion from the LLM using the chat completions endpoint.
+        Get the async HTTP client of the current thread, creating it on first use.
+        
+        The client keeps connections alive so concurrent requests reuse them.
+        It must be closed with aclose() before the event loop that created it ends.
+        
+        Returns:
+            httpx.AsyncClient: The async HTTP client.
+        """
+        client = getattr(self._local, 'async_client', None)
+        if client is None:
+            client = self._local.async_client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                transport=httpx.AsyncHTTPTransport(
+                    http2=True,
+                    retries=MAX_RETRIES,
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency
+                    )
+                )
+            )
+        return client
+
+    async def _aacquire_slot(self) -> None:
+        """Wait for a request slot without blocking the event loop, the slots are shared with other threads."""
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+    async def _apost(self, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        Asynchronously send a JSON request, retrying responses in RETRY_STATUS_CODES.
         
         Args:
-            messages: List of message objects in the format expected by the chat API.
+            url: URL of the endpoint.
+            payload: Request body.
+            
+        Returns:
+            httpx.Response: The response of the last attempt.
+        """
+        _UNREACHABLE.set(False)
+        content = _encode_payload(payload)
+        for attempt in range(MAX_RETRIES + 1):
+            await self._aacquire_slot()
+            try:
+                response = await self._get_async_client().post(url, content=content)
+            finally:
+                self._slots.release()
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+            delay = self._retry_delay(response, attempt)
+            logger.warning("LLM server answered %s, retrying in %.1fs", response.status_code, delay)
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        """Close the async HTTP client of the current thread if it has been created."""
+        client = getattr(self._local, 'async_client', None)
+        if client is not None:
+            try:
+                await client.aclose()
+            finally:
+                self._local.async_client = None
+
+    async def aget_completion(self, prompt: str, max_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Asynchronously get a completion from the LLM using the completions endpoint.
+        
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Optional limit on generated tokens, overriding the configured default.
             
         Returns:
             Optional[str]: The generated text, or None if the request failed.
         """
-        url = self._build_chat_url()
+        return await self._asend(self._build_completion_url(), self._completion_payload(prompt, max_tokens), chat=False)
+
+    async def aget_chat_completion(self, messages: list, response_format: Optional[Dict[str, Any]] = None,
+                                   max_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Asynchronously get a completion from the LLM using the chat completions endpoint.
         
-        payload = {
-            'model': self.model,
-            'messages': messages,
-            'temperature': self.temperature,
-            'max_tokens': self.max_tokens
-        }
+        Args:
+            messages: List of message objects in the format expected by the chat API.
+            response_format: Optional OpenAI-style response format, e.g. a JSON schema to constrain the output.
+            max_tokens: Optional limit on generated tokens, overriding the configured default.
+            
+        Returns:
+            Optional[str]: The generated text, or None if the request failed.
+        """
+        return await self._asend(self._build_chat_url(), self._chat_payload(messages, response_format, max_tokens), chat=True)
+
+    async def _asend(self, url: str, payload: Dict[str, Any], chat: bool) -> Optional[str]:
+        """
+        Asynchronously send a completions or chat completions request and extract the generated text.
         
+        Args:
+            url: URL of the endpoint.
+            payload: Request body.
+            chat: Whether the request goes to the chat completions endpoint.
+            
+        Returns:
+            Optional[str]: The generated text, or None if the request failed.
+        """
         try:
-            response = requests.post(
-                url,
-                headers=self.headers,
-                data=json.dumps(payload),
-                timeout=self.timeout
+            return self._read_text(await self._apost(url, payload), chat)
+        except Exception as e:
+            return self._request_failed(e, chat)
+
+    def _build_classification_messages(self, subject: str, sender: str, date: str, body: str,
+                                       categories: tuple) -> tuple:
+        """
+        Build the prompt and chat messages used to classify a single email.
+        
+        Args:
+            subject: Email subject.
+            sender: Email sender.
+            date: Email date.
+            body: Email body.
+            categories: Tuple of category names.
+            
+        Returns:
+            tuple: (prompt, messages) for the completions and chat completions endpoints.
+        """
+        prompt_parts = _build_prompt_parts(tuple(categories))
+        if prompt_parts:
+            prefix, suffix = prompt_parts
+            prompt = (
+                f"{prefix}Email:\nSubject: {subject}\nFrom: {sender}\nDate: {date}\nBody:\n{body}{suffix}"
             )
+        else:
+            from config import RENDER_PROMPT
             
-            response.raise_for_status()
-            result = response.json()
+            # Render the prompt using the compiled template from config
+            prompt = RENDER_PROMPT(
+                categories=_format_categories(tuple(categories)),
+                subject=subject,
+                sender=sender,
+                date=date,
+                body=body
+            )
+        
+        messages = [
+            {"role": "system", "content": "You are an email classification assistant."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        return prompt, messages
+
+    def classify_email(self, email_id: str, subject: str, sender: str, date: str, body: str,
+                       categories: tuple) -> Optional[str]:
+        """
+        Classify an email into one of the provided categories using the LLM.
+        
+        Args:
+            email_id: Email identifier, used for logging.
+            subject: Email subject.
+            sender: Email sender.
+            date: Email date.
+            body: Email body.
+            categories: Tuple of category names.
             
-            if 'choices' in result and len(result['choices']) > 0:
-                return result['choices'][0].get('message', {}).get('content', '').strip()
-            else:
-                logger.error(f"Unexpected response format: {result}")
-                return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error getting chat completion: {e}")
-            return None
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding response: {e}")
+        Returns:
+            Optional[str]: The predicted category, or None if classification failed.
+        """
+        try:
+            result = None
+            for index, (url, payload, chat, warning) in enumerate(
+                    self._classification_requests(subject, sender, date, body, categories)):
+                if result or (index and _UNREACHABLE.get()):
+                    break
+                if warning:
+                    logger.warning(warning)
+                result = self._send(url, payload, chat)
+            
+            return self._parse_classification(result, categories)
+        except Exception as e:
+            logger.error(f"Error classifying email {email_id}: {e}")
             return None
+
+    async def aclassify_email(self, email_id: str, subject: str, sender: str, date: str, body: str,
+                              categories: tuple) -> Optional[str]:
+        """
+        Asynchronously classify an email into one of the provided categories using the LLM.
+        
+        Args:
+            email_id: Email identifier, used for logging.
+            subject: Email subject.
+            sender: Email sender.
+            date: Email date.
+            body: Email body.
+            categories: Tuple of category names.
+            
+        Returns:
+            Optional[str]: The predicted category, or None if classification failed.
+        """
+        try:
+            result = None
+            for index, (url, payload, chat, warning) in enumerate(
+                    self._classification_requests(subject, sender, date, body, categories)):
+                if result or (index and _UNREACHABLE.get()):
+                    break
+                if warning:
+                    logger.warning(warning)
+                result = await self._asend(url, payload, chat)
+            
+            return self._parse_classification(result, categories)
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error(f"Error classifying email {email_id}: {e}")
             return None
 
-    def classify_email(self, email_data: Dict[str, Any], categories: list) -> Optional[str]:
+    def _classification_requests(self, subject: str, sender: str, date: str, body: str,
+                                 categories: tuple) -> List[Tuple[str, Dict[str, Any], bool, Optional[str]]]:
         """
-        Classify an email into one of the provided categories using the LLM.
+        Build the requests tried, in order, to classify a single email.
+        
+        Chat completion is tried first, constrained to the categories if structured output is enabled,
+        then regular completion. The next request is only sent if the previous one returned nothing
+        and the server is reachable.
+        
+        Args:
+            subject: Email subject.
+            sender: Email sender.
+            date: Email date.
+            body: Email body.
+            categories: Tuple of category names.
+            
+        Returns:
+            List[Tuple[str, Dict[str, Any], bool, Optional[str]]]: (URL, request body, whether it is a
+            chat request, warning to log before sending it) for each request.
+        """
+        prompt, messages = self._build_classification_messages(subject, sender, date, body, categories)
+        chat_url = self._build_chat_url()
+        
+        requests = []
+        warning = None
+        if self.structured_output:
+            # Constrain the output to one of the categories, so only a few tokens are generated
+            payload = self._chat_payload(
+                messages,
+                response_format=self._build_category_response_format(categories),
+                max_tokens=self.classification_max_tokens
+            )
+            requests.append((chat_url, payload, True, None))
+            warning = "Structured chat completion failed, retrying without a response format"
+        
+        # The prompt asks for the category name only, a few tokens are enough
+        requests.append((chat_url, self._chat_payload(messages, max_tokens=self.classification_max_tokens), True, warning))
+        requests.append((self._build_completion_url(), self._completion_payload(prompt), False,
+                         "Chat completion failed, falling back to regular completion"))
+        return requests
+
+    def _build_category_response_format(self, categories: list) -> Dict[str, Any]:
+        """
+        Build a JSON schema response format that only allows one of the categories.
+        
+        Supported by OpenAI-compatible servers such as llama.cpp and vLLM. The format is
+        built once per set of categories and must not be modified.
         
         Args:
-            email_data: Dictionary containing email data.
             categories: List of category names.
             
         Returns:
-            Optional[str]: The predicted category, or None if classification failed.
+            Dict[str, Any]: The response_format value for the chat completions request.
         """
-        from config import CLASSIFICATION_PROMPT_TEMPLATE
+        return _category_response_format(tuple(categories))
+
+    def _parse_classification(self, result: Optional[str], categories: list) -> Optional[str]:
+        """
+        Turn the LLM response for a single email into a category.
         
-        # Format the categories as a comma-separated list
-        categories_str = ", ".join([f"'{cat}'" for cat in categories])
+        Args:
+            result: Raw text returned by the LLM, or None if the request failed.
+            categories: List of category names.
+            
+        Returns:
+            Optional[str]: The predicted category, or None if the response is missing or unusable.
+        """
+        if not result:
+            logger.error("Failed to get a response from the LLM")
+            return None
         
-        # Format the prompt using the template from config
-        prompt = CLASSIFICATION_PROMPT_TEMPLATE.format(
-            categories=categories_str,
-            subject=email_data.get('subject', ''),
-            sender=email_data.get('sender', ''),
-            date=email_data.get('date', ''),
-            body=email_data.get('body', '')[:10000]  # Limit body length to avoid token limits
+        category = self._match_category(result, categories)
+        if category:
+            return category
+        
+        logger.warning(f"LLM response '{result}' doesn't match any category")
+        return None
+
+    def classify_batch(self, emails: List[Dict[str, Any]], categories: tuple) -> Optional[Dict[str, str]]:
+        """
+        Classify several emails with a single LLM request.
+        
+        Args:
+            emails: List of dictionaries containing email data.
+            categories: Tuple of category names.
+            
+        Returns:
+            Optional[Dict[str, str]]: Mapping of email ID to predicted category for every
+            entry the LLM answered with a valid category, or None if the request or parsing failed.
+        """
+        from config import RENDER_BATCH_PROMPT
+        
+        # Render each email as a numbered entry tagged with its ID
+        email_entries = []
+        for number, email_data in enumerate(emails, 1):
+            email_entries.append(
+                f"{number}. ID: {email_data.get('id', '')}\n"
+                f"Subject: {email_data.get('subject', '')}\n"
+                f"From: {email_data.get('sender', '')}\n"
+                f"Date: {email_data.get('date', '')}\n"
+                f"Body:\n{truncate_body(email_data.get('body', ''), self.batch_body_chars)}\n"
+            )
+        
+        prompt = RENDER_BATCH_PROMPT(
+            categories=_format_categories(tuple(categories)),
+            emails="\n".join(email_entries)
         )
         
-        # Try chat completion first, fall back to regular completion if it fails
         messages = [
             {"role": "system", "content": "You are an email classification assistant."},
             {"role": "user", "content": prompt}
@@ -181,28 +905,81 @@ class LLMClient:
         
         try:
             result = self.get_chat_completion(messages)
-            if not result:
+            if not result and not _UNREACHABLE.get():
                 logger.warning("Chat completion failed, falling back to regular completion")
                 result = self.get_completion(prompt)
             
-            if result:
-                # Clean up the result to extract just the category name
-                result = result.strip().lower()
-                
-                # Check if the result matches any of the categories
-                for category in categories:
-                    if category.lower() in result:
-                        return category
-                
-                logger.warning(f"LLM response '{result}' doesn't match any category")
-                return None
-            else:
+            if not result:
                 logger.error("Failed to get a response from the LLM")
                 return None
+            
+            # Models sometimes wrap the JSON in prose or code fences, so extract the array
+            start = result.find('[')
+            end = result.rfind(']')
+            if start == -1 or end < start:
+                return self._parse_batch_lines(result, emails, categories)
+            
+            entries = _decode_json(result[start:end + 1])
+            
+            categories_by_id = {}
+            for entry in entries:
+                if not isinstance(entry, dict):
+                    continue
+                category = self._match_category(str(entry.get('category', '')), categories)
+                if category:
+                    categories_by_id[str(entry.get('id', ''))] = category
+            
+            return categories_by_id
+        except json.JSONDecodeError as e:
+            logger.warning(f"Error decoding LLM batch response: {e}")
+            return self._parse_batch_lines(result, emails, categories)
         except Exception as e:
-            logger.error(f"Error classifying email: {e}")
+            logger.error(f"Error classifying email batch: {e}")
             return None
 
+    def _parse_batch_lines(self, result: str, emails: List[Dict[str, Any]], categories: tuple) -> Optional[Dict[str, str]]:
+        """
+        Parse a batch response that is not a JSON array, as one numbered line per email.
+        
+        Models that ignore the requested format usually still answer with lines like
+        "1. bills", numbered like the emails in the prompt.
+        
+        Args:
+            result: Raw text returned by the LLM.
+            emails: The emails of the batch, in prompt order.
+            categories: Tuple of category names.
+            
+        Returns:
+            Optional[Dict[str, str]]: Mapping of email ID to category for every numbered line
+            with a valid category, or None if there is none.
+        """
+        categories_by_id = {}
+        for match in _NUMBERED_LINE_RE.finditer(result):
+            number = int(match.group(1))
+            if not 1 <= number <= len(emails):
+                continue
+            category = self._match_category(match.group(2), categories)
+            if category:
+                categories_by_id.setdefault(str(emails[number - 1].get('id', '')), category)
+        
+        if not categories_by_id:
+            logger.warning(f"LLM batch response has neither a JSON array nor numbered categories: '{result}'")
+            return None
+        return categories_by_id
+
+    def _match_category(self, result: str, categories: list) -> Optional[str]:
+        """
+        Extract a category name from an LLM response.
+        
+        Args:
+            result: Raw text returned by the LLM.
+            categories: List of category names.
+            
+        Returns:
+            Optional[str]: The first category found in the response, or None if none matched.
+        """
+        return _get_category_matcher(tuple(categories)).match(result)
+
     def test_connection(self) -> bool:
         """
         Test the connection to the LLM API.
@@ -211,7 +988,18 @@ class LLMClient:
             bool: True if the connection is successful, False otherwise.
         """
         try:
-            # Simple test prompt
+            # Listing the models needs no generation, OpenAI-compatible servers answer it instantly
+            try:
+                response = self._client.get(self._build_models_url(), timeout=MODELS_PROBE_TIMEOUT)
+                if response.status_code == 200:
+                    logger.info("Successfully connected to LLM API (models)")
+                    return True
+                logger.debug(f"Models endpoint answered {response.status_code}, probing with a completion")
+            except httpx.TransportError as e:
+                logger.error(f"Failed to connect to LLM API: {e}")
+                return False
+            
+            # Simple test prompt, a single generated token is enough to know the server works
             test_prompt = "Hello, this is a test."
             
             # Try chat completion first
@@ -219,13 +1007,13 @@ class LLMClient:
                 {"role": "user", "content": test_prompt}
             ]
             
-            result = self.get_chat_completion(messages)
+            result = self.get_chat_completion(messages, max_tokens=1)
             if result is not None:
                 logger.info("Successfully connected to LLM API (chat)")
                 return True
             
             # Fall back to regular completion
-            result = self.get_completion(test_prompt)
+            result = self.get_completion(test_prompt, max_tokens=1)
             if result is not None:
                 logger.info("Successfully connected to LLM API (completion)")
                 return True
@@ -4,14 +4,15 @@ Main entry point for the Email Classifier application.
 import argparse
 import logging
 import os
+from logging.handlers import RotatingFileHandler
 import sys
 import time
 from datetime import datetime
 
-from config import LOGGING_CONFIG, EMAIL_CATEGORIES, PROCESSING_CONFIG
-from email_processor import EmailProcessor
-from classifier import EmailClassifier
-from folder_manager import FolderManager
+from config import LOGGING_CONFIG, PROCESSING_CONFIG, EMAIL_CONFIG
+
+# The IMAP, LLM and classifier modules are imported by the commands that use them, so cron runs
+# and commands like --help or --list-categories start without loading them
 
 # Configure logging
 def setup_logging():
@@ -24,13 +25,18 @@ def setup_logging():
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
     
-    # Configure logging
+    # Under cron stderr is mailed, which makes every console write wait for the mail system
+    to_console = LOGGING_CONFIG['log_to_console']
+    to_console = sys.stderr.isatty() if to_console == 'auto' else to_console == 'true'
+    
+    # Configure logging, the log file is only opened when the first record is written
     logging.basicConfig(
         level=log_level,
         format=log_format,
         handlers=[
-            logging.FileHandler(LOGGING_CONFIG['log_file']),
-            logging.StreamHandler() if LOGGING_CONFIG['log_to_console'] else logging.NullHandler()
+            RotatingFileHandler(LOGGING_CONFIG['log_file'], maxBytes=LOGGING_CONFIG['log_max_bytes'],
+                                backupCount=LOGGING_CONFIG['log_backup_count'], delay=True),
+            logging.StreamHandler() if to_console else logging.NullHandler()
         ]
     )
 
@@ -38,34 +44,57 @@ def setup_logging():
 logger = logging.getLogger(__name__)
 
 
-def process_emails():
+def create_email_processor():
+    """
+    Create the email processor, using aioimaplib if IMAP_ASYNC is enabled and it is installed.
+    
+    Returns:
+        EmailProcessor: The email processor.
+    """
+    from email_processor import EmailProcessor
+    
+    if EMAIL_CONFIG['async_imap']:
+        try:
+            from async_email_processor import AsyncEmailProcessor
+            return AsyncEmailProcessor()
+        except ImportError as e:
+            logger.error(f"Failed to initialize async email processor, using imaplib: {e}")
+    return EmailProcessor()
+
+
+def process_emails(email_processor, classifier):
     """
     Process emails from the configured folders.
     
+    Args:
+        email_processor: Email processor shared by the whole run.
+        classifier: Email classifier shared by the whole run.
+    
     Returns:
         tuple: (processed_count, success_count)
     """
-    # Initialize components
-    email_processor = EmailProcessor()
-    classifier = EmailClassifier()
-    folder_manager = FolderManager()
+    from folder_manager import FolderManager
     
-    # Ensure category folders exist
-    if not folder_manager.ensure_category_folders_exist():
-        logger.warning("Some category folders could not be created")
+    # Ensure category folders exist, processing then reuses the same session. The async processor
+    # checks them over its own session, a check here would log in a second time with imaplib
+    if not email_processor.uses_async_session:
+        with FolderManager(email_processor) as folder_manager:
+            if not folder_manager.ensure_category_folders_exist():
+                logger.warning("Some category folders could not be created")
     
     # Test LLM connection
     if not classifier.test_llm_connection():
         logger.error("Failed to connect to LLM API")
         return 0, 0
     
-    # Define the processor function that will be called for each email
-    def classify_and_get_category(email_data):
-        """Classify an email and return the category."""
-        return classifier.classify_email(email_data)
+    # Define the processor function that will be called for each batch of emails
+    def classify_and_get_categories(emails):
+        """Classify a batch of emails and return their category indices."""
+        return classifier.classify_emails_idx(emails)
+    classify_and_get_categories.needs = classifier.needs
     
     # Process emails
-    return email_processor.process_emails(classify_and_get_category)
+    return email_processor.process_emails(classify_and_get_categories, classifier.get_category_folders())
 
 
 def main():
@@ -93,16 +122,20 @@ def main():
     
     logger.info("Starting Email Classifier")
     
+    # Created by the commands that need the IMAP server, so a run logs in at most once
+    email_processor = None
+    
     try:
         # Test connections
         if args.test:
+            from classifier import EmailClassifier
+            
             logger.info("Testing connections...")
             
             # Test email connection
-            email_processor = EmailProcessor()
+            email_processor = create_email_processor()
             if email_processor.connect():
                 logger.info("Email connection successful")
-                email_processor.disconnect()
             else:
                 logger.error("Email connection failed")
             
@@ -117,8 +150,11 @@ def main():
         
         # List folders
         if args.list_folders:
-            folder_manager = FolderManager()
-            folders = folder_manager.get_available_folders()
+            from folder_manager import FolderManager
+            
+            email_processor = create_email_processor()
+            with FolderManager(email_processor) as folder_manager:
+                folders = folder_manager.get_available_folders()
             
             if folders:
                 logger.info("Available folders:")
@@ -131,13 +167,14 @@ def main():
         
         # List categories
         if args.list_categories:
-            classifier = EmailClassifier()
-            categories = classifier.get_available_categories()
+            # The classifier uses the registry's categories, no need to load it
+            from category_registry import CATEGORIES
+            
+            categories = CATEGORIES.folders()
             
             if categories:
                 logger.info("Available categories:")
-                for category in categories:
-                    folder = EMAIL_CATEGORIES.get(category, "Unknown")
+                for category, folder in categories.items():
                     print(f"- {category} -> {folder}")
             else:
                 logger.warning("No categories found")
@@ -146,36 +183,44 @@ def main():
         
         # Add category
         if args.add_category:
+            from folder_manager import FolderManager
+            
             category, folder = args.add_category
             
-            folder_manager = FolderManager()
-            classifier = EmailClassifier()
+            email_processor = create_email_processor()
             
-            if folder_manager.add_category_folder(category, folder) and classifier.add_category(category, folder):
-                logger.info(f"Added category '{category}' with folder '{folder}'")
-            else:
-                logger.error(f"Failed to add category '{category}' with folder '{folder}'")
+            # The folder manager updates the category registry shared with the classifier
+            with FolderManager(email_processor) as folder_manager:
+                if folder_manager.add_category_folder(category, folder):
+                    logger.info(f"Added category '{category}' with folder '{folder}'")
+                else:
+                    logger.error(f"Failed to add category '{category}' with folder '{folder}'")
             
             return
         
         # Remove category
         if args.remove_category:
+            from folder_manager import FolderManager
+            
             category = args.remove_category
             
-            folder_manager = FolderManager()
-            classifier = EmailClassifier()
+            email_processor = create_email_processor()
             
-            if folder_manager.remove_category_folder(category) and classifier.remove_category(category):
-                logger.info(f"Removed category '{category}'")
-            else:
-                logger.error(f"Failed to remove category '{category}'")
+            with FolderManager(email_processor) as folder_manager:
+                if folder_manager.remove_category_folder(category):
+                    logger.info(f"Removed category '{category}'")
+                else:
+                    logger.error(f"Failed to remove category '{category}'")
             
             return
         
         # Process emails (default action)
         if args.process or not any([args.test, args.list_folders, args.list_categories, args.add_category, args.remove_category]):
+            from classifier import EmailClassifier
+            
             start_time = time.time()
-            processed_count, success_count = process_emails()
+            email_processor = create_email_processor()
+            processed_count, success_count = process_emails(email_processor, EmailClassifier())
             end_time = time.time()
             
             logger.info(f"Processed {processed_count} emails, {success_count} successfully categorized")
@@ -186,6 +231,13 @@ def main():
     except Exception as e:
         logger.exception(f"Unexpected error: {e}")
         return 1
+    finally:
+        if email_processor is not None:
+            email_processor.disconnect()
+        # The LLM client only exists if a command imported it
+        llm_client = sys.modules.get('llm_client')
+        if llm_client is not None:
+            llm_client.LLMClient.close_instance()
     
     logger.info("Email Classifier completed")
     return 0
@@ -0,0 +1,200 @@
+"""
+Pipelined fetch, classify and move of emails, overlapping LLM latency with IMAP latency.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Maximum number of classified emails waiting to be moved
+MOVE_QUEUE_SIZE = 32
+# Maximum number of emails routed in one hop to the IMAP thread
+MOVE_BATCH_SIZE = 16
+# Maximum number of fetched batches waiting to be classified
+CLASSIFY_QUEUE_SIZE = 2
+
+
+class EmailBudget:
+    """
+    Number of emails a run may still process, shared by the pipelines of all folders.
+    """
+
+    def __init__(self, total: int):
+        """
+        Initialize the budget.
+        
+        Args:
+            total: Maximum number of emails to process.
+        """
+        self._remaining = total
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        """Number of emails that can still be reserved."""
+        return self._remaining
+
+    def reserve(self, count: int) -> int:
+        """
+        Reserve up to `count` emails of the budget.
+        
+        Args:
+            count: Number of emails to reserve.
+            
+        Returns:
+            int: Number of emails actually reserved.
+        """
+        with self._lock:
+            granted = max(0, min(count, self._remaining))
+            self._remaining -= granted
+            return granted
+
+
+async def run_pipeline(email_processor, processor_func: Callable[[List[Dict[str, Any]]], List[Optional[int]]],
+                       category_folders: Tuple[str, ...], dry_run: bool,
+                       folder_exists_cache: Dict[str, bool],
+                       budget: Optional[EmailBudget] = None) -> Tuple[int, int]:
+    """
+    Fetch, classify and move the unprocessed emails of all configured folders.
+    
+    The three stages run concurrently and are connected by queues, so the emails of one batch
+    are moved while the next batch is being classified. imaplib connections are not thread-safe,
+    so fetching and moving share a single IMAP worker thread, while classification runs in its
+    own thread. Before switching to the next folder, the fetcher waits for both queues to drain,
+    so every IMAP command runs against the folder the email was fetched from.
+    
+    Args:
+        email_processor: Connected EmailProcessor.
+        processor_func: Function that takes a list of email dicts and returns a list with
+            the category index of each email (or None), in the same order.
+        category_folders: Destination folder of each category index.
+        dry_run: Whether emails should only be classified and marked as processed.
+        folder_exists_cache: Whether each destination folder exists, by folder name.
+        budget: Optional budget shared with the pipelines of other folders, defaults to the
+            processor's `max_emails_per_run`.
+    
+    Returns:
+        Tuple[int, int]: (Number of emails processed, number of emails successfully categorized)
+    """
+    loop = asyncio.get_running_loop()
+    if budget is None:
+        budget = EmailBudget(email_processor.max_emails_per_run)
+    imap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='imap')
+    llm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='llm')
+
+    classify_queue = asyncio.Queue(maxsize=CLASSIFY_QUEUE_SIZE)
+    move_queue = asyncio.Queue(maxsize=MOVE_QUEUE_SIZE)
+    counts = {'processed': 0, 'success': 0}
+
+    def imap(func, *args):
+        return loop.run_in_executor(imap_executor, func, *args)
+
+    def fetch_batch(batch):
+        return list(email_processor.fetch_emails_bulk(batch))
+
+    def route_group(group):
+        by_folder = {}
+        for folder, email_data, category_idx in group:
+            by_folder.setdefault(folder, []).append((email_data, category_idx))
+        return sum(
+            email_processor.route_emails(routed, folder, category_folders, dry_run, folder_exists_cache)
+            for folder, routed in by_folder.items()
+        )
+
+    async def fetcher():
+        try:
+            for folder in email_processor.folders_to_process:
+                logger.info(f"Processing folder: {folder}")
+                
+                # Get unprocessed emails
+                remaining = budget.remaining
+                if remaining <= 0:
+                    break
+                
+                email_ids = await imap(email_processor.get_unprocessed_emails, folder, remaining)
+                logger.info(f"Found {len(email_ids)} unprocessed emails in {folder}")
+                email_ids = email_ids[:budget.reserve(len(email_ids))]
+                
+                # Emails classified by an earlier run skip fetching and classification
+                known, email_ids = await imap(email_processor.split_known_routes, email_ids, category_folders)
+                counts['processed'] += len(known)
+                for email_data, category_idx in known:
+                    await move_queue.put((folder, email_data, category_idx))
+                
+                for i in range(0, len(email_ids), email_processor.batch_size):
+                    batch_start = loop.time()
+                    batch_emails = await imap(fetch_batch, email_ids[i:i + email_processor.batch_size])
+                    if not batch_emails:
+                        continue
+                    
+                    counts['processed'] += len(batch_emails)
+                    await classify_queue.put((folder, batch_emails))
+                    
+                    # Only wait if the server answered faster than the minimum batch interval
+                    delay = email_processor.min_batch_interval - (loop.time() - batch_start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                
+                # Finish this folder before another one gets selected
+                await classify_queue.join()
+                await move_queue.join()
+        finally:
+            await classify_queue.put(None)
+
+    async def classifier():
+        try:
+            while True:
+                item = await classify_queue.get()
+                if item is None:
+                    break
+                
+                folder, batch_emails = item
+                try:
+                    # Call the processor function to get the category index of every email in the batch
+                    category_indices = await loop.run_in_executor(llm_executor, processor_func, batch_emails)
+                except Exception as e:
+                    logger.error(f"Error classifying batch of {len(batch_emails)} emails: {e}")
+                    category_indices = [None] * len(batch_emails)
+                
+                for email_data, category_idx in zip(batch_emails, category_indices):
+                    await move_queue.put((folder, email_data, category_idx))
+                classify_queue.task_done()
+        finally:
+            await move_queue.put(None)
+
+    async def mover():
+        while True:
+            item = await move_queue.get()
+            if item is None:
+                break
+            
+            # Route whatever else is already waiting in the same hop to the IMAP thread
+            group = [item]
+            while len(group) < MOVE_BATCH_SIZE and not move_queue.empty():
+                item = move_queue.get_nowait()
+                if item is None:
+                    break
+                group.append(item)
+            
+            try:
+                counts['success'] += await imap(route_group, group)
+            except Exception as e:
+                logger.error(f"Error moving batch of {len(group)} emails: {e}")
+            finally:
+                for _ in group:
+                    move_queue.task_done()
+            
+            if item is None:
+                break
+    
+    try:
+        await asyncio.gather(fetcher(), classifier(), mover())
+    finally:
+        imap_executor.shutdown(wait=True)
+        llm_executor.shutdown(wait=True)
+    
+    return counts['processed'], counts['success']
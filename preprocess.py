@@ -0,0 +1,318 @@
+"""
+Normalization of email bodies before classification.
+"""
+import logging
+import re
+from html import unescape
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Byte values used by the kernel
+_LF = 10
+_CR = 13
+_SPACE = 32
+_TAB = 9
+_VT = 11  # vertical tab
+_FF = 12  # form feed
+_GT = 62  # '>'
+_LT = 60  # '<'
+_SLASH = 47  # '/'
+_REPLY_PREFIX = b"On "
+_REPLY_SUFFIX = b" wrote:"
+_SCRIPT = b"script"
+_STYLE = b"style"
+
+# HTML tags, and script/style elements whose content is not text, for when Numba is not installed
+# A negated class instead of a lazy quantifier, so a tag is matched in one scan without backtracking
+_TAG_RE = re.compile(r'<[^<>]+>')
+_SCRIPT_STYLE_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+
+
+def _is_blank(buf, start, end):
+    """Return True if buf[start:end] only contains spaces and tabs."""
+    for i in range(start, end):
+        if buf[i] != _SPACE and buf[i] != _TAB:
+            return False
+    return True
+
+
+def _is_reply_marker(buf, start, end, prefix, suffix):
+    """Return True if buf[start:end] is an "On ... wrote:" line."""
+    if end - start < len(prefix) + len(suffix):
+        return False
+    for i in range(len(prefix)):
+        if buf[start + i] != prefix[i]:
+            return False
+    offset = end - len(suffix)
+    for i in range(len(suffix)):
+        if buf[offset + i] != suffix[i]:
+            return False
+    return True
+
+
+def _clean_body_kernel(buf, prefix, suffix):
+    """
+    Clean a UTF-8 encoded email body in a single pass.
+    
+    Line endings are normalized to LF, quoted lines (starting with '>') are dropped, runs of
+    blank lines are collapsed into one and everything from an "On ... wrote:" line onwards is
+    cut, unless it is the first line.
+    """
+    n = len(buf)
+    out = np.empty(n, dtype=np.uint8)
+    i = 0
+    j = 0
+    first_line = True
+    previous_blank = False
+    while i < n:
+        # Find the end of the current line
+        end = i
+        while end < n and buf[end] != _LF:
+            end += 1
+        line_end = end
+        if line_end > i and buf[line_end - 1] == _CR:
+            line_end -= 1
+        
+        if not first_line and _is_reply_marker(buf, i, line_end, prefix, suffix):
+            break
+        first_line = False
+        
+        if line_end > i and buf[i] == _GT:
+            i = end + 1
+            continue
+        
+        blank = _is_blank(buf, i, line_end)
+        if blank and previous_blank:
+            i = end + 1
+            continue
+        previous_blank = blank
+        
+        if not blank:
+            for k in range(i, line_end):
+                out[j] = buf[k]
+                j += 1
+        if end < n:
+            out[j] = _LF
+            j += 1
+        i = end + 1
+    
+    return out[:j]
+
+
+def _is_tag_name(buf, start, end, name):
+    """Return True if the tag in buf[start:end] (after '<' or '</') is named name (lowercase)."""
+    if end - start < len(name):
+        return False
+    for k in range(len(name)):
+        c = buf[start + k]
+        # ASCII lowercase
+        if 65 <= c <= 90:
+            c += 32
+        if c != name[k]:
+            return False
+    if end - start == len(name):
+        return True
+    c = buf[start + len(name)]
+    return c == _SPACE or c == _TAB or c == _LF or c == _CR or c == _SLASH
+
+
+def _html_text_kernel(buf, script, style):
+    """
+    Strip the tags of UTF-8 encoded HTML in a single pass.
+    
+    Tags are replaced by a space, the content of script and style elements is dropped and runs
+    of whitespace other than line breaks are collapsed into one space. Entities are left as is.
+    """
+    n = len(buf)
+    out = np.empty(n, dtype=np.uint8)
+    i = 0
+    j = 0
+    space = False
+    # Element whose content is being skipped: 0 for none, 1 for script, 2 for style
+    skip = 0
+    while i < n:
+        c = buf[i]
+        if c == _LT:
+            # Find the end of the tag, like the <[^<>]+> pattern
+            end = i + 1
+            while end < n and buf[end] != _GT and buf[end] != _LT:
+                end += 1
+            if end < n and buf[end] == _GT and end > i + 1:
+                closing = buf[i + 1] == _SLASH
+                name_start = i + 2 if closing else i + 1
+                if skip == 0:
+                    if not closing and _is_tag_name(buf, name_start, end, script):
+                        skip = 1
+                    elif not closing and _is_tag_name(buf, name_start, end, style):
+                        skip = 2
+                elif closing and _is_tag_name(buf, name_start, end, script if skip == 1 else style):
+                    skip = 0
+                
+                if not space:
+                    out[j] = _SPACE
+                    j += 1
+                    space = True
+                i = end + 1
+                continue
+        
+        if skip != 0:
+            i += 1
+            continue
+        
+        if c == _SPACE or c == _TAB or c == _CR or c == _VT or c == _FF:
+            if not space:
+                out[j] = _SPACE
+                j += 1
+                space = True
+        else:
+            out[j] = c
+            j += 1
+            space = False
+        i += 1
+    
+    return out[:j]
+
+
+if njit is not None:
+    _is_blank = njit(cache=True)(_is_blank)
+    _is_reply_marker = njit(cache=True)(_is_reply_marker)
+    _clean_body_kernel = njit(cache=True)(_clean_body_kernel)
+    _is_tag_name = njit(cache=True)(_is_tag_name)
+    _html_text_kernel = njit(cache=True)(_html_text_kernel)
+    _REPLY_PREFIX_BUF = np.frombuffer(_REPLY_PREFIX, dtype=np.uint8)
+    _REPLY_SUFFIX_BUF = np.frombuffer(_REPLY_SUFFIX, dtype=np.uint8)
+    _SCRIPT_BUF = np.frombuffer(_SCRIPT, dtype=np.uint8)
+    _STYLE_BUF = np.frombuffer(_STYLE, dtype=np.uint8)
+
+
+def clean_body_bytes(buf):
+    """
+    Clean a UTF-8 encoded email body with the Numba-compiled kernel.
+    
+    Args:
+        buf: uint8 numpy array holding the encoded body.
+    
+    Returns:
+        The cleaned body as a uint8 numpy array.
+    """
+    return _clean_body_kernel(buf, _REPLY_PREFIX_BUF, _REPLY_SUFFIX_BUF)
+
+
+def _clean_body_python(body: str) -> str:
+    """
+    Pure-Python equivalent of the kernel, used when Numba is not installed.
+    
+    Args:
+        body: Email body.
+    
+    Returns:
+        str: The cleaned body.
+    """
+    lines = body.split('\n')
+    last = len(lines) - 1
+    parts = []
+    previous_blank = False
+    for index, line in enumerate(lines):
+        if line.endswith('\r'):
+            line = line[:-1]
+        
+        if index > 0 and line.startswith("On ") and line.endswith(" wrote:") and len(line) >= 10:
+            break
+        
+        if line.startswith('>'):
+            continue
+        
+        blank = not line.strip(' \t')
+        if blank and previous_blank:
+            continue
+        previous_blank = blank
+        
+        if not blank:
+            parts.append(line)
+        if index < last:
+            parts.append('\n')
+    
+    return ''.join(parts)
+
+
+def clean_body(body: str) -> str:
+    """
+    Normalize an email body for classification.
+    
+    Line endings are normalized, quoted lines and the quoted reply chain are dropped and runs
+    of blank lines are collapsed. Uses the Numba-compiled kernel when Numba is installed.
+    
+    Args:
+        body: Email body.
+    
+    Returns:
+        str: The cleaned body.
+    """
+    if not body:
+        return ''
+    
+    if njit is None:
+        return _clean_body_python(body)
+    
+    buf = np.frombuffer(body.encode('utf-8', errors='surrogatepass'), dtype=np.uint8)
+    return clean_body_bytes(buf).tobytes().decode('utf-8', errors='replace')
+
+
+def html_to_text(html_body: str) -> str:
+    """
+    Strip the tags, scripts and styles of an HTML email body and unescape its entities.
+    
+    Uses the Numba-compiled kernel when Numba is installed, which also collapses runs of
+    whitespace other than line breaks; the caller collapses the remaining ones.
+    
+    Args:
+        html_body: HTML content.
+    
+    Returns:
+        str: The text content.
+    """
+    if njit is None:
+        return unescape(_TAG_RE.sub(' ', _SCRIPT_STYLE_RE.sub(' ', html_body)))
+    
+    buf = np.frombuffer(html_body.encode('utf-8', errors='surrogatepass'), dtype=np.uint8)
+    text = _html_text_kernel(buf, _SCRIPT_BUF, _STYLE_BUF).tobytes().decode('utf-8', errors='replace')
+    return unescape(text) if '&' in text else text
+
+
+def truncate_body(body: str, max_chars: int) -> str:
+    """
+    Truncate a body to at most `max_chars` characters, at a word boundary so no partial word is tokenized.
+    
+    Args:
+        body: Email body.
+        max_chars: Maximum number of characters kept.
+    
+    Returns:
+        str: The body, with a truncation marker if it was cut.
+    """
+    if len(body) <= max_chars:
+        return body
+    
+    # Only look back a little for a space, a body without spaces is cut at the limit
+    cut = body.rfind(' ', max(0, max_chars - 100), max_chars)
+    return body[:cut if cut > 0 else max_chars] + "... [truncated]"
+
+
+def warm_up() -> None:
+    """Compile (or load from the on-disk cache) the Numba kernels before the first email."""
+    if njit is None:
+        return
+    
+    try:
+        clean_body_bytes(np.zeros(1, dtype=np.uint8))
+        _html_text_kernel(np.zeros(1, dtype=np.uint8), _SCRIPT_BUF, _STYLE_BUF)
+    except Exception as e:
+        logger.error(f"Failed to compile the body preprocessing kernels: {e}")
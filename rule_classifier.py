@@ -0,0 +1,108 @@
+"""
+Rule-based classification of emails by sender domain, mailing list headers and subject.
+"""
+import logging
+import re
+from email.utils import parseaddr
+from typing import Dict, Any, Optional, List
+
+from config import CLASSIFICATION_RULES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class RuleClassifier:
+    """
+    Classifies emails with the deterministic rules in CLASSIFICATION_RULES, so that emails
+    from known senders are categorized without an LLM request.
+    """
+
+    def __init__(self, categories: List[str]):
+        """
+        Initialize the rule classifier.
+        
+        Args:
+            categories: List of category names, rules for other categories are ignored.
+        """
+        self.set_categories(categories)
+
+    def set_categories(self, categories: List[str]) -> None:
+        """
+        Build the rule tables for a set of categories.
+        
+        Args:
+            categories: List of category names.
+        """
+        valid = set(categories)
+        
+        self._by_domain: Dict[str, str] = {}
+        for domain, category in CLASSIFICATION_RULES['domain_to_category'].items():
+            if category in valid:
+                self._by_domain[domain.strip().lower().lstrip('@')] = category
+            else:
+                logger.warning("Ignoring rule for domain '%s': unknown category '%s'", domain, category)
+        
+        list_category = CLASSIFICATION_RULES['list_unsubscribe_category']
+        self._list_category = list_category if list_category in valid else None
+        if list_category and self._list_category is None:
+            logger.warning("Ignoring List-Unsubscribe rule: unknown category '%s'", list_category)
+        
+        self._subject_rules = []
+        for pattern, category in CLASSIFICATION_RULES['subject_patterns']:
+            if category not in valid:
+                logger.warning("Ignoring subject rule '%s': unknown category '%s'", pattern, category)
+                continue
+            try:
+                self._subject_rules.append((re.compile(pattern, re.IGNORECASE), category))
+            except re.error as e:
+                logger.warning("Ignoring invalid subject rule '%s': %s", pattern, e)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any rule is configured."""
+        return bool(self._by_domain or self._list_category or self._subject_rules)
+
+    def _match_domain(self, sender: str) -> Optional[str]:
+        """
+        Look up the category of the sender's domain or of one of its parent domains.
+        
+        Args:
+            sender: From header of the email.
+            
+        Returns:
+            Optional[str]: The category of the most specific matching domain, or None.
+        """
+        address = parseaddr(sender)[1]
+        domain = address.rpartition('@')[2].lower()
+        while domain:
+            category = self._by_domain.get(domain)
+            if category:
+                return category
+            domain = domain.partition('.')[2]
+        return None
+
+    def classify(self, email_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Classify an email by the first matching rule: sender domain, List-Unsubscribe header, subject.
+        
+        Args:
+            email_data: Dictionary containing email data.
+            
+        Returns:
+            Optional[str]: The category of the first matching rule, or None if no rule matches.
+        """
+        if self._by_domain:
+            category = self._match_domain(email_data.get('sender', ''))
+            if category:
+                return category
+        
+        if self._list_category and email_data.get('list_unsubscribe'):
+            return self._list_category
+        
+        subject = email_data.get('subject', '')
+        for pattern, category in self._subject_rules:
+            if pattern.search(subject):
+                return category
+        
+        return None
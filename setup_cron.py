@@ -6,9 +6,10 @@ import os
 import sys
 import subprocess
 import argparse
-from crontab import CronTab
 from pathlib import Path
 
+# python-crontab is imported by the functions that use it, after main() made sure it is installed
+
 
 def setup_cron_job(schedule='0 2 * * *', user=None):
     """
@@ -32,6 +33,7 @@ def setup_cron_job(schedule='0 2 * * *', user=None):
         command = f"cd {project_dir} && {python_executable} {project_dir}/main.py"
         
         # Set up the cron job
+        from crontab import CronTab
         cron = CronTab(user=user)
         job = cron.new(command=command)
         job.setall(schedule)
@@ -59,6 +61,8 @@ def remove_cron_job(user=None):
         bool: True if the cron job was removed successfully, False otherwise.
     """
     try:
+        from crontab import CronTab
+        
         cron = CronTab(user=user)
         
         # Find and remove jobs with the 'Email Classifier' comment
@@ -89,6 +93,8 @@ def list_cron_jobs(user=None):
         user: User to list cron jobs for (default: current user).
     """
     try:
+        from crontab import CronTab
+        
         cron = CronTab(user=user)
         
         # Find jobs with the 'Email Classifier' comment
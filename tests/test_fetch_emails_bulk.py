@@ -0,0 +1,73 @@
+"""
+Tests for the two-phase fetch of EmailProcessor.fetch_emails_bulk.
+"""
+import unittest
+
+from email_processor import EmailProcessor, STRUCTURE_FETCH_ITEMS
+
+
+def _fetch_response(uids):
+    """Build an imaplib UID FETCH response with the headers and text of each UID."""
+    data = []
+    for seq, uid in enumerate(uids, 1):
+        header = f"Subject: Email {uid}\r\nFrom: sender@example.com\r\n\r\n".encode('ascii')
+        text = f"Body of email {uid}".encode('ascii')
+        data.append((f"{seq} (UID {uid} RFC822.SIZE 100 BODY[HEADER.FIELDS (SUBJECT FROM)] {{{len(header)}}}".encode('ascii'), header))
+        data.append((f" BODY[TEXT]<0> {{{len(text)}}}".encode('ascii'), text))
+        data.append(b')')
+    return data
+
+
+class FetchEmailsBulkTest(unittest.TestCase):
+    """fetch_emails_bulk falls back to fetching whole chunks when the probe fails."""
+
+    def setUp(self):
+        self.processor = EmailProcessor()
+        self.processor.connection = object()
+        self.processor.needs = frozenset(('subject', 'sender', 'body'))
+        self.processor.batch_size = 10
+        self.commands = []
+        self.failing = set()
+        self.processor._imap = self._imap
+
+    def _imap(self, command, *args):
+        """Answer UID FETCH commands, failing the ones whose UID set and items are in `failing`."""
+        _, uid_set, items = args
+        items = items[len('(UID '):-1]
+        self.commands.append((uid_set, items))
+        if STRUCTURE_FETCH_ITEMS in items or (uid_set, items) in self.failing:
+            return 'NO', [b'FETCH failed']
+        return 'OK', _fetch_response(uid_set.split(','))
+
+    def test_failed_probe_of_several_emails_fetches_them(self):
+        emails = list(self.processor.fetch_emails_bulk(['101', '102', '103']))
+        
+        self.assertEqual([email_data['id'] for email_data in emails], ['101', '102', '103'])
+        self.assertEqual([email_data['subject'] for email_data in emails], ['Email 101', 'Email 102', 'Email 103'])
+        # The probe is not retried one email at a time
+        probes = [uid_set for uid_set, items in self.commands if STRUCTURE_FETCH_ITEMS in items]
+        self.assertEqual(probes, ['101,102,103'])
+
+    def test_failed_probe_of_one_email_fetches_it(self):
+        emails = list(self.processor.fetch_emails_bulk(['101']))
+        
+        self.assertEqual([email_data['id'] for email_data in emails], ['101'])
+
+    def test_failed_fetch_is_retried_one_by_one(self):
+        self.failing.add(('101,102', self.processor._fetch_items()))
+        self.failing.add(('102', self.processor._fetch_items()))
+        
+        emails = list(self.processor.fetch_emails_bulk(['101', '102']))
+        
+        self.assertEqual([email_data['id'] for email_data in emails], ['101'])
+
+    def test_fetch_messages_returns_none_when_every_fetch_fails(self):
+        items = self.processor._fetch_items()
+        for uid_set in ('101,102', '101', '102'):
+            self.failing.add((uid_set, items))
+        
+        self.assertIsNone(self.processor._fetch_messages(['101', '102'], items))
+
+
+if __name__ == '__main__':
+    unittest.main()